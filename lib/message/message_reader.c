@@ -1,6 +1,7 @@
 /** \author Michael Krieger */
 
 #include <stdlib.h>
+#include <string.h>
 #include "message.h"
 #include "message_reader.h"
 
@@ -9,7 +10,6 @@
 struct msg_item;
 struct msg_queue;
 static void msg_queue_init(struct msg_queue *q);
-static void msg_queue_clear(struct msg_queue *q);
 static void msg_queue_append(struct msg_queue *q, struct msg_item *t);
 static void msg_queue_extend(struct msg_queue *q, struct msg_queue *r);
 static struct msg_item *msg_queue_pop(struct msg_queue *q);
@@ -33,15 +33,6 @@ void msg_queue_init(struct msg_queue *q)
     q->end = NULL;
 }
 
-void msg_queue_clear(struct msg_queue *q)
-{
-    struct msg_item *t;
-    while ((t = msg_queue_pop(q))) {
-        message_delete(t->msg);
-        free(t);
-    }
-}
-
 void msg_queue_append(struct msg_queue *q, struct msg_item *t)
 {
     t->next = NULL;
@@ -90,27 +81,60 @@ int msg_queue_is_empty(struct msg_queue *q)
 struct message_reader {
     struct msg_queue messages;
     Message *msg;
+    /* message pool (only used if capacity > 0) */
+    size_t capacity;
+    char *arena;              /* capacity message objects */
+    struct msg_item *items;   /* one item for each message of the arena */
+    struct msg_queue free;    /* items with unused messages */
 };
 
-static int reader_init(MessageReader *r);
+static int reader_init(MessageReader *r, size_t capacity);
+static int reader_owns(const MessageReader *r, const Message *m, size_t *i);
+static Message *reader_new_message(MessageReader *r);
+static struct msg_item *reader_new_item(MessageReader *r, Message *m);
+static void reader_free_item(MessageReader *r, struct msg_item *t);
+static void reader_clear(MessageReader *r, struct msg_queue *q);
 
 MessageReader *message_reader_new(void)
+{
+    return message_reader_new_pooled(0);
+}
+
+MessageReader *message_reader_new_pooled(size_t capacity)
 {
     MessageReader *r;
     if (!(r = malloc(sizeof *r))) {
         return NULL;
     }
-    if (!(reader_init(r) == 0)) {
+    if (!(reader_init(r, capacity) == 0)) {
         message_reader_delete(r);
         return NULL;
     }
     return r;
 }
 
-int reader_init(MessageReader *r)
+int reader_init(MessageReader *r, size_t capacity)
 {
     msg_queue_init(&r->messages);
-    if (!(r->msg = message_new())) {
+    msg_queue_init(&r->free);
+    r->msg = NULL;
+    r->capacity = 0;
+    r->arena = NULL;
+    r->items = NULL;
+    if (capacity) {
+        size_t size = message_size();
+        if (!(r->arena = malloc(capacity * size))) { return 1; }
+        if (!(r->items = malloc(capacity * sizeof *r->items))) { return 1; }
+        r->capacity = capacity;
+        size_t i;
+        for (i = 0; i < capacity; i++) {
+            Message *m = (Message *)(r->arena + i*size);
+            message_init(m);
+            r->items[i].msg = m;
+            msg_queue_append(&r->free, &r->items[i]);
+        }
+    }
+    if (!(r->msg = reader_new_message(r))) {
         return 1;
     }
     return 0;
@@ -118,16 +142,22 @@ int reader_init(MessageReader *r)
 
 void message_reader_delete(MessageReader *r)
 {
-    msg_queue_clear(&r->messages);
+    reader_clear(r, &r->messages);
     if (r->msg) {
-        message_delete(r->msg);
+        message_reader_release(r, r->msg);
     }
+    size_t i;
+    for (i = 0; i < r->capacity; i++) {
+        message_reset(r->items[i].msg); /* free the samples */
+    }
+    free(r->items);
+    free(r->arena);
     free(r);
 }
 
 void message_reader_reset(MessageReader *r)
 {
-    msg_queue_clear(&r->messages);
+    reader_clear(r, &r->messages);
     if (r->msg) {
         message_reset(r->msg);
     }
@@ -139,6 +169,7 @@ int message_reader_add_buffer(MessageReader *r, const uint16_t *buf, size_t len)
     msg_queue_init(&q);
 
     Message *m = r->msg;
+    struct msg_item *t;
 
     size_t pos = 0;
     while (1) {
@@ -152,12 +183,10 @@ int message_reader_add_buffer(MessageReader *r, const uint16_t *buf, size_t len)
            of the current iteration, we will then break. */
         if (!(pos < len) && !(message_is_complete(m))) { break; }
 
-        struct msg_item *t;
-        if (!(t = malloc(sizeof *t))) { goto abort; }
-        t->msg = m;
+        if (!(t = reader_new_item(r, m))) { goto abort; }
         msg_queue_append(&q, t);
 
-        if (!(m = message_new())) { goto abort; }
+        if (!(m = reader_new_message(r))) { goto abort; }
     }
 
     r->msg = m;
@@ -166,7 +195,14 @@ int message_reader_add_buffer(MessageReader *r, const uint16_t *buf, size_t len)
     return 0;
 
 abort:
-    msg_queue_clear(&q);
+    if (m && m != r->msg) {
+        message_reader_release(r, m);
+    }
+    /* the first item (if any) contains r->msg, which is kept */
+    if ((t = msg_queue_pop(&q)) && !reader_owns(r, t->msg, NULL)) {
+        free(t);
+    }
+    reader_clear(r, &q);
     return 1;
 }
 
@@ -175,6 +211,109 @@ Message *message_reader_get_message(MessageReader *r)
     struct msg_item *t = msg_queue_pop(&r->messages);
     if (!t) { return NULL; }
     Message *m = t->msg;
-    free(t);
+    if (!reader_owns(r, m, NULL)) {
+        free(t);
+    }
     return m;
 }
+
+size_t message_reader_get_messages(MessageReader *r, Message **out, size_t max)
+{
+    size_t n = 0;
+    Message *m;
+    while (n < max && (m = message_reader_get_message(r))) {
+        out[n++] = m;
+    }
+    return n;
+}
+
+size_t message_reader_get_columns(MessageReader *r, MessageColumns *c, size_t max)
+{
+    size_t n = 0;
+    struct msg_item *t;
+    while (n < max && (t = msg_queue_pop(&r->messages))) {
+        Message *m = t->msg;
+        int hit = message_is_hit(m);
+        if (c->hit) { c->hit[n] = hit; }
+        if (c->group_id) { c->group_id[n] = message_get_group_id(m); }
+        if (c->channel_id) { c->channel_id[n] = message_get_channel_id(m); }
+        if (c->timestamp) { c->timestamp[n] = message_get_timestamp(m); }
+        if (c->hit_type) { c->hit_type[n] = message_get_hit_type(m); }
+        if (c->stop_type) { c->stop_type[n] = message_get_stop_type(m); }
+        if (c->num_samples || c->samples) {
+            size_t k = 0;
+            int16_t *s;
+            if (hit && (s = message_get_samples(m))) {
+                k = message_get_num_samples(m);
+                if (k > c->max_samples) { k = c->max_samples; }
+                if (c->samples) {
+                    memcpy(c->samples + n*c->max_samples, s, k * sizeof *s);
+                }
+            }
+            if (c->num_samples) { c->num_samples[n] = k; }
+        }
+        reader_free_item(r, t);
+        n++;
+    }
+    return n;
+}
+
+void message_reader_release(MessageReader *r, Message *m)
+{
+    size_t i;
+    if (reader_owns(r, m, &i)) {
+        reader_free_item(r, &r->items[i]);
+    } else {
+        message_delete(m);
+    }
+}
+
+/*------------------------------------------------------------------*/
+
+int reader_owns(const MessageReader *r, const Message *m, size_t *i)
+{
+    const char *p = (const char *)m;
+    if (!(r->arena && p >= r->arena)) { return 0; }
+    size_t k = (p - r->arena) / message_size();
+    if (!(k < r->capacity)) { return 0; }
+    if (i) { *i = k; }
+    return 1;
+}
+
+Message *reader_new_message(MessageReader *r)
+{
+    struct msg_item *t = msg_queue_pop(&r->free);
+    return t ? t->msg : message_new();
+}
+
+struct msg_item *reader_new_item(MessageReader *r, Message *m)
+{
+    size_t i;
+    if (reader_owns(r, m, &i)) {
+        return &r->items[i];
+    }
+    struct msg_item *t;
+    if ((t = malloc(sizeof *t))) {
+        t->msg = m;
+    }
+    return t;
+}
+
+void reader_free_item(MessageReader *r, struct msg_item *t)
+{
+    if (reader_owns(r, t->msg, NULL)) {
+        message_reset(t->msg);
+        msg_queue_append(&r->free, t);
+    } else {
+        message_delete(t->msg);
+        free(t);
+    }
+}
+
+void reader_clear(MessageReader *r, struct msg_queue *q)
+{
+    struct msg_item *t;
+    while ((t = msg_queue_pop(q))) {
+        reader_free_item(r, t);
+    }
+}
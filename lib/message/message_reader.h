@@ -10,7 +10,12 @@
  *
  * All functions receiving a pointer to a ::MessageReader object assume
  * that it has been properly allocated and initialized (by
- * message_reader_new()).
+ * message_reader_new() or message_reader_new_pooled()).
+ *
+ * For high message rates, a pooled message reader takes the message
+ * objects from a preallocated arena instead of allocating each one
+ * separately, and many messages can be retrieved at once using
+ * message_reader_get_messages() or message_reader_get_columns().
  */
 
 #ifndef SPADIC_MESSAGE_READER_H
@@ -40,17 +45,49 @@ typedef struct message_reader MessageReader;
  * Saves the state of partially read messages across buffer boundaries.
  */
 
+typedef struct message_columns MessageColumns;
+/**<
+ * Caller-supplied arrays for message_reader_get_columns().
+ */
+struct message_columns {
+    uint8_t *hit;         /**< non-zero if the message is a hit (message_is_hit()) */
+    uint8_t *group_id;    /**< message_get_group_id() */
+    uint8_t *channel_id;  /**< message_get_channel_id() */
+    uint16_t *timestamp;  /**< message_get_timestamp() */
+    uint8_t *hit_type;    /**< message_get_hit_type() */
+    uint8_t *stop_type;   /**< message_get_stop_type() */
+    uint8_t *num_samples; /**< number of samples stored in `samples` */
+    int16_t *samples;     /**< `max_samples` values per message */
+    size_t max_samples;   /**< row length of `samples` */
+};
+
 MessageReader *message_reader_new(void);
 /**<
  * Allocate and initialize a new message reader.
  * \return Pointer to created message reader, `NULL` if unsuccessful.
  */
+MessageReader *message_reader_new_pooled(size_t capacity);
+/**<
+ * Allocate and initialize a new message reader with a pool of `capacity`
+ * message objects.
+ * \return Pointer to created message reader, `NULL` if unsuccessful.
+ *
+ * Messages retrieved from a pooled reader must be returned using
+ * message_reader_release() instead of message_delete(), so that they can
+ * be recycled. If all message objects of the pool are in use, additional
+ * ones are allocated separately (and deallocated when they are released).
+ *
+ * message_reader_new_pooled(0) is equivalent to message_reader_new().
+ */
 void message_reader_delete(MessageReader *r);
 /**<
  * Clean up and deallocate a message reader.
  *
  * All messages that have not yet been retrieved using
  * message_reader_get_message() will be lost.
+ *
+ * In case of a pooled reader, all retrieved messages must have been
+ * released before, because the pool is deallocated.
  */
 void message_reader_reset(MessageReader *r);
 /**<
@@ -86,5 +123,40 @@ Message *message_reader_get_message(MessageReader *r);
  *
  * The returned messages are always complete (message_is_complete()).
  */
+size_t message_reader_get_messages(MessageReader *r, Message **out, size_t max);
+/**<
+ * Retrieve up to `max` messages at once.
+ *
+ * \return The number `n` of messages written to `out`.
+ *
+ * `out` must have space for `max` pointers. The first `n` entries are
+ * filled in the same order as by repeated calls of
+ * message_reader_get_message().
+ */
+size_t message_reader_get_columns(MessageReader *r, MessageColumns *c, size_t max);
+/**<
+ * Retrieve up to `max` messages at once and copy their contents into the
+ * arrays of `c`.
+ *
+ * \return The number `n` of messages copied.
+ *
+ * Each non-`NULL` array of `c` must have space for `max` values (`samples`
+ * for `max` * `max_samples` values); `NULL` arrays are skipped. Row `i` of
+ * `samples` starts at `samples + i*max_samples` and contains the first
+ * `num_samples[i]` samples of message `i`. `num_samples[i]` is zero if the
+ * message is not a hit or the raw data is invalid. The other values are
+ * undefined if they are not available for the message type (see
+ * message.h).
+ *
+ * The messages are released by the reader, so this is the fastest way to
+ * read many messages from a pooled reader.
+ */
+void message_reader_release(MessageReader *r, Message *m);
+/**<
+ * Return a message retrieved from `r` when it is no longer needed.
+ *
+ * For pooled readers, the message object is recycled, otherwise this is
+ * the same as message_delete().
+ */
 
 #endif
@@ -5,6 +5,9 @@ pure Python wrapper around libmessage.so using ctypes
 import ctypes
 
 lib = ctypes.cdll.LoadLibrary('libmessage.so')
+# pointers must not be truncated to int on 64 bit systems
+lib.message_new.restype = ctypes.c_void_p
+lib.message_get_samples.restype = ctypes.c_void_p
 
 def as_array(words, dtype=ctypes.c_uint16):
     return (len(words) * dtype)(*words)
@@ -17,9 +20,10 @@ class Message(object):
     #---- create, destroy, fill ---------------------------
 
     def __init__(self, m=None):
-        self.m = m or lib.message_new()
-        if not self.m:
+        m = m or lib.message_new()
+        if not m:
             raise RuntimeError("could not create Message object")
+        self.m = ctypes.c_void_p(m)
 
     def __del__(self):
         try:
@@ -7,15 +7,52 @@ import ctypes
 lib = ctypes.cdll.LoadLibrary('libreader.so')
 from message_wrap import Message, as_array
 
+# pointers must not be truncated to int on 64 bit systems
+lib.message_reader_new.restype = ctypes.c_void_p
+lib.message_reader_new_pooled.restype = ctypes.c_void_p
+lib.message_reader_get_message.restype = ctypes.c_void_p
+lib.message_reader_get_messages.restype = ctypes.c_size_t
+lib.message_reader_get_columns.restype = ctypes.c_size_t
+
+class MessageColumns(ctypes.Structure):
+    _fields_ = [
+        ('hit',         ctypes.POINTER(ctypes.c_uint8)),
+        ('group_id',    ctypes.POINTER(ctypes.c_uint8)),
+        ('channel_id',  ctypes.POINTER(ctypes.c_uint8)),
+        ('timestamp',   ctypes.POINTER(ctypes.c_uint16)),
+        ('hit_type',    ctypes.POINTER(ctypes.c_uint8)),
+        ('stop_type',   ctypes.POINTER(ctypes.c_uint8)),
+        ('num_samples', ctypes.POINTER(ctypes.c_uint8)),
+        ('samples',     ctypes.POINTER(ctypes.c_int16)),
+        ('max_samples', ctypes.c_size_t),
+    ]
+
+class PooledMessage(Message):
+    """
+    Message retrieved from a pooled MessageReader, which is given back to
+    the reader instead of being deleted.
+    """
+    def __init__(self, m, reader):
+        Message.__init__(self, m)
+        self.reader = reader # must outlive the message
+
+    def __del__(self):
+        try:
+            lib.message_reader_release(self.reader.r, self.m)
+        except AttributeError:
+            pass # lib was already garbage collected
+
 class MessageReader:
     """
     Straightforward mapping of C API to Python class.
     """
 
-    def __init__(self, r=None):
-        self.r = r or lib.message_reader_new()
-        if not self.r:
+    def __init__(self, r=None, capacity=0):
+        r = r or lib.message_reader_new_pooled(ctypes.c_size_t(capacity))
+        if not r:
             raise RuntimeError("could not create MessageReader object")
+        self.r = ctypes.c_void_p(r)
+        self.pooled = capacity > 0
 
     def __del__(self):
         try:
@@ -28,11 +65,35 @@ class MessageReader:
 
     def add_buffer(self, buf):
         a = as_array(buf)
-        n = len(buf)
+        n = ctypes.c_size_t(len(buf))
         fail = lib.message_reader_add_buffer(self.r, a, n)
         if fail:
             raise RuntimeError("could not add buffer")
 
+    def _message(self, m):
+        return PooledMessage(m, self) if self.pooled else Message(m)
+
     def get_message(self):
         m = lib.message_reader_get_message(self.r)
-        return Message(m) if m else None
+        return self._message(m) if m else None
+
+    def get_messages(self, max_messages):
+        out = (max_messages * ctypes.c_void_p)()
+        n = lib.message_reader_get_messages(self.r, out,
+                                            ctypes.c_size_t(max_messages))
+        return [self._message(m) for m in out[:n]]
+
+    def get_columns(self, max_messages, max_samples=32):
+        columns = {name: (max_messages * t._type_)()
+                   for (name, t) in MessageColumns._fields_[:-2]}
+        columns['samples'] = (max_messages * max_samples * ctypes.c_int16)()
+        c = MessageColumns(max_samples=max_samples, **{name:
+            ctypes.cast(a, t) for (name, t) in MessageColumns._fields_[:-1]
+            for a in [columns[name]]})
+        n = lib.message_reader_get_columns(self.r, ctypes.byref(c),
+                                           ctypes.c_size_t(max_messages))
+        result = {name: list(a[:n]) for (name, a) in columns.items()}
+        s = columns['samples']
+        result['samples'] = [list(s[i*max_samples:i*max_samples+k])
+                             for (i, k) in enumerate(result['num_samples'])]
+        return result
@@ -7,8 +7,8 @@ from reader_wrap import MessageReader
 #---- helpers -------------------------------------------------------
 
 class MessageIterator:
-    def __init__(self):
-        self.r = MessageReader()
+    def __init__(self, capacity=0):
+        self.r = MessageReader(capacity=capacity)
 
     def __call__(self, buf):
         self.r.add_buffer(buf)
@@ -24,8 +24,10 @@ def split_at(n, words):
 #--------------------------------------------------------------------
 
 class MessageIterBase(unittest.TestCase):
+    capacity = 0
+
     def setUp(self):
-        self.it = MessageIterator()
+        self.it = MessageIterator(self.capacity)
         self.words = [[
             0x8987,
             0x9654,
@@ -83,5 +85,57 @@ class MessageIterAppend(MessageIterBase):
         MessageIterBase.setUp(self)
         self.words.append([0x9000, 0xA000])
 
+#---- pooled reader -------------------------------------------------
+
+class MessageIterPooled(MessageIterBase):
+    capacity = 16
+
+class MessageIterPoolExhausted(MessageIterJoined):
+    capacity = 1
+
+class MessageBulkBase(unittest.TestCase):
+    capacity = 0
+
+    def setUp(self):
+        self.r = MessageReader(capacity=self.capacity)
+        self.words = [
+            0x8987, 0x9654, 0xA010, 0xB075,         # hit
+            0x8000, 0x9000, 0xD123,                 # epoch marker
+            0x8ABC, 0x9DEF, 0xA020, 0x0600, 0xB0A3, # hit
+        ] * 3
+
+    def test_get_messages(self):
+        self.r.add_buffer(self.words)
+        messages = self.r.get_messages(4) + self.r.get_messages(100)
+        self.assertEqual(len(messages), 9)
+        self.assertEqual([m.is_hit for m in messages], [True, False, True]*3)
+        self.assertEqual(messages[3].timestamp, 0x654)
+        self.assertEqual(messages[5].samples, [4, 3])
+        self.assertEqual(self.r.get_messages(100), [])
+
+    def test_get_columns(self):
+        self.r.add_buffer(self.words)
+        c = self.r.get_columns(5, max_samples=2)
+        self.assertEqual(c['hit'], [1, 0, 1, 1, 0])
+        self.assertEqual(c['channel_id'][2], 0xC)
+        self.assertEqual(c['timestamp'][3], 0x654)
+        self.assertEqual(c['num_samples'], [1, 0, 2, 1, 0])
+        self.assertEqual(c['samples'], [[2], [], [4, 3], [2], []])
+        c = self.r.get_columns(100, max_samples=1)
+        self.assertEqual(c['samples'], [[4], [2], [], [4]])
+        self.assertEqual(self.r.get_columns(100)['hit'], [])
+
+    def test_reuse(self):
+        for i in range(10):
+            self.r.add_buffer(self.words)
+            self.assertEqual(len(self.r.get_columns(100)['hit']), 9)
+        self.r.add_buffer(self.words[:6])
+        self.r.reset()
+        self.r.add_buffer(self.words)
+        self.assertEqual(len(self.r.get_messages(100)), 9)
+
+class MessageBulkPooled(MessageBulkBase):
+    capacity = 4
+
 if __name__=='__main__':
     unittest.main()
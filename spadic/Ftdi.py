@@ -90,8 +90,36 @@ USB_ERROR_CODE = {
 # libFTDI documentation:
 # http://www.intra2net.com/en/developer/libftdi/documentation/group__libftdi.html
 
+def list_devices(VID=0x0403, PID=0x6010):
+    """Return a list of (manufacturer, description, serial) tuples of the
+    connected FTDI devices with the given vendor and product ID."""
+    context = ftdi.new()
+    try:
+        code, devlist = ftdi.usb_find_all(context, VID, PID)
+        if code < 0:
+            raise IOError('Could not list USB devices (error code %i: %s)'
+                          % (code, USB_ERROR_CODE.get(code, 'unknown')))
+        devices = []
+        node = devlist
+        while node:
+            code, manufacturer, description, serial = ftdi.usb_get_strings(
+                context, node.dev)
+            if code == 0:
+                devices.append((manufacturer, description, serial))
+            node = node.next
+        ftdi.list_free(devlist)
+        return devices
+    finally:
+        ftdi.free(context)
+
+
 class Ftdi:
-    """Wrapper for simple FTDI communication."""
+    """Wrapper for simple FTDI communication.
+
+    If several devices with the same vendor and product ID are connected,
+    one of them can be selected by its serial number or by its USB bus path
+    ('<bus>/<device>', e.g. '003/007', see lsusb).
+    """
 
     from .util import log as _log
     def _debug(self, *text):
@@ -100,17 +128,26 @@ class Ftdi:
     #----------------------------------------------------------------
     # connection management methods
     #----------------------------------------------------------------
-    def __init__(self, VID=0x0403, PID=0x6010):
+    def __init__(self, VID=0x0403, PID=0x6010, serial=None, device=None):
         """Prepare, but don't initialize FTDI context."""
         self._VID = VID
         self._PID = PID
+        self._serial = serial
+        self._device = device
         self._context = None
         self._debug('init')
 
     def __enter__(self):
         """Open USB connection and initialize FTDI context."""
         context = ftdi.new()
-        if not ftdi.usb_open(context, self._VID, self._PID) == 0:
+        if self._device is not None:
+            code = ftdi.usb_open_string(context, 'd:' + self._device)
+        elif self._serial is not None:
+            code = ftdi.usb_open_desc(context, self._VID, self._PID,
+                                      None, self._serial)
+        else:
+            code = ftdi.usb_open(context, self._VID, self._PID)
+        if not code == 0:
             ftdi.free(context)
             raise IOError('Could not open USB connection.')
         if not ftdi.set_bitmode(context, 0, ftdi.BITMODE_SYNCFF) == 0:
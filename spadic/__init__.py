@@ -6,19 +6,26 @@ __all__ = []
 # imported without them.
 try:
     from .main import Spadic
-    from .server import SpadicServer
+    from .server import SpadicServer, SpadicMultiServer
+    from .Ftdi import list_devices
     del main
     del server
-    __all__ += ['Spadic', 'SpadicServer']
+    __all__ += ['Spadic', 'SpadicServer', 'SpadicMultiServer', 'list_devices']
 except ImportError:
     pass
 
 # Move the clients from their module namespace to the top-level spadic
 # package namespace. They don't need libFTDI and will be available in any
 # case.
-from .client import SpadicControlClient, SpadicDataClient
+from .client import (SpadicControlClient, SpadicDataClient,
+                     SpadicMetricsClient, SpadicDirectoryClient)
 del client
-__all__ += ['SpadicControlClient', 'SpadicDataClient']
+__all__ += ['SpadicControlClient', 'SpadicDataClient', 'SpadicMetricsClient',
+            'SpadicDirectoryClient']
+
+from .fleet import SpadicFleet
+del fleet
+__all__ += ['SpadicFleet']
 
 __version__ = '1.1.8'
 
@@ -6,10 +6,11 @@ import threading
 import time
 import queue
 
-from .util import IndexQueue
+from . import metrics
+from .util import IndexQueue, OverflowQueue
 from .control import SpadicController
 from .control.ui import SpadicControlUI
-from .message import _MessageSplitter, Message
+from .message import _MessageSplitter, _count_dropped, Message
 from .registerfile import SpadicRegisterFile
 from .server_ports import PORT_BASE, PORT_OFFSET
 from .shiftregister import SPADIC_SR
@@ -17,11 +18,11 @@ from .shiftregister import SPADIC_SR
 
 # inheritance tree:
 # 
-# BaseClient-----------------
-# \                          \
-#  BaseReceiveClient-----     SpadicCmdClient
-#  \                     \
-#   BaseRegisterClient    SpadicDataClient
+# BaseClient-----------------------------------------
+# \                          \                       \
+#  BaseReceiveClient-----     SpadicCmdClient         SpadicMetricsClient
+#  \                     \                            \
+#   BaseRegisterClient    SpadicDataClient             SpadicDirectoryClient
 #   \               \
 #    SpadicRFClient  SpadicSRClient
 
@@ -74,6 +75,11 @@ class BaseRegisterClient(BaseReceiveClient):
         self._cache.update({name: (value, time.time()+self._expires)
                             for (name, value) in register_values.items()})
 
+    def clear_cache(self):
+        """Forget the cached values, so that they are read from the server
+        again, e.g. to verify written values."""
+        self._cache.clear()
+
     def write_registers(self, register_values):
         """
         Write registers.
@@ -144,6 +150,43 @@ class SpadicCmdClient(BaseClient):
 
 #--------------------------------------------------------------------
 
+class SpadicMetricsClient(BaseClient):
+    """Client for the metrics part of the SpadicServer."""
+    port_offset = PORT_OFFSET["METRICS"]
+
+    def __init__(self, server_address, port_base=None):
+        BaseClient.__init__(self)
+        self._buf = b''
+        self.connect(server_address, port_base)
+
+    def read(self, prefix=''):
+        """Return a dictionary with the current values of all metrics of the
+        server whose name starts with the given prefix."""
+        self.socket.sendall(bytes(
+            json.dumps(prefix) + '\n',
+            'utf-8'))
+        while not b'\n' in self._buf:
+            received = self.socket.recv(4096)
+            if not received:
+                raise IOError("connection to metrics server lost")
+            self._buf += received
+        line, _, self._buf = self._buf.partition(b'\n')
+        return json.loads(str(line, 'utf-8'))
+
+class SpadicDirectoryClient(SpadicMetricsClient):
+    """Client for the directory of a SpadicMultiServer."""
+    port_offset = PORT_OFFSET["DIRECTORY"]
+
+    def chips(self):
+        """Return a dictionary {device: port_base} of all served chips.
+
+        The port base can be used for the other clients, e.g.
+        SpadicControlClient(host, port_base).
+        """
+        return self.read()
+
+#--------------------------------------------------------------------
+
 class SpadicControlClient:
     """Client for the RF/SR/Cmd parts of the SpadicServer."""
 
@@ -166,6 +209,16 @@ class SpadicControlClient:
                     return client.read_registers([name])[name]
                 return read
             return read_gen
+        def gen_write_many(client):
+            def write_many(operations):
+                client.write_registers({name: value
+                    for (name, addr, value) in operations})
+            return write_many
+        def gen_read_many(client):
+            def read_many(registers):
+                return client.read_registers([name
+                    for (name, addr) in registers])
+            return read_many
 
         self.rf_client.connect(server_address, port_base)
         self.sr_client.connect(server_address, port_base)
@@ -180,10 +233,14 @@ class SpadicControlClient:
         self._registerfile = SpadicRegisterFile(
                                  gen_write_gen(self.rf_client),
                                  gen_read_gen(self.rf_client),
-                                 use_cache=False)
+                                 use_cache=False,
+                                 write_many=gen_write_many(self.rf_client),
+                                 read_many=gen_read_many(self.rf_client))
 
         # The shiftregister actually behaves like the registerfile here,
         # we only have to override the default register map using SPADIC_SR.
+        # Entries written in one batch result in one shift register write
+        # operation on the server.
         # format: {name: (address, size), ...}, (address not used here)
         sr_map = {name: (0, len(bits))
                   for (name, bits) in SPADIC_SR.items()}
@@ -191,7 +248,9 @@ class SpadicControlClient:
                                   gen_write_gen(self.sr_client),
                                   gen_read_gen(self.sr_client),
                                   register_map=sr_map,
-                                  use_cache=False)
+                                  use_cache=False,
+                                  write_many=gen_write_many(self.sr_client),
+                                  read_many=gen_read_many(self.sr_client))
 
         # this is exactly like in main.Spadic
         self.control = SpadicController(self._registerfile,
@@ -221,31 +280,77 @@ class SpadicControlClient:
 #--------------------------------------------------------------------
 
 class SpadicDataClient(BaseReceiveClient):
-    def __init__(self, group, server_address, port_base=None):
+    """Client for one of the data readout parts of the SpadicServer.
+
+    At most `queue_size` messages (0 means unlimited) are kept until they
+    are read. If more messages arrive, they are handled according to the
+    `overflow` policy (see util.OverflowQueue). By default, receiving
+    stops until there is space again, which eventually makes the server
+    discard messages.
+    """
+    def __init__(self, group, server_address, port_base=None,
+                       queue_size=2**16, overflow='block'):
         BaseReceiveClient.__init__(self)
-        self._recv_queue = queue.Queue()
-        self._splitter = _MessageSplitter()
 
         if not group in 'aAbB':
             raise ValueError
         g = group.upper()
+
+        m = metrics.registry.labelled(stage='client', lane=g,
+                                      host=server_address)
+        self._recv_queue = OverflowQueue(queue_size, overflow,
+                                         m.counter('queue_overflows').inc,
+                                         _count_dropped(m, 'AB'.index(g)))
+        self._splitter = _MessageSplitter(m)
+        self._messages = m.counter('messages')
+        self._bytes_received = m.counter('bytes_received')
+        self._latency = m.histogram('message_queue_latency_seconds')
+        m.gauge('message_queue_depth', self._recv_queue.qsize)
+
         self.port_offset = PORT_OFFSET["DATA_%s"%g]
         self.connect(server_address, port_base)
 
     def read_message(self, timeout=1, raw=False):
         try:
-            data = self._recv_queue.get(timeout=timeout)
+            t, data = self._recv_queue.get(timeout=timeout)
         except queue.Empty:
             return None
+        self._latency.observe(time.time() - t)
         return (data if raw else Message(data))
 
+    def read_messages(self, max_messages=None, timeout=1):
+        """Return a list of all messages received so far (at most
+        max_messages), as lists of words.
+
+        Wait up to timeout seconds for the first message, return an empty
+        list if there was none.
+        """
+        result = []
+        try:
+            t, data = self._recv_queue.get(timeout=timeout)
+            now = time.time()
+            while True:
+                self._latency.observe(now - t)
+                result.append(data)
+                if max_messages is not None and len(result) >= max_messages:
+                    break
+                t, data = self._recv_queue.get(block=False)
+        except queue.Empty:
+            pass
+        return result
+
     def _recv_job(self):
         while not self._stop.is_set():
             try:
                 received = self.socket.recv(1024)
             except socket.timeout:
                 continue
+            self._bytes_received.inc(len(received))
             words = struct.unpack('!' + str(len(received) // 2) + 'H', received)
+            t = time.time()
+            n = 0
             for m in self._splitter(words):
-                self._recv_queue.put(m)
+                self._recv_queue.put((t, m))
+                n += 1
+            self._messages.inc(n)
 
@@ -1,5 +1,7 @@
 from .spadic_controller import SpadicController
+from .base import ConfigSnapshot
+from .config import ConfigDiff
+from .store import ConfigStore
 del spadic_controller
 
-__all__ = ['SpadicController']
-
+__all__ = ['SpadicController', 'ConfigSnapshot', 'ConfigDiff', 'ConfigStore']
@@ -63,14 +63,15 @@ class AdcBias(ControlUnitBase):
         self._shiftregister['VPAmp'].apply()
         self._shiftregister['baselineTrimN'].apply()
 
-    def update(self):
-        self._vndel = self._shiftregister['VNDel'].read()
-        self._vpdel = self._shiftregister['VPDel'].read()
-        self._vploadfb = self._shiftregister['VPLoadFB'].read()
-        self._vploadfb2 = self._shiftregister['VPLoadFB2'].read()
-        self._vpfb = self._shiftregister['VPFB'].read()
-        self._vpamp = self._shiftregister['VPAmp'].read()
-        self._baseline = self._shiftregister['baselineTrimN'].read()
+    def update(self, snapshot=None):
+        sr = snapshot_values(self._shiftregister, snapshot, 'sr')
+        self._vndel = sr['VNDel']
+        self._vpdel = sr['VPDel']
+        self._vploadfb = sr['VPLoadFB']
+        self._vploadfb2 = sr['VPLoadFB2']
+        self._vpfb = sr['VPFB']
+        self._vpamp = sr['VPAmp']
+        self._baseline = sr['baselineTrimN']
 
     def get(self):
         return {'vndel': self._vndel,
@@ -1,3 +1,5 @@
+import types
+
 def onoff(value):
     return 'ON' if value else 'OFF'
 
@@ -7,6 +9,30 @@ def checkvalue(v, vmin, vmax, name):
                          (name, vmin, vmax))
 
 
+class ConfigSnapshot:
+    """Register values of the register file (rf) and shift register (sr)
+    at one point in time, as read-only dictionaries {name: value}."""
+    def __init__(self, rf, sr):
+        self.rf = types.MappingProxyType(dict(rf))
+        self.sr = types.MappingProxyType(dict(sr))
+
+class _RegisterReader:
+    """Read registers one by one when their values are accessed."""
+    def __init__(self, registers):
+        self._registers = registers
+
+    def __getitem__(self, name):
+        return self._registers[name].read()
+
+def snapshot_values(registers, snapshot, part):
+    """Return the values used by the update method of a control unit: the
+    given part ('rf' or 'sr') of the snapshot, or, without snapshot, the
+    values read from the registers."""
+    if snapshot is None:
+        return _RegisterReader(registers)
+    return getattr(snapshot, part)
+
+
 class ControlUnitBase:
     def write(self, *args, **kwargs):
         self.set(*args, **kwargs)
@@ -15,4 +41,3 @@ class ControlUnitBase:
     def read(self):
         self.update()
         return self.get()
-
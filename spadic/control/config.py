@@ -0,0 +1,114 @@
+"""
+Configuration files and comparison of configurations.
+
+A configuration consists of register file (RF) and shift register (SR)
+values, see base.ConfigSnapshot. Configuration files (.spc, optionally
+gzip compressed) contain one line per register with its name and value,
+the RF and SR parts start with the lines '# Register file' and '# Shift
+register', respectively.
+"""
+
+import gzip
+
+from .base import ConfigSnapshot
+
+
+def parse_spc(lines):
+    """
+    Parse the lines of a configuration file.
+
+    Return a ConfigSnapshot, which contains only the registers present in
+    the file.
+
+    >>> c = parse_spc(['# Register file', 'threshold1  0x0C8',
+    ...                '# Shift register', 'VNDel  42  # comment'])
+    >>> dict(c.rf), dict(c.sr)
+    ({'threshold1': 200}, {'VNDel': 42})
+    """
+    mode = None
+    values = {'RF': {}, 'SR': {}}
+    for line in lines:
+        if '# Register file' in line:
+            mode = 'RF'
+        elif '# Shift register' in line:
+            mode = 'SR'
+        else:
+            if not mode:
+                continue
+            content = line.partition('#')[0]
+            if content.strip():
+                [name, value_str] = content.split()
+                values[mode][name] = int(value_str, 0)
+    return ConfigSnapshot(values['RF'], values['SR'])
+
+def format_spc(snapshot, sizes):
+    """
+    Return the text of a configuration file with the values of the
+    snapshot. sizes is a dictionary {name: number of bits} used for the
+    number format.
+
+    >>> print(format_spc(ConfigSnapshot({'threshold1': 200}, {'VNDel': 1}),
+    ...                  {'threshold1': 9, 'VNDel': 1}))
+    # Register file
+    threshold1                 0x0C8
+    # Shift register
+    VNDel                          1
+    """
+    def fmtnumber(n, sz):
+        if sz == 1:
+            fmt = '{0}'
+        else:
+            nhex = sz//4 + (1 if sz%4 else 0)
+            fmt = '0x{:0'+str(nhex)+'X}'
+        return fmt.format(n).rjust(6)
+    lines = ['# Register file']
+    lines += sorted((name.ljust(25) + ' ' + fmtnumber(value, sizes[name])
+                     for (name, value) in snapshot.rf.items()), key=str.lower)
+    lines.append('# Shift register')
+    lines += sorted((name.ljust(25) + ' ' + fmtnumber(value, sizes[name])
+                     for (name, value) in snapshot.sr.items()), key=str.lower)
+    return '\n'.join(lines)
+
+def read_spc(filename):
+    """Read a configuration file (gzip compressed if the name ends with
+    .gz) and return a ConfigSnapshot."""
+    fopen = gzip.open if filename.endswith('.gz') else open
+    with fopen(filename, 'rt') as f:
+        return parse_spc(f)
+
+
+class ConfigDiff:
+    """
+    Registers that differ between the current and the target configuration.
+
+    Only registers contained in the target are compared, registers missing
+    in the current configuration count as changed.
+
+    rf, sr: dictionaries {name: (current value, target value)}
+
+    >>> d = ConfigDiff(ConfigSnapshot({'a': 1, 'b': 2}, {'x': 0}),
+    ...                ConfigSnapshot({'a': 1, 'b': 3}, {'x': 5, 'y': 1}))
+    >>> len(d), d.rf
+    (3, {'b': (2, 3)})
+    >>> print(d)
+    b  2 -> 3
+    x  0 -> 5
+    y  None -> 1
+    """
+    def __init__(self, current, target):
+        self.rf = self._compare(current.rf, target.rf)
+        self.sr = self._compare(current.sr, target.sr)
+
+    @staticmethod
+    def _compare(current, target):
+        return {name: (current.get(name), value)
+                for (name, value) in target.items()
+                if current.get(name) != value}
+
+    def __len__(self):
+        return len(self.rf) + len(self.sr)
+
+    def __str__(self):
+        return '\n'.join('%s  %s -> %s' % (name, old, new)
+                         for part in [self.rf, self.sr]
+                         for (name, (old, new)) in sorted(part.items()))
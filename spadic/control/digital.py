@@ -43,17 +43,18 @@ class DigitalChannel(ControlUnitBase):
         self._registerfile['triggerMaskA'].apply()
         self._registerfile['triggerMaskB'].apply()
 
-    def update(self):
+    def update(self, snapshot=None):
+        rf = snapshot_values(self._registerfile, snapshot, 'rf')
         i = self._id % 16
 
         reg_disable = {0: 'disableChannelA',
                        1: 'disableChannelB'}[self._id//16]
-        dis = self._registerfile[reg_disable].read()
+        dis = rf[reg_disable]
         self._enable = (~dis >> i) & 1
 
         reg_trigger = {0: 'triggerMaskA',
                        1: 'triggerMaskB'}[self._id//16]
-        trig = self._registerfile[reg_trigger].read()
+        trig = rf[reg_trigger]
         self._entrigger = (trig >> i) & 1
 
     def get(self):
@@ -132,12 +133,13 @@ class NeighborMatrix(ControlUnitBase):
                     ({0: 'A', 1: 'B'}[self._group], i))
             self._registerfile[name].apply()
 
-    def update(self):
+    def update(self, snapshot=None):
+        rf = snapshot_values(self._registerfile, snapshot, 'rf')
         bits = []
         for i in range(31):
             name = ('neighborSelectMatrix%s_%i' % 
                     ({0: 'A', 1: 'B'}[self._group], i))
-            x = self._registerfile[name].read()
+            x = rf[name]
             bits += [(x >> i) & 1 for i in range(16)]
         for tgt in range(22):
             for src in range(22):
@@ -204,11 +206,11 @@ class Digital:
         for nb in self.neighbor.values():
             nb.apply()
 
-    def update(self):
+    def update(self, snapshot=None):
         for ch in self.channel:
-            ch.update()
+            ch.update(snapshot)
         for nb in self.neighbor.values():
-            nb.update()
+            nb.update(snapshot)
 
     def __str__(self):
         s = [('channel %2i: ' % ch._id) + str(ch) for ch in self.channel]
@@ -101,30 +101,31 @@ class Filter(ControlUnitBase):
         self._registerfile['offsetFilter'].apply()
         self._registerfile['scalingFilter'].apply()
 
-    def update(self):
-        ra_h = self._registerfile['aCoeffFilter_h'].read() 
-        ra_l = self._registerfile['aCoeffFilter_l'].read()
+    def update(self, snapshot=None):
+        rf = snapshot_values(self._registerfile, snapshot, 'rf')
+        ra_h = rf['aCoeffFilter_h'] 
+        ra_l = rf['aCoeffFilter_l']
         ra = (ra_h << 16) + ra_l
         for i in self._coeffa:
             # aCoeffFilter does not contain a value for stage 0 --> (i-1)
             a = (ra >> (6*(i-1))) & 0x3F
             self._coeffa[i] = (a if a < 32 else a-64)
 
-        rb_h = self._registerfile['bCoeffFilter_h'].read()
-        rb_l = self._registerfile['bCoeffFilter_l'].read()
+        rb_h = rf['bCoeffFilter_h']
+        rb_l = rf['bCoeffFilter_l']
         rb = (rb_h << 16) + rb_l
         for i in self._coeffb:
             b = (rb >> (6*i)) & 0x3F
             self._coeffb[i] = (b if b < 32 else b-64)
 
-        byp = self._registerfile['bypassFilterStage'].read()
+        byp = rf['bypassFilterStage']
         for i in self._enable:
             self._enable[i] = (~byp >> i) & 1
 
-        scaling = self._registerfile['scalingFilter'].read()
+        scaling = rf['scalingFilter']
         self._scaling = scaling if scaling < 256 else scaling-512
 
-        offset = self._registerfile['offsetFilter'].read()
+        offset = rf['offsetFilter']
         self._offset = offset if offset < 256 else offset-512
 
     def get(self):
@@ -53,13 +53,14 @@ class FrontendChannel(ControlUnitBase):
         self._shiftregister[self._reg_enablecsaN].apply()
         self._shiftregister[self._reg_enablecsaP].apply()
 
-    def update(self):
-        self._baseline = self._shiftregister[self._reg_baseline].read()
-        self._frontend = self._shiftregister[self._reg_frontend].read()
-        self._enableadc = self._shiftregister[self._reg_enableadc].read()
+    def update(self, snapshot=None):
+        sr = snapshot_values(self._shiftregister, snapshot, 'sr')
+        self._baseline = sr[self._reg_baseline]
+        self._frontend = sr[self._reg_frontend]
+        self._enableadc = sr[self._reg_enableadc]
         enamp = {0: self._reg_enablecsaN,
                  1: self._reg_enablecsaP}[self._frontend]
-        self._enablecsa = self._shiftregister[enamp].read()
+        self._enablecsa = sr[enamp]
 
     def get(self):
         return {'baseline': self._baseline,
@@ -156,18 +157,19 @@ class Frontend(ControlUnitBase):
         for ch in self.channel:
             ch.apply()
 
-    def update(self):
-        self._frontend = self._shiftregister['DecSelectNP'].read()
+    def update(self, snapshot=None):
+        sr = snapshot_values(self._shiftregister, snapshot, 'sr')
+        self._frontend = sr['DecSelectNP']
         fe ={0: 'N', 1: 'P'}[self._frontend] 
-        self._pcasc = self._shiftregister['pCasc'+fe].read()
-        self._ncasc = self._shiftregister['nCasc'+fe].read()
-        self._psourcebias = self._shiftregister['pSourceBias'+fe].read()
-        self._nsourcebias = self._shiftregister['nSourceBias'+fe].read()
+        self._pcasc = sr['pCasc'+fe]
+        self._ncasc = sr['nCasc'+fe]
+        self._psourcebias = sr['pSourceBias'+fe]
+        self._nsourcebias = sr['nSourceBias'+fe]
         xfb = {0: 'pFBN', 1: 'nFBP'}[self._frontend]
-        self._xfb = self._shiftregister[xfb].read()
+        self._xfb = sr[xfb]
 
         for ch in self.channel:
-            ch.update()
+            ch.update(snapshot)
 
     def get(self):
         return {'frontend': {0: 'N', 1: 'P'}[self._frontend],
@@ -81,21 +81,22 @@ class HitLogic(ControlUnitBase):
         self._registerfile['enableAnalogTrigger'].apply()
         self._registerfile['enableTriggerOutput'].apply()
 
-    def update(self):
-        mask_h = self._registerfile['selectMask_h'].read()
-        mask_l = self._registerfile['selectMask_l'].read()
+    def update(self, snapshot=None):
+        rf = snapshot_values(self._registerfile, snapshot, 'rf')
+        mask_h = rf['selectMask_h']
+        mask_l = rf['selectMask_l']
         self._mask = (mask_h << 16) + mask_l
 
-        self._window = self._registerfile['hitWindowLength'].read()
+        self._window = rf['hitWindowLength']
 
-        th1 = self._registerfile['threshold1'].read()
-        th2 = self._registerfile['threshold2'].read()
+        th1 = rf['threshold1']
+        th2 = rf['threshold2']
         self._threshold1 = th1 if th1 < 256 else th1-512
         self._threshold2 = th2 if th2 < 256 else th2-512
 
-        self._diffmode = self._registerfile['compDiffMode'].read()
-        self._analogtrigger = self._registerfile['enableAnalogTrigger'].read()
-        self._triggerout = self._registerfile['enableTriggerOutput'].read()
+        self._diffmode = rf['compDiffMode']
+        self._analogtrigger = rf['enableAnalogTrigger']
+        self._triggerout = rf['enableTriggerOutput']
 
     def get(self):
         return {'mask': self._mask,
@@ -24,8 +24,9 @@ class Led(ControlUnitBase):
     def apply(self):
         self._registerfile['overrides'].apply()
 
-    def update(self):
-        value = self._registerfile['overrides'].read()
+    def update(self, snapshot=None):
+        rf = snapshot_values(self._registerfile, snapshot, 'rf')
+        value = rf['overrides']
         self._userpin1 = (value & 0x10) >> 4
         self._userpin2 = (value & 0x20) >> 5
 
@@ -49,11 +49,12 @@ class Monitor(ControlUnitBase):
             self._shiftregister['enMonitorAdc_'+str(ch)].apply()
             self._shiftregister['ampToBus_'+str(ch)].apply()
 
-    def update(self):
-        self._source = self._shiftregister['SelMonitor'].read()
+    def update(self, snapshot=None):
+        sr = snapshot_values(self._shiftregister, snapshot, 'sr')
+        self._source = sr['SelMonitor']
         reg = {0: 'enMonitorAdc_', 1: 'ampToBus_'}[self._source]
         for ch in range(32):
-            en = self._shiftregister[reg+str(ch)].read()
+            en = sr[reg+str(ch)]
             if en:
                 self._channel = ch
                 break
@@ -1,6 +1,9 @@
+import contextlib
 import gzip
 import os
 
+from .base import ConfigSnapshot
+from .config import ConfigDiff, format_spc, parse_spc, read_spc
 from .led import Led
 from .hitlogic import HitLogic
 from .filter import Filter
@@ -37,10 +40,19 @@ class SpadicController:
     and documentation about the hit logic settings is needed, type
       help(c.hitlogic)
 
+    Several settings can be changed in a transaction, then only the
+    changed registers are written at the end, and the shift register at
+    most once:
+      with c.transaction():
+          c.frontend.channel[0].write(baseline=64)
+          c.digital.channel[0].write(enable=1)
+
     """
     def __init__(self, registerfile, shiftregister, reset=0, load_file=None):
         self.registerfile = registerfile
         self.shiftregister = shiftregister
+        self._transactions = 0 # nesting level of transactions
+        self._aborted = False  # one of the nested transactions was aborted
 
         # add control units
         self._units = {}
@@ -64,7 +76,6 @@ class SpadicController:
             self.apply()
         if load_file:
             self.load(load_file)
-            self.update()
 
     def reset(self):
         """Reset all control units."""
@@ -73,16 +84,76 @@ class SpadicController:
 
     def apply(self):
         """Update register values from control units and write RF/SR."""
-        for unit in self._units.values():
-            unit.apply()
+        with self.transaction():
+            for unit in self._units.values():
+                unit.apply()
+
+    def begin(self):
+        """Start a transaction: defer all RF/SR write operations."""
+        if not self._transactions:
+            self.registerfile.begin()
+            self.shiftregister.begin()
+            self._aborted = False
+        self._transactions += 1
+
+    def commit(self):
+        """Finish a transaction: write all changed registers of the RF in
+        one batch, then the SR (if changed). Nested transactions are only
+        committed by the outermost one, nothing is written if one of them
+        was aborted."""
+        if not self._transactions:
+            raise RuntimeError('no transaction to commit')
+        self._transactions -= 1
+        if not self._transactions:
+            if self._aborted:
+                self.registerfile.abort()
+                self.shiftregister.abort()
+                snapshot = ConfigSnapshot(self.registerfile.get(),
+                                          self.shiftregister.get())
+                for unit in self._units.values():
+                    unit.update(snapshot)
+            else:
+                self.registerfile.commit()
+                self.shiftregister.commit()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Context manager for begin/commit.
+
+        If an exception occurs, nothing is written, also not by the
+        enclosing transactions. The RF/SR registers are restored to their
+        last written or read values and the control units are updated
+        accordingly.
+        """
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.abort()
+            raise
+        self.commit()
+
+    def abort(self):
+        """Finish a transaction without writing anything. The enclosing
+        transactions are finished without writing as well."""
+        if not self._transactions:
+            raise RuntimeError('no transaction to abort')
+        self._aborted = True
+        self.commit()
+
+    def snapshot(self):
+        """Read RF/SR (in one bulk operation each, if possible) and return
+        the register values as a ConfigSnapshot."""
+        self.registerfile.update()
+        self.shiftregister.update()
+        return ConfigSnapshot(self.registerfile.get(),
+                              self.shiftregister.get())
 
     def update(self):
         """Read RF/SR and update control units from register values."""
-        # do this first, it is faster
-        self.registerfile.update()
-        self.shiftregister.update()
+        snapshot = self.snapshot()
         for unit in self._units.values():
-            unit.update()
+            unit.update(snapshot)
 
     def __str__(self):
         return '\n\n'.join(frame(name)+'\n'+str(unit)
@@ -101,57 +172,68 @@ class SpadicController:
 
     def _save(self, f=None, nonzero=False):
         """Save the current configuration to a file."""
-        def fmtnumber(n, sz):
-            if sz == 1:
-                fmt = '{0}'
-            else:
-                nhex = sz//4 + (1 if sz%4 else 0)
-                fmt = '0x{:0'+str(nhex)+'X}'
-            return fmt.format(n).rjust(6)
-        lines = ['# Register file']
-        rflines = []
-        for name in self.registerfile:
-            ln = name.ljust(25) + ' '
-            sz = self.registerfile[name].size
-            ln += fmtnumber(self.registerfile[name].get(), sz)
-            rflines.append(ln)
-        lines += sorted(rflines, key=str.lower)
-        lines.append('# Shift register')
-        srlines = []
-        for name in self.shiftregister:
-            ln = name.ljust(25) + ' '
-            sz = self.shiftregister[name].size
-            ln += fmtnumber(self.shiftregister[name].get(), sz)
-            srlines.append(ln)
-        lines += sorted(srlines, key=str.lower)
-        print('\n'.join(lines), file=f)
+        snapshot = ConfigSnapshot(self.registerfile.get(),
+                                  self.shiftregister.get())
+        sizes = {name: registers[name].size
+                 for registers in [self.registerfile, self.shiftregister]
+                 for name in registers}
+        print(format_spc(snapshot, sizes), file=f)
 
     def load(self, filename):
-        fopen = gzip.open if filename.endswith('.gz') else open
-        with fopen(filename, 'rt') as f:
-            self._load(f)
+        """Load the configuration from a file (see configure)."""
+        return self.configure(read_spc(filename))
 
     def _load(self, f):
-        """Load the configuration from a file."""
-        mode = None
-        rf_values = {}
-        sr_values = {}
-        values = {'RF': rf_values, 'SR': sr_values}
-        for line in f:
-            if '# Register file' in line:
-                mode = 'RF'
-            elif '# Shift register' in line:
-                mode = 'SR'
+        """Load the configuration from a file object."""
+        return self.configure(parse_spc(f))
+
+    def configure(self, target):
+        """Bring RF/SR into the target configuration with minimal writes.
+
+        The target can be a ConfigSnapshot, the name of a configuration
+        file, or a dictionary {name: value} of RF and/or SR registers.
+        Registers not contained in the target are not changed.
+
+        The current values are read (in bulk) and only the registers that
+        differ are written, in one transaction. The control units are
+        updated without reading again.
+
+        Return a ConfigDiff with the changed registers.
+        """
+        target = self.as_snapshot(target)
+        current = self.snapshot()
+        diff = ConfigDiff(current, target)
+        with self.transaction():
+            for (name, (_, value)) in diff.rf.items():
+                self.registerfile[name].write(value)
+            for (name, (_, value)) in diff.sr.items():
+                self.shiftregister[name].write(value)
+        result = ConfigSnapshot(dict(current.rf, **target.rf),
+                                dict(current.sr, **target.sr))
+        for unit in self._units.values():
+            unit.update(result)
+        return diff
+
+    def diff(self, target):
+        """Return the ConfigDiff between the current configuration and the
+        target (see configure) without writing anything."""
+        return ConfigDiff(self.snapshot(), self.as_snapshot(target))
+
+    def as_snapshot(self, target):
+        """Return a ConfigSnapshot of a configuration given as snapshot,
+        name of a configuration file, or dictionary {name: value} of RF
+        and SR registers (KeyError if a name is unknown)."""
+        if isinstance(target, ConfigSnapshot):
+            return target
+        if isinstance(target, str):
+            return read_spc(target)
+        rf = {}
+        sr = {}
+        for (name, value) in target.items():
+            if name in self.registerfile:
+                rf[name] = value
+            elif name in self.shiftregister:
+                sr[name] = value
             else:
-                if not mode:
-                    continue
-                content = line.partition('#')[0]
-                if content.strip():
-                    [name, value_str] = content.split()
-                    value = int(value_str, 0)
-                    values[mode][name] = value
-        self.registerfile.set(rf_values)
-        self.shiftregister.set(sr_values)
-        self.registerfile.apply()
-        self.shiftregister.apply()
-
+                raise KeyError('unknown register: %s' % name)
+        return ConfigSnapshot(rf, sr)
@@ -0,0 +1,207 @@
+"""
+Local store of SPADIC configurations.
+
+Configurations are stored as compact binary images of the register file
+and the shift register, named by the SHA-1 hash of their content, so that
+each distinct configuration is only stored once. Every stored
+configuration is recorded in a history, and configurations can be tagged
+with names.
+
+Directory layout:
+
+    objects/<hash>   binary image (see encode)
+    history          one line per stored configuration: time, hash, message
+    tags             JSON dictionary {tag: hash}
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from ..registerfile import SPADIC_RF
+from ..shiftregister import SPADIC_SR
+from .base import ConfigSnapshot
+from .config import ConfigDiff, format_spc, read_spc
+
+DEFAULT_STORE = os.path.join(os.path.expanduser('~'), '.spadic', 'configs')
+
+IMAGE_HEADER = b'SPADICCFG\x01'
+_RF_NAMES = sorted(SPADIC_RF, key=lambda name: SPADIC_RF[name][0])
+_RF_SIZE = 2 * len(_RF_NAMES) # all registers have at most 16 bits
+_SR_SIZE = (max(p for pos in SPADIC_SR.values() for p in pos) + 8) // 8
+
+SIZES = dict([(name, size) for (name, (_, size)) in SPADIC_RF.items()] +
+             [(name, len(pos)) for (name, pos) in SPADIC_SR.items()])
+
+
+def encode(snapshot):
+    """
+    Return the binary image of a complete configuration: the RF values as
+    16 bit numbers in the order of their addresses, followed by the bits
+    of the SR at their positions (position 0 is the LSB of the first
+    byte), after a short header.
+
+    >>> s = ConfigSnapshot({name: 1 for name in SPADIC_RF},
+    ...                    {name: 0 for name in SPADIC_SR})
+    >>> image = encode(s)
+    >>> len(image), dict(decode(image).rf) == dict(s.rf)
+    (269, True)
+    """
+    rf = b''.join(snapshot.rf[name].to_bytes(2, 'little')
+                  for name in _RF_NAMES)
+    bits = 0
+    for (name, positions) in SPADIC_SR.items():
+        value = snapshot.sr[name]
+        n = len(positions)
+        for (i, p) in enumerate(positions): # MSB first
+            bits |= ((value >> (n-1-i)) & 1) << p
+    return IMAGE_HEADER + rf + bits.to_bytes(_SR_SIZE, 'little')
+
+def decode(image):
+    """Return the ConfigSnapshot of a binary image (see encode)."""
+    if not image.startswith(IMAGE_HEADER):
+        raise ValueError('not a configuration image')
+    data = image[len(IMAGE_HEADER):]
+    rf = {name: int.from_bytes(data[2*i:2*i+2], 'little')
+          for (i, name) in enumerate(_RF_NAMES)}
+    bits = int.from_bytes(data[_RF_SIZE:], 'little')
+    sr = {}
+    for (name, positions) in SPADIC_SR.items():
+        value = 0
+        for p in positions:
+            value = (value << 1) | ((bits >> p) & 1)
+        sr[name] = value
+    return ConfigSnapshot(rf, sr)
+
+
+class ConfigStore:
+    """
+    Store of configurations in a directory (default: ~/.spadic/configs).
+
+    Configurations are referred to by their hash, a unique prefix of it,
+    or a tag. Example:
+
+        store = ConfigStore()
+        ref = store.save(controller, 'pulser run')
+        store.tag('pulser', ref)
+        ...
+        store.load(controller, 'pulser')    # write only the differences
+        print(store.compare(controller, 'pulser'))
+    """
+    def __init__(self, path=DEFAULT_STORE):
+        self.path = path
+        self._objects = os.path.join(path, 'objects')
+        if not os.path.exists(self._objects):
+            os.makedirs(self._objects)
+
+    #----------------------------------------------------------------
+    # snapshots
+    #----------------------------------------------------------------
+    def put(self, snapshot, message=''):
+        """Store a complete configuration and return its hash."""
+        image = encode(snapshot)
+        h = hashlib.sha1(image).hexdigest()
+        filename = os.path.join(self._objects, h)
+        if not os.path.exists(filename):
+            tmp = filename + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(image)
+            os.replace(tmp, filename)
+        with open(os.path.join(self.path, 'history'), 'a') as f:
+            f.write('%.3f %s %s\n' % (time.time(), h,
+                                      ' '.join(message.split())))
+        return h
+
+    def get(self, ref):
+        """Return the ConfigSnapshot of a stored configuration."""
+        with open(os.path.join(self._objects, self.resolve(ref)), 'rb') as f:
+            return decode(f.read())
+
+    def resolve(self, ref):
+        """Return the hash of a configuration given by tag, hash or unique
+        prefix of a hash."""
+        tags = self.tags()
+        if ref in tags:
+            return tags[ref]
+        matches = [h for h in os.listdir(self._objects)
+                   if h.startswith(ref) and not h.endswith('.tmp')]
+        if len(matches) != 1:
+            raise KeyError('%s configurations match %r' % (len(matches), ref)
+                           if matches else 'unknown configuration: %r' % ref)
+        return matches[0]
+
+    def diff(self, ref_from, ref_to):
+        """Return the ConfigDiff between two stored configurations."""
+        return ConfigDiff(self.get(ref_from), self.get(ref_to))
+
+    #----------------------------------------------------------------
+    # history and tags
+    #----------------------------------------------------------------
+    def history(self, n=None):
+        """Return the list of (time, hash, message) of the last n (default:
+        all) stored configurations, the latest one first."""
+        try:
+            with open(os.path.join(self.path, 'history')) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        result = []
+        for line in reversed(lines[-n:] if n else lines):
+            t, h, message = (line.rstrip('\n').split(' ', 2) + [''])[:3]
+            result.append((float(t), h, message))
+        return result
+
+    def tags(self):
+        """Return the dictionary {tag: hash}."""
+        try:
+            with open(os.path.join(self.path, 'tags')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def tag(self, name, ref):
+        """Give a configuration a (new) tag name."""
+        tags = self.tags()
+        tags[name] = self.resolve(ref)
+        self._write_tags(tags)
+
+    def untag(self, name):
+        """Remove a tag."""
+        tags = self.tags()
+        del tags[name]
+        self._write_tags(tags)
+
+    def _write_tags(self, tags):
+        filename = os.path.join(self.path, 'tags')
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(tags, f, indent=1, sort_keys=True)
+        os.replace(filename + '.tmp', filename)
+
+    #----------------------------------------------------------------
+    # controller and .spc files
+    #----------------------------------------------------------------
+    def save(self, controller, message=''):
+        """Store the current configuration of a SpadicController."""
+        return self.put(controller.snapshot(), message)
+
+    def load(self, controller, ref):
+        """Bring a SpadicController into a stored configuration, writing
+        only the registers that differ. Return the ConfigDiff."""
+        return controller.configure(self.get(ref))
+
+    def compare(self, controller, ref):
+        """Return the ConfigDiff between the current configuration of a
+        SpadicController and a stored one."""
+        return controller.diff(self.get(ref))
+
+    def import_spc(self, filename, message=None):
+        """Store the configuration of a complete .spc file."""
+        return self.put(read_spc(filename),
+                        os.path.basename(filename) if message is None
+                        else message)
+
+    def export_spc(self, ref, filename):
+        """Write a stored configuration to a .spc file."""
+        with open(filename, 'w') as f:
+            print(format_spc(self.get(ref), SIZES), file=f)
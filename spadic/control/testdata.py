@@ -31,10 +31,11 @@ class TestData(ControlUnitBase):
         self._registerfile['enableTestOutput'].apply()
         self._registerfile['testOutputSelGroup'].apply()
 
-    def update(self):
-        self._testdatain = self._registerfile['enableTestInput'].read()
-        self._testdataout = self._registerfile['enableTestOutput'].read()
-        self._group = self._registerfile['testOutputSelGroup'].read()
+    def update(self, snapshot=None):
+        rf = snapshot_values(self._registerfile, snapshot, 'rf')
+        self._testdatain = rf['enableTestInput']
+        self._testdataout = rf['enableTestOutput']
+        self._group = rf['testOutputSelGroup']
 
     def get(self):
         return {'testdatain': self._testdatain,
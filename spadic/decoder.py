@@ -0,0 +1,151 @@
+"""Decoding of message words in several processes.
+
+The words of each lane are cut into chunks that start where a message
+starts, so that the chunks can be split into messages and decoded
+independently. The decoded messages of each lane are returned in the
+original order.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import threading
+
+from .message import _MessageSplitter, _END_KINDS, Message
+from .message import info_kind, word_kind
+
+
+def decode_words(words):
+    """Split words into messages and decode them, including the data.
+
+    Return a list of Message objects. An incomplete message at the end is
+    discarded.
+
+    >>> [(m.channel_id, m.data()) for m in decode_words(
+    ...     [0x8001, 0x9000, 0xA000, 0x7000, 0xB040, 0x8002])]
+    [(1, [0])]
+    """
+    messages = []
+    for words in _MessageSplitter()(words):
+        m = Message(words)
+        m.data()
+        messages.append(m)
+    return messages
+
+
+# Decoded messages are sent back from the worker processes as tuples of
+# their attributes, which is much cheaper to pickle than Message objects.
+_FIELDS = Message.__slots__
+
+def _decode_packed(words):
+    return [tuple(getattr(m, f) for f in _FIELDS)
+            for m in decode_words(words)]
+
+def _unpack(packed):
+    messages = []
+    for values in packed:
+        m = Message.__new__(Message)
+        for (field, value) in zip(_FIELDS, values):
+            setattr(m, field, value)
+        messages.append(m)
+    return messages
+
+
+def _last_start(words):
+    """
+    Return the index of the last word (except the first one) at which a
+    message starts: a start of message word, or the word after an end of
+    message marker or an info word. None if there is none.
+
+    >>> _last_start([0x8001, 0x9000, 0xB000, 0x8002, 0x9000])
+    3
+    >>> _last_start([0xD000, 0xD001])
+    2
+    >>> _last_start([0x8001, 0x9000]) is None
+    True
+    """
+    for i in range(len(words), 0, -1):
+        if i < len(words) and word_kind[words[i] >> 12] == 'wSOM':
+            return i
+        kind = word_kind[words[i-1] >> 12]
+        if kind in _END_KINDS or (kind == 'wINF' and
+                info_kind[(words[i-1] >> 8) & 0xF] != 'iNOP'):
+            return i
+    return None
+
+
+class ParallelDecoder:
+    """Decode the words of several lanes in a pool of processes.
+
+    Words given to put() are collected until there are at least
+    `chunk_size` words, then everything up to the start of the last message
+    is decoded in one of the processes. The messages of a lane are
+    obtained with get(), in the order of the words.
+
+    Example:
+
+        with ParallelDecoder() as d:
+            d.put(0, words)
+            d.flush()
+            messages = d.get(0)
+    """
+    def __init__(self, processes=None, chunk_size=2**14):
+        self._executor = ProcessPoolExecutor(processes)
+        self._chunk_size = chunk_size
+        self._words = {}   # lane: words not submitted yet
+        self._futures = {} # lane: futures in submission order
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._executor.shutdown()
+
+    def put(self, lane, words):
+        """Add words of the given lane."""
+        with self._lock:
+            buf = self._words.setdefault(lane, [])
+            buf.extend(words)
+            if len(buf) >= self._chunk_size:
+                self._cut(lane)
+
+    def flush(self, lane=None):
+        """Decode all words of the given lane (default: all lanes) given so
+        far. An incomplete message at the end is kept for the next put."""
+        with self._lock:
+            for l in ([lane] if lane is not None else list(self._words)):
+                self._cut(l)
+
+    def _cut(self, lane):
+        """Submit the words of the lane up to the start of the last
+        message."""
+        buf = self._words.get(lane, [])
+        cut = _last_start(buf)
+        if cut is not None:
+            self._submit(lane, buf[:cut])
+            self._words[lane] = buf[cut:]
+
+    def _submit(self, lane, words):
+        future = self._executor.submit(_decode_packed, words)
+        self._futures.setdefault(lane, deque()).append(future)
+
+    def pending(self, lane):
+        """Return the number of chunks of the lane that are not read yet."""
+        return len(self._futures.get(lane, ()))
+
+    def get(self, lane, timeout=None):
+        """Return the decoded messages of the next chunk of the given lane.
+
+        Wait up to timeout seconds (forever if None) for the chunk to be
+        decoded. Return None if no chunk is ready.
+        """
+        futures = self._futures.get(lane)
+        if not futures:
+            return None
+        try:
+            packed = futures[0].result(timeout)
+        except TimeoutError:
+            return None
+        futures.popleft()
+        return _unpack(packed)
+
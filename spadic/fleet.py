@@ -0,0 +1,138 @@
+import threading
+import time
+
+from .client import SpadicControlClient, SpadicDirectoryClient
+from .control.base import ConfigSnapshot
+from .control.config import ConfigDiff, read_spc
+
+
+class FleetResult:
+    """Result of configuring one chip.
+
+    diff:       ConfigDiff of the written registers
+    mismatches: ConfigDiff between the read-back and the target
+                configuration (empty if verified, None if not verified)
+    error:      exception raised while configuring the chip, or None
+    elapsed:    duration in seconds
+    """
+    def __init__(self):
+        self.diff = None
+        self.mismatches = None
+        self.error = None
+        self.elapsed = 0
+
+    @property
+    def ok(self):
+        return self.error is None and not self.mismatches
+
+    def __str__(self):
+        if self.error is not None:
+            return 'error: %s' % self.error
+        s = '%i registers written in %.2f s' % (len(self.diff), self.elapsed)
+        if self.mismatches is None:
+            return s + ', not verified'
+        if self.mismatches:
+            return s + ', %i mismatches:\n%s' % (len(self.mismatches),
+                                                self.mismatches)
+        return s + ', verified'
+
+
+class SpadicFleet:
+    """Configure several chips served by SpadicServers at once.
+
+    `chips` is a dictionary {name: (host, port_base)}. The chips of a
+    SpadicMultiServer can be obtained with from_directory().
+
+    Example:
+
+        with SpadicFleet.from_directory('localhost') as fleet:
+            results = fleet.configure('run.spc', overrides={
+                'FT1234': {'groupIdA': 1, 'groupIdB': 2},
+                'FT5678': {'groupIdA': 3, 'groupIdB': 4}})
+            for (name, result) in results.items():
+                print(name, result)
+    """
+    from .util import log as _log
+    def _debug(self, *text):
+        self._log.info(' '.join(map(str, text)))
+
+    def __init__(self, chips):
+        self.chips = dict(chips)
+        self.clients = {}
+
+    @classmethod
+    def from_directory(cls, host, port_base=None):
+        """Create a fleet with all chips of a SpadicMultiServer."""
+        with SpadicDirectoryClient(host, port_base) as d:
+            chips = d.chips()
+        return cls({name: (host, chip_port_base)
+                    for (name, chip_port_base) in chips.items()})
+
+    def __enter__(self):
+        try:
+            for (name, (host, port_base)) in self.chips.items():
+                self.clients[name] = SpadicControlClient(host, port_base)
+        except BaseException:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        for c in self.clients.values():
+            c.__exit__(*args)
+        self.clients = {}
+
+    def configure(self, config, overrides=None, verify=True):
+        """Bring all chips into the same configuration at the same time.
+
+        config:    ConfigSnapshot, name of a configuration file, or a
+                   dictionary {name: value} (see SpadicController.configure)
+        overrides: dictionary {chip name: {register name: value}} with
+                   chip-specific values, e.g. CbmNetAddr, groupIdA/B
+        verify:    read back all registers of each chip after writing
+
+        Each chip only gets the registers that differ from its current
+        configuration, in one batch. Return a dictionary {chip name:
+        FleetResult}.
+        """
+        if isinstance(config, str):
+            config = read_spc(config)
+        overrides = overrides or {}
+        results = {name: FleetResult() for name in self.clients}
+
+        threads = []
+        for (name, client) in self.clients.items():
+            t = threading.Thread(name='configure %s' % name)
+            t.run = self._configure_task(client, config,
+                                         overrides.get(name, {}),
+                                         verify, results[name])
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+
+        for (name, result) in results.items():
+            self._debug(name, result)
+        return results
+
+    def _configure_task(self, client, config, override, verify, result):
+        def configure_task():
+            start = time.time()
+            try:
+                control = client.control
+                target = control.as_snapshot(config)
+                if override:
+                    extra = control.as_snapshot(override)
+                    target = ConfigSnapshot(dict(target.rf, **extra.rf),
+                                            dict(target.sr, **extra.sr))
+                result.diff = control.configure(target)
+                if verify:
+                    client.rf_client.clear_cache()
+                    client.sr_client.clear_cache()
+                    result.mismatches = ConfigDiff(control.snapshot(),
+                                                   target)
+            except Exception as e:
+                result.error = e
+            result.elapsed = time.time() - start
+        return configure_task
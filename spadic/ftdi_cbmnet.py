@@ -1,6 +1,7 @@
 from collections import namedtuple
 import struct
 
+from . import metrics
 from .Ftdi import FtdiContainer
 from .mux_stream import (
     MultiplexedStreamInterface, StreamDemultiplexer, NoDataAvailable
@@ -23,10 +24,38 @@ WRITE_LEN = {
   ADDR_CTRL: 3
 }
 
+# CBMnet interface port names (used for metrics)
+PORT_NAME = {
+  ADDR_DLM   : 'DLM',
+  ADDR_CTRL  : 'CTRL',
+  ADDR_DATA_A: 'DATA_A',
+  ADDR_DATA_B: 'DATA_B'
+}
+
 
 class FtdiCbmnetInterface(FtdiContainer, MultiplexedStreamInterface):
     """Representation of the FTDI <-> CBMnet interface."""
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics = {}
+        for addr, name in PORT_NAME.items():
+            m = metrics.registry.labelled(port=name)
+            self._metrics[addr] = {
+                (direction, unit): m.counter('cbmnet_{}_{}'.format(unit,
+                                                                  direction))
+                for direction in ['sent', 'received']
+                for unit in ['packets', 'bytes']
+            }
+
+    def _count(self, addr, direction, num_bytes):
+        try:
+            counters = self._metrics[addr]
+        except KeyError:
+            return
+        counters[direction, 'packets'].inc()
+        counters[direction, 'bytes'].inc(num_bytes)
+
     def write(self, value, destination):
         """Write a packet to the CBMnet send interface."""
         packet = FtdiCbmnetPacket(addr=destination, words=value)
@@ -42,6 +71,7 @@ class FtdiCbmnetInterface(FtdiContainer, MultiplexedStreamInterface):
         data = struct.pack('>%dH' % len(packet.words), *packet.words)
         ftdi_data = header + data
         self._ftdi.write(ftdi_data)
+        self._count(packet.addr, 'sent', len(ftdi_data))
 
     def read(self):
         """Read a packet from the CBMnet receive interface.
@@ -56,6 +86,7 @@ class FtdiCbmnetInterface(FtdiContainer, MultiplexedStreamInterface):
         addr, num_words = struct.unpack('BB', header)
         data = self._ftdi.read(2 * num_words)
         words = struct.unpack('>%dH' % num_words, data)
+        self._count(addr, 'received', len(header) + len(data))
 
         self._debug('read', '%i,' % addr,
                     '[%s]' % (' '.join('%04X' % w for w in words)))
@@ -64,17 +95,24 @@ class FtdiCbmnetInterface(FtdiContainer, MultiplexedStreamInterface):
 
 
 class FtdiCbmnet:
-    """Representation of the CBMnet interface over FTDI."""
+    """Representation of the CBMnet interface over FTDI.
+
+    `ring_size` (in words) and `overflow` are used for the receive buffers
+    of the data ports, `queue_size` and `overflow` for the control port
+    (see StreamDemultiplexer).
+    """
 
     from .util import log as _log
     def _debug(self, *text):
         self._log.info(' '.join(text)) # TODO use proper log levels
 
-    def __init__(self, ftdi):
+    def __init__(self, ftdi, queue_size=0, overflow='block', ring_size=2**20):
         self._demux = StreamDemultiplexer(
             interface=FtdiCbmnetInterface(ftdi),
             sources=[ADDR_DATA_A, ADDR_DATA_B, ADDR_CTRL],
-            name='{}Demultiplexer'.format(type(self).__name__)
+            name='{}Demultiplexer'.format(type(self).__name__),
+            queue_size=queue_size, overflow=overflow,
+            word_sources=[ADDR_DATA_A, ADDR_DATA_B], ring_size=ring_size
         )
         self._debug('init')
 
@@ -95,12 +133,15 @@ class FtdiCbmnet:
         """Send a DLM."""
         self._demux.write([number], destination=ADDR_DLM)
 
-    def read_data(self, lane, timeout=1):
-        """Read words from the CBMnet data receive interface at the given lane
-        number.
+    def read_data(self, lane, timeout=1, timed=False):
+        """Read all words received so far from the CBMnet data receive
+        interface at the given lane number, as an array.
+
+        If timed, return a tuple (time of reception, words) (see
+        StreamDemultiplexer.read).
         """
         source = [ADDR_DATA_A, ADDR_DATA_B][lane]
-        return self._demux.read(source, timeout)
+        return self._demux.read(source, timeout, timed)
 
     def read_ctrl(self, timeout=1):
         """Read words from the CBMnet control receive interface."""
@@ -13,16 +13,35 @@ class Spadic:
     Arguments:
     reset - flag for initial reset of the chip configuration
     load  - name of .spc configuration file to be loaded
+
+    Optional selection of the FTDI device (see Ftdi.Ftdi), if several are
+    connected:
+    ftdi_serial - serial number
+    ftdi_device - USB bus path '<bus>/<device>'
+
+    Optional queue settings (see util.OverflowQueue, util.WordRingBuffer):
+    lane_buffer_size, lane_overflow      - received words of each lane
+                                           ('drop_oldest' is not supported)
+    message_queue_size, message_overflow - split messages of each lane
     """
 
     from .util import log as _log
     def _debug(self, *text):
         self._log.info(' '.join(text))
 
-    def __init__(self, reset=False, load=None, **kwargs):
-        self._cbmif = ftdi_cbmnet.FtdiCbmnet(Ftdi.Ftdi())
+    def __init__(self, reset=False, load=None,
+                       lane_buffer_size=2**20, lane_overflow='block',
+                       message_queue_size=2**16,
+                       message_overflow='drop_oldest',
+                       ftdi_serial=None, ftdi_device=None):
+        ftdi = Ftdi.Ftdi(serial=ftdi_serial, device=ftdi_device)
+        self._cbmif = ftdi_cbmnet.FtdiCbmnet(ftdi,
+                                             overflow=lane_overflow,
+                                             ring_size=lane_buffer_size)
         self._reg_access = SpadicCbmnetRegisterAccess(self._cbmif)
-        self._splitters = [MessageSplitter(self._cbmif, lane)
+        self._splitters = [MessageSplitter(self._cbmif, lane,
+                                           message_queue_size,
+                                           message_overflow)
                            for lane in [0, 1]]
 
         self.readout_enable(0)
@@ -36,7 +55,23 @@ class Spadic:
             def read():
                 return next(self._reg_access.read_registers([addr]))
             return read
-        self._registerfile = SpadicRegisterFile(rf_write_gen, rf_read_gen)
+        def rf_write_many(operations):
+            self._reg_access.write_registers([(addr, value)
+                for (name, addr, value) in operations])
+        def rf_read_many(registers):
+            # all read requests are sent before the results are collected
+            results = self._reg_access.read_registers([addr
+                for (name, addr) in registers])
+            values = {}
+            try:
+                for (name, addr) in registers:
+                    values[name] = next(results)
+            except IOError:
+                pass
+            return values
+        self._registerfile = SpadicRegisterFile(rf_write_gen, rf_read_gen,
+                                                write_many=rf_write_many,
+                                                read_many=rf_read_many)
 
         # higher level shift register access
         self._shiftregister = SpadicShiftRegister(
@@ -1,6 +1,11 @@
+from collections import Counter
 import logging
 import queue
 import threading
+import time
+
+from . import metrics
+from .util import OverflowQueue
 
 def match_word(word, xxx_todo_changeme):
     """Test if a part of a word matches a given value."""
@@ -92,6 +97,30 @@ hittype_str = {
   3: 'self and neighbor triggered'
 }
 
+#--------------------------------------------------------------------
+# classification tables
+#--------------------------------------------------------------------
+# preamble name of a word by its upper four bits (continuation: 0..7)
+word_kind = [next(p for (p, vm) in preamble.items() if match_word(i << 12, vm))
+             for i in range(16)]
+
+# info type name of an info word by bits 8..11
+info_kind = [next(t for (t, vm) in infotype.items() if match_word(i << 8, vm))
+             for i in range(16)]
+
+_END_KINDS = ('wEOM', 'wBOM', 'wEPM')   # end of message markers
+_INFO_CHANNEL = ('iDIS', 'iNGT', 'iNBE', 'iMSB') # info words with channel
+
+def classify(word):
+    """Return the preamble name of a word and, for info words, the info
+    type name (otherwise None).
+
+    >>> classify(0x8012), classify(0x1234), classify(0xF500)
+    (('wSOM', None), ('wCON', None), ('wINF', 'iNOP'))
+    """
+    kind = word_kind[word >> 12]
+    return (kind, info_kind[(word >> 8) & 0xF] if kind == 'wINF' else None)
+
 
 
 #====================================================================
@@ -101,10 +130,13 @@ hittype_str = {
 #--------------------------------------------------------------------
 # split sequence of message words into messages (or info words)
 #--------------------------------------------------------------------
-def _MessageSplitter():
+def _MessageSplitter(metrics=None):
     """Return a generator function for splitting words into chunks that form
     one message, remembering unprocessed input until the next call.
 
+    If metrics (e.g. a metrics.LabelledMetrics instance) are given, the
+    dropped NOP words and the info words by type are counted.
+
     >>> s = _MessageSplitter()
     >>> list(s([0x8000, 0x9000, 0xA000, 0x1234]))
     []
@@ -114,17 +146,32 @@ def _MessageSplitter():
     """
     message = []
 
+    if metrics is not None:
+        nop_counter = metrics.counter('nop_words_dropped')
+        info_counters = {
+            i: metrics.counter('info_words',
+                               type=infotype_str.get(i, 'unknown'))
+            for i in range(16)
+        }
+
     def split(message_words):
         """Consume words and generate chunks that form one message."""
+        num_nop = 0
+        num_info = Counter()
         for w in message_words:
+            kind = word_kind[w >> 12]
             # first check if info word and discard NOP words
-            if match_word(w, preamble['wINF']):
-                if not match_word(w, infotype['iNOP']):
+            if kind == 'wINF':
+                info = (w & 0x0F00) >> 8
+                if info_kind[info] != 'iNOP':
+                    num_info[info] += 1
                     yield [w]
                     message.clear()
+                else:
+                    num_nop += 1
                 continue
             # start new message at start of message marker
-            elif match_word(w, preamble['wSOM']):
+            elif kind == 'wSOM':
                 message.clear()
 
             # build up message
@@ -132,19 +179,109 @@ def _MessageSplitter():
 
             # yield message at all possible end of message markers
             # also clear it so it is not stored as remainder
-            if any(match_word(w, preamble[p])
-                   for p in ['wEOM', 'wBOM', 'wEPM']):
+            if kind in _END_KINDS:
                 yield list(message)
                 message.clear()
 
+        # count once per call, not for every word
+        if metrics is not None:
+            nop_counter.inc(num_nop)
+            for i, n in num_info.items():
+                info_counters[i].inc(n)
+
     return split
 
 
+def _count_dropped(metrics, lane):
+    """Return a function that counts a discarded (time, words) item of the
+    given lane (0: A, 1: B) per channel, using the channel ID of the start
+    of message word (channel 'none' for info words).
+
+    >>> from spadic.metrics import MetricsRegistry
+    >>> r = MetricsRegistry()
+    >>> count = _count_dropped(r, 1)
+    >>> for words in [[0x8013, 0xB000], [0x8003], [0xF000]]:
+    ...     count((0, words))
+    >>> r.snapshot()
+    {'messages_dropped{channel=19}': 2, 'messages_dropped{channel=none}': 1}
+    """
+    offset = 16 * lane
+    counters = {}
+    def count(item):
+        words = item[1]
+        if words and word_kind[words[0] >> 12] == 'wSOM':
+            channel = offset + (words[0] & 0x000F)
+        else:
+            channel = 'none'
+        try:
+            counter = counters[channel]
+        except KeyError:
+            counter = counters[channel] = metrics.counter(
+                'messages_dropped', channel=channel)
+        counter.inc()
+    return count
+
+
 #--------------------------------------------------------------------
 # extract information from messages
 #--------------------------------------------------------------------
+def _read_som(m, w):
+    # start of message -> group ID, channel IDs
+    m.group_id   = (w & 0x0FF0) >> 4
+    m.channel_id = (w & 0x000F)
+
+def _read_tsw(m, w):
+    # timestamp
+    m.timestamp = (w & 0x0FFF)
+
+def _read_eom(m, w):
+    # end of message -> num. data, hit type, stop type
+    m.num_data  = (w & 0x0FC0) >> 6
+    m.hit_type  = (w & 0x0030) >> 4
+    m.stop_type = (w & 0x0007)
+
+def _read_bom(m, w):
+    # buffer overflow count
+    m.buffer_overflow_count = (w & 0x00FF)
+
+def _read_epm(m, w):
+    # epoch marker
+    m.epoch_count = (w & 0x0FFF)
+
+def _read_inf(m, w):
+    # info words
+    m.info_type = (w & 0x0F00) >> 8
+    info = info_kind[m.info_type]
+    if info in _INFO_CHANNEL:
+        m.channel_id = (w & 0x00F0) >> 4
+    elif info == 'iSYN':
+        m.epoch_count = (w & 0x00FF)
+
+# header field readers by the upper four bits of a word (None: no header
+# fields, i.e. raw data, extracted data and continuation words)
+_HEADER_READERS = [{'wSOM': _read_som, 'wTSW': _read_tsw,
+                    'wEOM': _read_eom, 'wBOM': _read_bom,
+                    'wEPM': _read_epm, 'wINF': _read_inf}.get(kind)
+                   for kind in word_kind]
+
+
 class Message():
-    """Representation of a SPADIC 1.0 message."""
+    """Representation of a SPADIC 1.0 message.
+
+    The words can be any sequence of 16 bit numbers (e.g. a list, an
+    array.array or a memoryview slice), they are not copied. The header
+    fields are extracted in one pass, the data samples are decoded when
+    they are needed for the first time.
+
+    >>> m = Message([0x8012, 0x9345, 0xA000, 0x7000, 0xB041])
+    >>> m.group_id, m.channel_id, m.timestamp, m.num_data, m.stop_type
+    (1, 2, 837, 1, 1)
+    >>> m.data(), m.data() is m.data()
+    ([0], True)
+    """
+    __slots__ = ['words', 'group_id', 'channel_id', 'timestamp', '_data',
+                 'num_data', 'hit_type', 'stop_type',
+                 'buffer_overflow_count', 'epoch_count', 'info_type']
 
     def __init__(self, words):
         """Extract the metadata from the message."""
@@ -161,38 +298,11 @@ class Message():
 
         self.words = words
 
+        readers = _HEADER_READERS
         for w in words:
-            # start of message -> group ID, channel IDs
-            if match_word(w, preamble['wSOM']):
-                self.group_id   = (w & 0x0FF0) >> 4
-                self.channel_id = (w & 0x000F)
-
-            # timestamp
-            elif match_word(w, preamble['wTSW']):
-                self.timestamp = (w & 0x0FFF)
-
-            # end of message -> num. data, hit type, stop type
-            elif match_word(w, preamble['wEOM']):
-                self.num_data = (w & 0x0FC0) >> 6
-                self.hit_type = (w & 0x0030) >> 4
-                self.stop_type = (w & 0x0007)
-
-            # buffer overflow count
-            elif match_word(w, preamble['wBOM']):
-                self.buffer_overflow_count = (w & 0x00FF)
-
-            # epoch marker
-            elif match_word(w, preamble['wEPM']):
-                self.epoch_count = (w & 0x0FFF)
-
-            # info words
-            elif match_word(w, preamble['wINF']):
-                self.info_type = (w & 0x0F00) >> 8
-                if any(match_word(w, infotype[it])
-                       for it in ['iDIS', 'iNGT', 'iNBE', 'iMSB']):
-                    self.channel_id = (w & 0x00F0) >> 4
-                elif match_word(w, infotype['iSYN']):
-                    self.epoch_count = (w & 0x00FF)
+            reader = readers[w >> 12]
+            if reader is not None:
+                reader(self, w)
 
 
     def _update_data(self):
@@ -202,10 +312,11 @@ class Message():
             pos = -9 # initial position of the mask LSB
             for w in self.words:
                 if pos < 0:
-                    if match_word(w, preamble['wRDA']):
+                    kind = word_kind[w >> 12]
+                    if kind == 'wRDA':
                         r = (r << 12) + (w & 0x0FFF)
                         pos += 12
-                    elif match_word(w, preamble['wCON']):
+                    elif kind == 'wCON':
                         r = (r << 15) + (w & 0x7FFF)
                         pos += 15
 
@@ -229,7 +340,7 @@ class Message():
 
     def report(self, verbose=False):
         """Make a human-readable report."""
-        self._update_data()
+        self.data()
         s = []
 
         if verbose:
@@ -275,17 +386,32 @@ class Message():
 
 
 class MessageSplitter:
-    """Split messages from received words in the background."""
+    """Split messages from received words in the background.
+
+    At most `queue_size` messages (0 means unlimited) are kept until they
+    are read. If more messages arrive, they are handled according to the
+    `overflow` policy (see util.OverflowQueue). By default, the oldest
+    messages are discarded, so that nothing piles up if nobody reads them.
+    """
 
     def _debug(self, *text):
         logger = logging.getLogger(type(self).__name__ + 'AB'[self._lane])
         logger.info(' '.join(text))
 
-    def __init__(self, backend, lane):
+    def __init__(self, backend, lane, queue_size=2**16,
+                       overflow='drop_oldest'):
         self._backend = backend
         self._lane = lane
-        self._splitter = _MessageSplitter()
-        self._queue = queue.Queue()
+        m = metrics.registry.labelled(stage='splitter', lane='AB'[lane])
+        self._splitter = _MessageSplitter(m)
+        self._queue = OverflowQueue(queue_size, overflow,
+                                    m.counter('queue_overflows').inc,
+                                    _count_dropped(m, lane))
+        self._messages = m.counter('messages')
+        self._latency = m.histogram('message_queue_latency_seconds')
+        # from the reception of the words by the demultiplexer to reading
+        self._message_latency = m.histogram('message_latency_seconds')
+        m.gauge('message_queue_depth', self._queue.qsize)
         self._setup_thread()
 
     def __enter__(self):
@@ -313,14 +439,19 @@ class MessageSplitter:
         self._debug(self._thread.name, 'finished')
 
     def _split_job(self):
-        """Give received words the message splitter, put resulting messages
-        into the output queue."""
+        """Give all words received so far to the message splitter, put
+        resulting messages into the output queue."""
         while not self._stop.is_set():
-            words = self._backend.read_data(lane=self._lane)
-            if not words:
+            item = self._backend.read_data(lane=self._lane, timed=True)
+            if not item:
                 continue
+            (received, words) = item
+            t = time.time()
+            n = 0
             for m in self._splitter(words):
-                self._queue.put(m)
+                self._queue.put((t, m, received))
+                n += 1
+            self._messages.inc(n)
 
     def read_message(self, timeout=1, raw=False):
         """Return one message from the output queue, if available.
@@ -329,7 +460,10 @@ class MessageSplitter:
         if the `raw` flag is set.
         """
         try:
-            data = self._queue.get(timeout=timeout)
+            t, data, received = self._queue.get(timeout=timeout)
         except queue.Empty:
             return None
+        now = time.time()
+        self._latency.observe(now - t)
+        self._message_latency.observe(now - received)
         return (data if raw else Message(data))
@@ -0,0 +1,208 @@
+"""Lightweight metrics (counters, gauges, histograms) for the readout chain.
+
+All metrics live in a registry and are identified by a name and a set of
+labels. The components of the readout chain use the module-level default
+registry:
+
+>>> m = registry.labelled(lane='A')
+>>> m.counter('example_messages').inc(3)
+>>> registry.snapshot()['example_messages{lane=A}']
+3
+
+The snapshot can be obtained remotely from the SpadicServer by using
+a SpadicMetricsClient.
+"""
+
+import bisect
+import threading
+import weakref
+
+
+class Counter:
+    """A value that can only increase."""
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """Increase the value by the given amount."""
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+
+class Gauge:
+    """A value that can go up and down.
+
+    If a function is given, the value is obtained by calling it every time
+    it is requested, instead of being set explicitly. Bound methods (e.g.
+    the qsize method of a queue) are only weakly referenced, so that the
+    gauge does not keep their object alive; the value is 0 after the
+    object is gone.
+
+    >>> import queue
+    >>> q = queue.Queue()
+    >>> q.put(1)
+    >>> g = Gauge(q.qsize)
+    >>> g.value
+    1
+    >>> del q
+    >>> g.value
+    0
+    """
+    def __init__(self, function=None):
+        self._value = 0
+        self.set_function(function)
+
+    def set(self, value):
+        """Set the value."""
+        self._value = value
+
+    def set_function(self, function):
+        """Obtain the value from the given function (None: use set)."""
+        if hasattr(function, '__self__') and hasattr(function, '__func__'):
+            self._function = weakref.WeakMethod(function)
+        elif function is not None:
+            self._function = lambda: function
+        else:
+            self._function = None
+
+    @property
+    def value(self):
+        if self._function is not None:
+            function = self._function()
+            return function() if function is not None else 0
+        return self._value
+
+
+class Histogram:
+    """Counts of observed values in buckets with given upper bounds.
+
+    >>> h = Histogram(buckets=[1, 10])
+    >>> for x in [0.5, 2, 3, 20]:
+    ...     h.observe(x)
+    >>> h.value['count'], h.value['sum']
+    (4, 25.5)
+    >>> h.value['buckets']
+    {'1': 1, '10': 3, 'inf': 4}
+    """
+    # seconds, suitable for latencies
+    DEFAULT_BUCKETS = [1e-4, 1e-3, 1e-2, 1e-1, 1, 10]
+
+    def __init__(self, buckets=None):
+        self._bounds = sorted(buckets or self.DEFAULT_BUCKETS)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Count the given value."""
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    @property
+    def value(self):
+        """Number and sum of all values, and cumulative counts of the values
+        less than or equal to each bucket bound."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        buckets = {}
+        cumulative = 0
+        for bound, n in zip(self._bounds + [float('inf')], counts):
+            cumulative += n
+            buckets['{:g}'.format(bound)] = cumulative
+        return {'count': cumulative, 'sum': total, 'buckets': buckets}
+
+
+def _format_key(name, labels):
+    if not labels:
+        return name
+    return '{}{{{}}}'.format(name, ','.join('{}={}'.format(k, v)
+                                            for (k, v) in labels))
+
+
+class MetricsRegistry:
+    """Collection of metrics identified by name and labels."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, metric_type, name, labels, *args):
+        key = (name, tuple(sorted((k, str(v)) for (k, v) in labels.items())))
+        with self._lock:
+            try:
+                metric = self._metrics[key]
+            except KeyError:
+                metric = self._metrics[key] = metric_type(*args)
+        if not isinstance(metric, metric_type):
+            raise TypeError('{} is a {}, not a {}'.format(
+                _format_key(*key), type(metric).__name__,
+                metric_type.__name__))
+        return metric
+
+    def counter(self, name, **labels):
+        """Return the counter with the given name and labels."""
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, function=None, **labels):
+        """Return the gauge with the given name and labels.
+
+        If a function is given, the gauge uses it from now on to obtain its
+        value (see Gauge).
+        """
+        gauge = self._get(Gauge, name, labels)
+        if function is not None:
+            gauge.set_function(function)
+        return gauge
+
+    def histogram(self, name, buckets=None, **labels):
+        """Return the histogram with the given name and labels.
+
+        If the histogram is created, it uses the given bucket bounds.
+        """
+        return self._get(Histogram, name, labels, buckets)
+
+    def labelled(self, **labels):
+        """Return a view of the registry which adds the given labels to all
+        metrics obtained through it."""
+        return LabelledMetrics(self, labels)
+
+    def snapshot(self, prefix=''):
+        """Return a dictionary with the current values of all metrics whose
+        name starts with the given prefix."""
+        with self._lock:
+            items = list(self._metrics.items())
+        return {_format_key(name, labels): metric.value
+                for ((name, labels), metric) in sorted(items)
+                if name.startswith(prefix)}
+
+
+class LabelledMetrics:
+    """View of a MetricsRegistry with a fixed set of labels."""
+    def __init__(self, registry, labels):
+        self._registry = registry
+        self._labels = labels
+
+    def counter(self, name, **labels):
+        return self._registry.counter(name, **dict(self._labels, **labels))
+
+    def gauge(self, name, function=None, **labels):
+        return self._registry.gauge(name, function,
+                                    **dict(self._labels, **labels))
+
+    def histogram(self, name, buckets=None, **labels):
+        return self._registry.histogram(name, buckets,
+                                        **dict(self._labels, **labels))
+
+    def labelled(self, **labels):
+        return LabelledMetrics(self._registry, dict(self._labels, **labels))
+
+
+# default registry used by the readout chain
+registry = MetricsRegistry()
@@ -4,6 +4,9 @@ import queue
 import threading
 import time
 
+from . import metrics
+from .util import OverflowQueue, WordRingBuffer
+
 
 class NoDataAvailable(Exception):
     "Raised when interfaces used by StreamDemultiplexer have no data to read."
@@ -39,6 +42,15 @@ class MultiplexedStreamInterface(metaclass=ABCMeta):
 class StreamDemultiplexer:
     """Adaptor to convert a MultiplexedStreamInterface to an interface where
     values are read from or written to individual sources/destinations.
+
+    The values read from each source are kept in a queue holding at most
+    `queue_size` values (0 means unlimited). If a queue is full, values are
+    handled according to the `overflow` policy (see util.OverflowQueue).
+
+    Values read from the `word_sources` must be sequences of 16-bit words.
+    Instead of a queue, each of these sources has a ring buffer holding
+    `ring_size` words (see util.WordRingBuffer), from which all available
+    words are read at once.
     """
 
     WR_TASK = 0 # lower value -> higher priority
@@ -48,13 +60,26 @@ class StreamDemultiplexer:
         _log = logging.getLogger(self._name)
         _log.info(' '.join(text)) # TODO use proper log levels
 
-    def __init__(self, interface, sources, name=None):
+    def __init__(self, interface, sources, name=None,
+                       queue_size=0, overflow='block',
+                       word_sources=(), ring_size=2**20):
         self._name = name or type(self).__name__
         self._interface = interface
         self._send_queue = queue.Queue()
         self._comm_tasks = queue.PriorityQueue()
-        self._recv_queue = {source: queue.Queue() for source in sources}
+        m = metrics.registry.labelled(demux=self._name)
+        self._recv_queue = {
+            source: OverflowQueue(queue_size, overflow, m.counter(
+                'queue_overflows', source=source).inc)
+            for source in sources if source not in word_sources
+        }
+        self._rings = {
+            source: WordRingBuffer(ring_size, overflow, m.counter(
+                'queue_overflows', source=source).inc)
+            for source in sources if source in word_sources
+        }
         self._send_data = queue.Queue()
+        self._setup_metrics()
         self._setup_threads()
         self._debug('init')
 
@@ -73,18 +98,40 @@ class StreamDemultiplexer:
         """Write the value to the given destination."""
         self._send_queue.put((value, destination))
 
-    def read(self, source, timeout=1):
+    def read(self, source, timeout=1, timed=False):
         """Read a value from the given source.
 
-        If there was nothing to read, return None.
+        For word sources, return an array of all words available up to now.
+        If there was nothing to read, return None. If timed, return a tuple
+        (time, value) with the time at which the value (or the first of the
+        words) was received.
         """
+        if source in self._rings:
+            return self._rings[source].get(timeout=timeout, timed=timed)
         q = self._recv_queue[source]
         try:
-            value = q.get(timeout=timeout)
+            t, value = q.get(timeout=timeout)
         except queue.Empty:
             return None
         q.task_done()
-        return value
+        self._latency[source].observe(time.time() - t)
+        return (t, value) if timed else value
+
+    def _setup_metrics(self):
+        m = metrics.registry.labelled(demux=self._name)
+        self._received = {}
+        self._latency = {}
+        for source, q in self._recv_queue.items():
+            self._received[source] = m.counter('demux_packets_received',
+                                               source=source)
+            self._latency[source] = m.histogram('demux_queue_latency_seconds',
+                                                source=source)
+            m.gauge('demux_queue_depth', q.qsize, source=source)
+        for source, ring in self._rings.items():
+            self._received[source] = m.counter('demux_packets_received',
+                                               source=source)
+            m.gauge('demux_queue_depth', ring.__len__, source=source)
+        m.gauge('demux_send_queue_depth', self._send_queue.qsize)
 
     def _send_job(self):
         """Process items in the send queue."""
@@ -115,7 +162,11 @@ class StreamDemultiplexer:
                     source, value = self._interface.read()
                 except NoDataAvailable:
                     continue
-                self._recv_queue[source].put(value)
+                if source in self._rings:
+                    self._put_words(source, value)
+                else:
+                    self._recv_queue[source].put((time.time(), value))
+                self._received[source].inc()
             elif task == StreamDemultiplexer.WR_TASK:
                 value, destination = self._send_data.get()
                 self._interface.write(value, destination)
@@ -124,6 +175,18 @@ class StreamDemultiplexer:
                 self._comm_tasks.put(StreamDemultiplexer.RD_TASK)
             self._comm_tasks.task_done()
 
+    def _put_words(self, source, words):
+        """Write words to the ring buffer of the given source, waiting for
+        space only as long as the demultiplexer is not stopped. The words
+        are counted as dropped only if they are finally discarded."""
+        ring = self._rings[source]
+        while not ring.put(words, timeout=0.1):
+            if ring.overflow != 'block':
+                break # already counted by the ring buffer
+            if self._stop.is_set():
+                ring.drop(words)
+                break
+
     def _setup_threads(self):
         self._stop = threading.Event()
 
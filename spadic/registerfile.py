@@ -4,6 +4,9 @@ import threading
 class RegisterReadFailure(IOError):
     pass
 
+class RegisterWriteFailure(IOError):
+    pass
+
 #====================================================================
 # generic representation of a single register and a register file
 #====================================================================
@@ -23,6 +26,10 @@ class Register:
         self._cache = None  # last known value of the hardware register
         self._known = False # is the current value of the hardware register known?
         self._use_cache = use_cache # enables the cache
+        self._dirty = True     # changed since the last write operation?
+        self._deferred = False # write operations deferred (see RegisterFile.begin)
+        self._pending = False  # apply was called while deferred
+        self._last = None      # last written or read value
 
 
     def _write(self, value):
@@ -39,6 +46,7 @@ class Register:
         v = value % (2**self.size)
         if v != self._stage:
             self._stage = v
+            self._dirty = True
 
     def get(self):
         """Return the last known register value."""
@@ -58,12 +66,45 @@ class Register:
         After the write operation has been performed, the value of the
         hardware register will be considered "not known". It will become
         known again if the "update" or "read" methods are called.
+
+        Inside a transaction of the register file, nothing is done until
+        the transaction is committed.
         """
+        if self._deferred:
+            self._pending = True
+            return
         if self._stage != self._cache:
             self._write(self._stage)
-            if self._use_cache:
-                self._cache = self._stage
-                self._known = False
+            self._written()
+
+    def _written(self):
+        """Bookkeeping after the write operation has been performed."""
+        self._dirty = False
+        self._pending = False
+        self._last = self._stage
+        if self._use_cache:
+            self._cache = self._stage
+            self._known = False
+
+    def _rollback(self):
+        """Restore the staging area to the last written or read value, if
+        there is one."""
+        if self._last is not None and self._stage != self._last:
+            self._stage = self._last
+            self._dirty = False
+
+    def _needs_write(self):
+        """Is the write operation necessary in a commit?
+
+        Only registers that have been applied in the transaction are
+        written, with cache only if the last known value differs from the
+        staging area. Without cache they are always written, like in apply.
+        """
+        if not self._pending:
+            return False
+        if self._use_cache:
+            return self._stage != self._cache
+        return True
 
 
     def update(self, blocking=True):
@@ -95,7 +136,13 @@ class Register:
             result = self._read()
         except RegisterReadFailure:
             return # TODO do something better?
+        self._received(result)
+
+    def _received(self, result):
+        """Bookkeeping after the read operation has been performed."""
         self._stage = result
+        self._dirty = False
+        self._last = result
         if self._use_cache:
             self._cache = result
             self._known = True
@@ -121,11 +168,24 @@ class Register:
 
 
 class RegisterFile(Mapping):
-    """Representation of a generic register file."""
+    """Representation of a generic register file.
+
+    Write operations can be collected in a transaction (begin/commit), so
+    that all changed registers are written at once. If a write_many
+    function is given, it is used to write several registers given as a
+    dictionary {name: value} in one operation.
 
-    def __init__(self, registers):
+    Likewise, if a read_many function is given, it is used to read a list
+    of registers in one operation. It must return a dictionary {name:
+    value}, registers that could not be read may be missing.
+    """
+
+    def __init__(self, registers, write_many=None, read_many=None):
         """Set up all registers."""
         self._registers = registers
+        self._write_many = write_many
+        self._read_many = read_many
+        self._deferred = False
 
     # collections.abc.Mapping provides __contains__, keys, items, values, get,
     # __eq__, and __ne__
@@ -153,15 +213,91 @@ class RegisterFile(Mapping):
 
     def apply(self):
         """Perform the write operation for all registers."""
+        if self._deferred:
+            for name in self:
+                self[name]._pending = True
+            return
+        self._write_registers([name for name in self
+                               if self[name]._stage != self[name]._cache])
+
+    def begin(self):
+        """Defer all write operations until commit is called."""
+        self._deferred = True
         for name in self:
-            self[name].apply()
+            self[name]._deferred = True
+
+    def commit(self):
+        """Write all registers that have been applied since begin and
+        changed since the last write operation."""
+        names = [name for name in self if self[name]._needs_write()]
+        self._end()
+        self._write_registers(names)
+
+    def abort(self):
+        """Stop deferring write operations without writing anything.
+
+        The staging area of all registers is restored to the last written
+        or read value:
+
+        >>> hw = {'a': 0}
+        >>> rf = SpadicRegisterFile(
+        ...          lambda name, addr: lambda v: hw.update({name: v}),
+        ...          lambda name, addr: lambda: hw[name],
+        ...          register_map={'a': (0, 8)})
+        >>> rf.write({'a': 100})
+        >>> rf.begin()
+        >>> rf.write({'a': 5})
+        >>> rf.abort()
+        >>> rf.get(), hw
+        ({'a': 100}, {'a': 100})
+        """
+        self._end()
+        for name in self:
+            self[name]._rollback()
+
+    def _end(self):
+        """Stop deferring write operations."""
+        self._deferred = False
+        for name in self:
+            self[name]._deferred = False
+            self[name]._pending = False
+
+    def _write_registers(self, names):
+        """Perform the write operation for the given registers, in one
+        operation if possible."""
+        if not names:
+            return
+        if self._write_many is None:
+            for name in names:
+                self[name].apply()
+            return
+        self._write_many({name: self[name]._stage for name in names})
+        for name in names:
+            self[name]._written()
 
     def update(self):
-        """Perform the read operation for all registers."""
+        """Perform the read operation for all registers, if necessary (see
+        Register.update).
+
+        Values in the staging area that have not been written are replaced
+        by the values of the hardware registers:
+
+        >>> hw = {'a': 0}
+        >>> rf = SpadicRegisterFile(
+        ...          lambda name, addr: lambda v: hw.update({name: v}),
+        ...          lambda name, addr: lambda: hw[name],
+        ...          register_map={'a': (0, 8)})
+        >>> rf.write({'a': 100})
+        >>> rf.update()
+        >>> rf.set({'a': 5})
+        >>> rf.read(), hw
+        ({'a': 100}, {'a': 100})
+        """
         last_unknown = 0
         fail_count = 0
         while True:
-            unknown = [name for name in self if not self[name]._known]
+            unknown = [name for name in self if not self[name]._known
+                       or self[name]._stage != self[name]._cache]
             if len(unknown) != last_unknown:
                 fail_count = 0
             else:
@@ -169,6 +305,16 @@ class RegisterFile(Mapping):
             last_unknown = len(unknown)
             if not unknown or fail_count == 3:
                 break
+            if self._read_many is not None:
+                try:
+                    values = self._read_many(unknown)
+                except IOError:
+                    continue
+                for (name, value) in values.items():
+                    self[name]._received(value)
+                if len(values) == len(unknown):
+                    break # all read (without cache they stay unknown)
+                continue
             # the code from here would be needed without the retransmit bug
             threads = []
             for name in unknown:
@@ -260,12 +406,20 @@ for (group, base_addr) in [('A', 0x98), ('B', 0x190)]:
 class SpadicRegisterFile(RegisterFile):
     """Representation of the SPADIC register file."""
 
-    def __init__(self, write_gen, read_gen, register_map=None, use_cache=True):
+    def __init__(self, write_gen, read_gen, register_map=None, use_cache=True,
+                       write_many=None, read_many=None):
         """
         Set up the SPADIC registers.
 
         write_gen/read_gen must return functions that write/read the
         register with the given name or address.
+
+        write_many (optional) must be a function that writes several
+        registers given as a list of (name, address, value) tuples.
+
+        read_many (optional) must be a function that reads several
+        registers given as a list of (name, address) tuples and returns a
+        dictionary {name: value}.
         """
         registers = {}
         register_map = register_map or SPADIC_RF
@@ -276,5 +430,19 @@ class SpadicRegisterFile(RegisterFile):
             r._read = read_gen(name, addr)
             registers[name] = r
 
-        RegisterFile.__init__(self, registers)
+        if write_many is not None:
+            def write_values(values):
+                write_many([(name, register_map[name][0], value)
+                            for (name, value) in values.items()])
+        else:
+            write_values = None
+
+        if read_many is not None:
+            def read_values(names):
+                return read_many([(name, register_map[name][0])
+                                  for name in names])
+        else:
+            read_values = None
+
+        RegisterFile.__init__(self, registers, write_values, read_values)
 
@@ -1,4 +1,5 @@
 import json
+import multiprocessing
 import re
 import socket
 import struct
@@ -8,23 +9,24 @@ import time
 from .main import Spadic
 from .util import InfiniteSemaphore
 from . import message
+from . import metrics
 
 
 # inheritance tree:
 # 
-# BaseServer------------------------------
-# \                                       \
-#  BaseRequestServer-----                  BaseStreamServer
-#  \                     \                 \
-#   BaseRegisterServer    SpadicCmdServer   SpadicDataServer
-#   \               \
-#    SpadicRFServer  SpadicSRServer
+# BaseServer------------------------------------------------------
+# \                                                               \
+#  BaseRequestServer---------------------------------              BaseStreamServer
+#  \                     \                \         \              \
+#   BaseRegisterServer    SpadicCmdServer  \         \              SpadicDataServer
+#   \               \                       \         SpadicDirectoryServer
+#    SpadicRFServer  SpadicSRServer          SpadicMetricsServer
 
 
-from .server_ports import PORT_BASE, PORT_OFFSET
+from .server_ports import PORT_BASE, PORT_OFFSET, PORT_STRIDE
 
-WNOP = sum((v & m) for (v, m) in [message.preamble['wINF'],
-                                  message.infotype['iNOP']])
+WNOP = ((message.word_kind.index('wINF') << 12) |
+        (message.info_kind.index('iNOP') << 8))
 
 
 class SpadicServer:
@@ -58,6 +60,9 @@ class SpadicServer:
         def _run_dataB_server():
             _run_gen(SpadicDataServer, "B", self._spadic.read_groupB, port_base, debug)
 
+        def _run_metrics_server():
+            _run_gen(SpadicMetricsServer, metrics.registry, port_base, debug)
+
         self._rf_server = threading.Thread(name="RF server")
         self._rf_server.run = _run_rf_server
         self._rf_server.daemon = True
@@ -83,6 +88,11 @@ class SpadicServer:
         self._dataB_server.daemon = True
         self._dataB_server.start()
 
+        self._metrics_server = threading.Thread(name="Metrics server")
+        self._metrics_server.run = _run_metrics_server
+        self._metrics_server.daemon = True
+        self._metrics_server.start()
+
     def __enter__(self):
         self._spadic.__enter__()
         return self
@@ -92,10 +102,93 @@ class SpadicServer:
         if not self._stop.is_set():
             self._stop.set()
         for s in [self._rf_server, self._sr_server, self._cmd_server,
-                  self._dataA_server, self._dataB_server]:
+                  self._dataA_server, self._dataB_server,
+                  self._metrics_server]:
             s.join()
 
 
+#---------------------------------------------------------------------------
+
+def _run_chip_server(port_base, stop, kwargs):
+    """Run a SpadicServer until the stop event is set (in its own process)."""
+    with SpadicServer(port_base=port_base, **kwargs):
+        while not stop.wait(1):
+            pass
+
+
+class SpadicMultiServer:
+    """Serve several SPADIC chips, each one connected by its own FTDI device.
+
+    `devices` is a list of serial numbers of the FTDI devices (or USB bus
+    paths, if `by_device` is set). Each chip gets its own SpadicServer
+    running in a separate process, with the port base
+
+        port_base + i * port_stride
+
+    for the i-th device. A SpadicDirectoryServer at port_base tells clients
+    which chip is found at which port base (see SpadicDirectoryClient).
+    The port stride must be larger than the largest port offset.
+    The remaining keyword arguments are passed to each SpadicServer.
+    """
+    from .util import log as _log
+    def _debug(self, *text):
+        self._log.info(' '.join(map(str, text)))
+
+    def __init__(self, devices, port_base=None, port_stride=PORT_STRIDE,
+                       by_device=False, **kwargs):
+        # the ports of a chip must not overlap with those of the next chip
+        # or with the directory at port_base
+        if port_stride <= max(PORT_OFFSET.values()):
+            raise ValueError('port stride must be larger than %i' %
+                             max(PORT_OFFSET.values()))
+        port_base = port_base or PORT_BASE
+        self._stop = multiprocessing.Event()
+        self.chips = {}
+        self._processes = []
+        for (i, device) in enumerate(devices):
+            chip_port_base = port_base + i * port_stride
+            chip_kwargs = dict(kwargs)
+            chip_kwargs['ftdi_device' if by_device else 'ftdi_serial'] = device
+            p = multiprocessing.Process(name="SPADIC %s" % device,
+                                        target=_run_chip_server,
+                                        args=(chip_port_base, self._stop,
+                                              chip_kwargs))
+            p.daemon = True
+            self.chips[device] = chip_port_base
+            self._processes.append(p)
+
+        self._thread_stop = threading.Event()
+        def _run_directory_server():
+            with SpadicDirectoryServer(self.chips, port_base,
+                                       self._debug) as serv:
+                serv._stop = self._thread_stop
+                serv.run()
+        self._directory_server = threading.Thread(name="Directory server")
+        self._directory_server.run = _run_directory_server
+        self._directory_server.daemon = True
+
+    def __enter__(self):
+        for p in self._processes:
+            p.start()
+            self._debug(p.name, "started")
+        self._directory_server.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread_stop.set()
+        for p in self._processes:
+            p.join()
+            self._debug(p.name, "finished")
+        self._directory_server.join()
+
+    def alive(self):
+        """Return a dictionary {device: True/False} telling which chip
+        servers are still running."""
+        return {device: p.is_alive()
+                for (device, p) in zip(self.chips, self._processes)}
+
+
 #---------------------------------------------------------------------------
 
 class BaseServer:
@@ -240,6 +333,44 @@ class SpadicCmdServer(BaseRequestServer):
         self.send_command(decoded) # must be a number
 
 
+#---------------------------------------------------------------------------
+
+class SpadicMetricsServer(BaseRequestServer):
+    port_offset = PORT_OFFSET["METRICS"]
+
+    def __init__(self, registry, port_base=None, debug=None):
+        if debug:
+            def _debug(*args):
+                debug("[Metrics]", *args)
+        else:
+            _debug = None
+        BaseRequestServer.__init__(self, port_base, _debug)
+        self._registry = registry
+
+    def process(self, decoded):
+        # decoded must be a prefix of the requested metric names
+        return json.dumps(self._registry.snapshot(decoded))+'\n'
+
+
+#---------------------------------------------------------------------------
+
+class SpadicDirectoryServer(BaseRequestServer):
+    port_offset = PORT_OFFSET["DIRECTORY"]
+
+    def __init__(self, chips, port_base=None, debug=None):
+        if debug:
+            def _debug(*args):
+                debug("[Directory]", *args)
+        else:
+            _debug = None
+        BaseRequestServer.__init__(self, port_base, _debug)
+        self._chips = chips
+
+    def process(self, decoded):
+        # any request returns the port bases of all chips
+        return json.dumps(self._chips)+'\n'
+
+
 #---------------------------------------------------------------------------
 
 class BaseRegisterServer(BaseRequestServer):
@@ -328,12 +459,24 @@ class SpadicDataServer(BaseStreamServer):
         BaseStreamServer.__init__(self, port_base, _debug)
         self._data_read_func = data_read_func
 
+        m = metrics.registry.labelled(stage='server', lane=g)
+        self._messages_sent = m.counter('messages_sent')
+        self._bytes_sent = m.counter('bytes_sent')
+        self._keepalives_sent = m.counter('keepalive_words_sent')
+
     def read_data(self):
         # try to read data - if it fails, we return a NOP word instead of
         # None, so that we can detect if the client has disconnected
-        return self._data_read_func(timeout=1, raw=True) or [WNOP]
+        data = self._data_read_func(timeout=1, raw=True)
+        if data:
+            self._messages_sent.inc()
+        else:
+            self._keepalives_sent.inc()
+        return data or [WNOP]
 
     def encode_data(self, data):
         # encode as unsigned short (16 bit), big-endian byte order
-        return struct.pack('!'+str(len(data))+'H', *data)
+        encoded = struct.pack('!'+str(len(data))+'H', *data)
+        self._bytes_sent.inc(len(encoded))
+        return encoded
 
@@ -1,3 +1,7 @@
 PORT_BASE = 45000
-PORT_OFFSET = {"RF": 0, "SR": 1, "CMD": 2, "DATA_A": 3, "DATA_B": 4}
+PORT_OFFSET = {"RF": 0, "SR": 1, "CMD": 2, "DATA_A": 3, "DATA_B": 4,
+               "METRICS": 5, "DIRECTORY": 6}
+
+# distance between the port bases of the chips of a SpadicMultiServer
+PORT_STRIDE = 10
 
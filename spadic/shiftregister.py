@@ -38,12 +38,14 @@ class ShiftRegisterEntry:
         self.positions = positions
         self.size = len(positions)
         self._value = 0
+        self._dirty = True # changed since the last write/read operation?
 
     def set(self, value):
         """Set the value."""
         v = value % (2**self.size)
         if v != self._value:
             self._value = v
+            self._dirty = True
 
     def get(self):
         """Get the value."""
@@ -79,7 +81,11 @@ class ShiftRegisterEntry:
 
 
 class ShiftRegister(Mapping):
-    """Representation of a generic shift register."""
+    """Representation of a generic shift register.
+
+    Write operations can be collected in a transaction (begin/commit), so
+    that the shift register is written at most once.
+    """
 
     def __init__(self, length, register_map):
         """Set up all registers."""
@@ -94,6 +100,7 @@ class ShiftRegister(Mapping):
 
         self._last_bits = None
         self._known = False
+        self._deferred = False
 
     # collections.abc.Mapping provides __contains__, keys, items, values, get,
     # __eq__, and __ne__
@@ -126,12 +133,16 @@ class ShiftRegister(Mapping):
         # _last_bits instead of all 0's as initial bit string. A possible
         # disadvantage of this is that the unused bits will never be
         # cleared.
+        # Only the entries changed since the last write/read operation
+        # have to be inserted into _last_bits.
         if self._last_bits:
             bits = [b for b in self._last_bits]
+            names = [name for name in self if self[name]._dirty]
         else:
             bits = ['0']*self._length
+            names = list(self)
         #bits = ['0']*self._length
-        for name in self:
+        for name in names:
             pos = self[name].positions
             n = self[name].size
             value = self[name].get()
@@ -149,6 +160,7 @@ class ShiftRegister(Mapping):
                 value_bits[i] = bits[pos[i]]
             value = int(''.join(value_bits), 2)
             self[name].set(value)
+            self[name]._dirty = False
 
 
     def set(self, config):
@@ -164,12 +176,38 @@ class ShiftRegister(Mapping):
         return config
 
     def apply(self):
-        """Perform the write operation."""
+        """Perform the write operation.
+
+        Inside a transaction, nothing is done until it is committed.
+        """
+        if self._deferred:
+            return
         bits = self._to_bits()
         if bits != self._last_bits:
             self._write(bits)
             self._last_bits = bits
             self._known = False
+        for name in self:
+            self[name]._dirty = False
+
+    def begin(self):
+        """Defer the write operation until commit is called."""
+        self._deferred = True
+
+    def commit(self):
+        """Perform the write operation, if anything has changed."""
+        self._deferred = False
+        self.apply()
+
+    def abort(self):
+        """Stop deferring the write operation without writing anything.
+
+        The entries are restored to the last written or read values, if
+        there are any.
+        """
+        self._deferred = False
+        if self._last_bits:
+            self._from_bits(self._last_bits)
 
     def update(self):
         """Perform the read operation."""
@@ -1,161 +1,311 @@
-from itertools import cycle
+from collections import OrderedDict, deque, namedtuple
 import logging
+import time
 
-from .sequence_alignment import align_local
-from .registerfile import RegisterReadFailure
+from .registerfile import RegisterReadFailure, RegisterWriteFailure
 from .stsxyter_frame import AckType, DownlinkFrame, RequestType, UplinkReadData
 
+def sequence_number_count(frame_type):
+    """Return the number of distinct sequence numbers of a frame type."""
+    return 2 ** frame_type._fields['sequence_number']
+
+class WriteReport(namedtuple('WriteReport',
+        'operations retransmitted nacks failed duration')):
+    """Summary of a batch of register write operations.
+
+    >>> r = WriteReport(operations=100, retransmitted=2, nacks=1, failed=0,
+    ...                 duration=0.05)
+    >>> r.throughput
+    2000.0
+    """
+    __slots__ = ()
+
+    @property
+    def throughput(self):
+        """Number of successful write operations per second."""
+        if not self.duration:
+            return float('inf')
+        return (self.operations - self.failed) / self.duration
+
 class SpadicStsxyterRegisterAccess:
     """Read and write SPADIC registers using the STS-XYTER interface."""
 
+    # Maximum number of read requests waiting for a response. Responses
+    # carry only a 3-bit sequence number, so more pending requests could not
+    # be told apart.
+    read_window = sequence_number_count(UplinkReadData)
+
+    # Maximum number of downlink frames waiting for an Ack. Acks carry the
+    # full 4-bit sequence number.
+    write_window = sequence_number_count(DownlinkFrame)
+
+    # Time to wait for the next response before all pending requests are
+    # considered lost.
+    response_timeout = 0.1
+
+    # Number of retransmissions of a single request before giving up.
+    max_retries = 3
+
     def __init__(self, stsxyter, chip_address):
         self._stsxyter = stsxyter
         self._chip_address = chip_address
-        def sequence_number_count():
-            size = DownlinkFrame._fields['sequence_number']
-            return 2 ** size
-        self._sequence_numbers = cycle(range(sequence_number_count()))
+        self._sequence_number = 0
+        self._latched = None # last (address, value) with acknowledged WR_ADDR
         self._log = logging.getLogger(type(self).__name__)
 
+    def _next_sequence_number(self):
+        """Return the sequence number for the next downlink frame."""
+        n = self._sequence_number
+        self._sequence_number = (n + 1) % sequence_number_count(DownlinkFrame)
+        return n
+
     def write_registers(self, operations):
         """Perform register write operations as specified in the given list of
         (address, value) tuples.
+
+        Each operation consists of a pair of WR_ADDR and WR_DATA frames. The
+        frames are pipelined like read requests (see read_registers), and
+        an operation is finished when both frames are acknowledged. Only
+        operations with a NACKed or unacknowledged frame are retransmitted,
+        up to `max_retries` times each. If an operation still fails,
+        a RegisterWriteFailure exception is raised.
+
+        Return a WriteReport of the batch.
         """
-        def write_register_frames(reg_address, value):
-            for request, payload in [
-                (RequestType.WR_ADDR, reg_address),
-                (RequestType.WR_DATA, value)
-            ]:
-                yield DownlinkFrame(
-                    self._chip_address, next(self._sequence_numbers),
-                    request, payload
-                )
+        start = time.time()
+        operations = list(operations)
+        # Jobs 0..n-1 are the given operations, re-writes of registers
+        # overwritten after a lost WR_ADDR frame are appended to them.
+        jobs = list(operations)
+        retries = [0] * len(jobs)
+        todo = deque(enumerate(jobs))
+        failed = set()
+        num_retransmitted = 0
+        num_nacks = 0
 
-        def all_frames(operations):
-            for reg_address, value in operations:
-                for frame in write_register_frames(reg_address, value):
-                    yield frame
+        # Pending frames in the order they were sent, by sequence number.
+        pending = OrderedDict()
+        sequence_numbers = sequence_number_count(DownlinkFrame)
 
-        # Send and remember all write requests.
-        requests = list(all_frames(operations))
-        for r in requests:
-            self._stsxyter.write(r)
+        # Last value sent to each register address.
+        sent = {}
 
-        # Collect all Ack frames available, waiting as short as possible for
-        # the last one.
-        acks = iter(lambda: self._stsxyter.read_ack(timeout=0.01), None)
+        def retransmit(frames):
+            """Put the operations of the given frames back in front of the
+            remaining ones, unless they have been retransmitted too often
+            already."""
+            nonlocal num_retransmitted
+            indexes = {index for (index, _) in frames}
+            if (self._latched is not None and
+                any(int(frame.request_type) == RequestType.WR_ADDR
+                    for (_, frame) in frames)):
+                # The WR_DATA frame following a lost WR_ADDR frame has been
+                # written to the address set before, so that register has
+                # to be written again (once, unless already queued).
+                address, value = self._latched
+                rewrite = (address, sent.get(address, value))
+                if not any(jobs[i] == rewrite for (i, _) in todo):
+                    jobs.append(rewrite)
+                    retries.append(0)
+                    indexes.add(len(jobs) - 1)
+            for index in sorted(indexes, reverse=True):
+                # Ignore the Ack of the other frame of the operation, but
+                # keep its sequence number reserved until it arrives.
+                for key, (i, frame) in list(pending.items()):
+                    if i == index:
+                        pending[key] = (None, frame)
+                if retries[index] < self.max_retries:
+                    retries[index] += 1
+                    num_retransmitted += 1
+                    todo.appendleft((index, jobs[index]))
+                else:
+                    failed.add(index)
 
-        # TODO check CRC errors and if acks match requests
+        def next_pair_fits():
+            n = self._sequence_number
+            return all((n + i) % sequence_numbers not in pending
+                       for i in range(2))
 
-    def read_registers(self, addresses, attempt_alignment=True):
-        """Generate register read results corresponding to a list of addresses.
+        while todo or pending:
+            # Refill the window with pairs of WR_ADDR and WR_DATA frames.
+            while (todo and len(pending) + 2 <= self.write_window and
+                   next_pair_fits()):
+                index, (reg_address, value) = todo.popleft()
+                for request, payload in [
+                    (RequestType.WR_ADDR, reg_address),
+                    (RequestType.WR_DATA, value)
+                ]:
+                    frame = DownlinkFrame(
+                        self._chip_address, self._next_sequence_number(),
+                        request, payload
+                    )
+                    pending[int(frame.sequence_number)] = (index, frame)
+                    self._stsxyter.write(frame)
+                sent[reg_address] = value
 
-        If the sequence numbers in read requests and responses do not
-        correspond exactly, attempt to align them. Unmatched read requests will
-        result in a read value of None.
+            ack = self._stsxyter.read_ack(timeout=self.response_timeout)
 
-        If it is required that all read requests are successfully handled on
-        the first try, the alignment attempt can be disabled. In this case,
-        a RegisterReadFailure exception is raised.
-        """
+            if ack is None:
+                # Nothing arrived in time, all pending frames are lost.
+                lost = [(index, frame) for (index, frame) in pending.values()
+                        if index is not None]
+                pending.clear()
+                retransmit(lost)
+                continue
 
-        # Send and remember all read requests.
-        def read_register_frame(register_address):
-            return DownlinkFrame(
-                self._chip_address, next(self._sequence_numbers),
-                RequestType.RD_DATA, register_address
-            )
-
-        requests = [read_register_frame(a) for a in addresses]
-
-        # TODO limit number of pending responses - to 8? to 1?
-        for r in requests:
-            self._stsxyter.write(r)
-
-        def expected_sequence_number(request):
-            """Return the sequence number expected in the response
-            corresponding to the request."""
-            size = UplinkReadData._fields['sequence_number']
-            return int(request.sequence_number) % (2 ** size)
-
-        expected_sequence_numbers = [
-            expected_sequence_number(r) for r in requests
-        ]
-
-        # Try to read as many responses as requests were sent (with a short
-        # timeout).
-        responses = list(filter(None, (self._stsxyter.read_data(timeout=0.1)
-                                       for _ in requests)))
-
-        # Hope for the easily handled correct case.
-        def returned_sequence_number(response):
-            """Return the sequence number found in the response, or None if
-            the CRC of the response is incorrect."""
-            return (int(response.sequence_number)
-                    if response.crc_is_correct else None)
-
-        returned_sequence_numbers = [
-            returned_sequence_number(r) for r in responses
-        ]
-
-        def read_results_simple(responses):
-            """Generate register read values from responses."""
-            for response in responses:
-                yield int(response.data)
-
-        if returned_sequence_numbers == expected_sequence_numbers:
-            return read_results_simple(responses)
-
-        # There could be several reasons why the results are not correct:
-        #
-        # a) Excessive RDdata frames (maybe misidentified other frames)
-        # b) Missing RDdata frames (maybe due to CRC error in request)
-        # c) RDdata frames with wrong sequence numbers and/or CRC errors
-        #
-        # To resolve cases a) and b), try to read all remaining RDdata frames
-        # that are available within a small timeout (for a) this "cleans up"
-        # for future register read operations, for b) maybe the missing
-        # responses are received).
-        #
-        # Additionally read all Ack frames (which are sent with ack code "not
-        # acknowledged") when a register read operation failed due to CRC error
-        # in the request) available within a small timeout, to "clean up" for
-        # future register write operations.
-        responses.extend(
-            iter(lambda: self._stsxyter.read_data(timeout=0.1), None)
+            key = int(ack.sequence_number)
+            if not ack.crc_is_correct or key not in pending:
+                continue
+            ack_type = int(ack.ack)
+            if ack_type not in [AckType.ACK, AckType.NACK]:
+                continue
+
+            # Acks arrive in the same order as the frames, so all frames sent
+            # before the acknowledged one have lost their Ack.
+            lost = []
+            for k in list(pending):
+                if k == key:
+                    break
+                index, frame = pending.pop(k)
+                if index is not None:
+                    lost.append((index, frame))
+            index, frame = pending.pop(key)
+            if index is None:
+                # frame of an operation that is retransmitted anyway
+                if lost:
+                    retransmit(lost)
+                continue
+            if ack_type == AckType.NACK:
+                num_nacks += 1
+                lost.append((index, frame))
+            if lost:
+                retransmit(lost)
+            if (ack_type == AckType.ACK and
+                int(frame.request_type) == RequestType.WR_ADDR):
+                self._latched = jobs[index]
+
+        failed_addresses = sorted({jobs[i][0] for i in failed})
+        report = WriteReport(
+            operations=len(operations), retransmitted=num_retransmitted,
+            nacks=num_nacks, failed=len(failed_addresses),
+            duration=time.time()-start
         )
-        all_acks = iter(lambda: self._stsxyter.read_ack(timeout=0.1), None)
-        nacks = [a for a in all_acks if int(a.ack) == AckType.NACK]
-
-        # Hope again for the simple and correct case.
-        returned_sequence_numbers = [
-            returned_sequence_number(r) for r in responses
-        ]
-
-        if returned_sequence_numbers == expected_sequence_numbers:
-            return read_results_simple(responses)
-
-        # Attempt to align the received responses with the requests, or give up
-        # and raise an exception.
-        if not attempt_alignment:
-            raise RegisterReadFailure
-
-        alignment = dict(align_local(
-            expected_sequence_numbers, returned_sequence_numbers
-        ))
-
-        def read_values_aligned(requests, responses, alignment):
-            """Generate register read results from aligned requests and
-            responses. Use None as value if there is no matching response to
-            a request."""
-            for i, _ in enumerate(requests):
-                j = alignment.get(i, None)
-                reg_value = None if j is None else int(responses[j].data)
-                yield reg_value
-
-        self._log.info('Matched {} responses to {}/{} requests. '
+        self._log.info('Wrote {}/{} registers with {} retransmissions '
+                       'in {:.3f} s ({:.0f} registers/s). Received {} NACKs.'
+                       .format(report.operations - report.failed,
+                               report.operations, report.retransmitted,
+                               report.duration, report.throughput,
+                               report.nacks))
+
+        if failed:
+            raise RegisterWriteFailure('Could not write registers at {}.'
+                .format(', '.join(hex(a) for a in failed_addresses)))
+
+        return report
+
+    def read_registers(self, addresses, allow_missing=True):
+        """Return an iterator over the values read from a list of register
+        addresses.
+
+        The read requests are pipelined: up to `read_window` requests are
+        sent ahead, and the window is refilled as the responses arrive.
+        Requests that are NACKed or whose response is missing are
+        retransmitted, up to `max_retries` times each.
+
+        Registers that could still not be read have the value None. If this
+        is not acceptable, `allow_missing` can be set to False, and
+        a RegisterReadFailure exception is raised instead.
+        """
+        addresses = list(addresses)
+        results = [None] * len(addresses)
+        retries = [0] * len(addresses)
+        todo = deque(enumerate(addresses))
+        failed = []
+        num_retransmitted = 0
+        num_nacks = 0
+
+        # Pending requests in the order they were sent, by the sequence
+        # number expected in the response.
+        pending = OrderedDict()
+        response_sequence_numbers = sequence_number_count(UplinkReadData)
+
+        def retransmit(entries):
+            """Put requests back in front of the remaining ones, unless they
+            have been retransmitted too often already."""
+            nonlocal num_retransmitted
+            for index, address in reversed(entries):
+                if retries[index] < self.max_retries:
+                    retries[index] += 1
+                    num_retransmitted += 1
+                    todo.appendleft((index, address))
+                else:
+                    failed.append(index)
+
+        while todo or pending:
+            # Refill the window, as long as the response to the next
+            # request can be told apart from the pending ones.
+            while (todo and len(pending) < self.read_window and
+                   self._sequence_number % response_sequence_numbers
+                   not in pending):
+                index, address = todo.popleft()
+                request = DownlinkFrame(
+                    self._chip_address, self._next_sequence_number(),
+                    RequestType.RD_DATA, address
+                )
+                key = (int(request.sequence_number)
+                       % response_sequence_numbers)
+                pending[key] = (index, address, request)
+                self._stsxyter.write(request)
+
+            response = self._stsxyter.read_data(timeout=self.response_timeout)
+
+            # Read requests with a CRC error are answered by a NACK.
+            nacked = []
+            for ack in iter(lambda: self._stsxyter.read_ack(timeout=0), None):
+                if not (ack.crc_is_correct and int(ack.ack) == AckType.NACK):
+                    continue
+                num_nacks += 1
+                for key, (index, address, request) in list(pending.items()):
+                    if (int(request.sequence_number)
+                            == int(ack.sequence_number)):
+                        del pending[key]
+                        nacked.append((index, address))
+            retransmit(nacked)
+
+            if response is None:
+                # Nothing arrived in time, all pending requests are lost.
+                retransmit([(index, address)
+                            for (index, address, _) in pending.values()])
+                pending.clear()
+                continue
+
+            key = int(response.sequence_number)
+            if not response.crc_is_correct or key not in pending:
+                # Either not trustworthy or a stale response to a request
+                # that was already given up, the pending requests will be
+                # retransmitted eventually.
+                continue
+
+            # Responses arrive in the same order as the requests, so all
+            # requests sent before the matched one have lost their response.
+            lost = []
+            for k in list(pending):
+                if k == key:
+                    break
+                index, address, _ = pending.pop(k)
+                lost.append((index, address))
+            retransmit(lost)
+
+            index, _, _ = pending.pop(key)
+            results[index] = int(response.data)
+
+        self._log.info('Read {}/{} registers with {} retransmissions. '
                        'Received {} NACKs.'
-                       .format(len(responses), len(alignment), len(requests),
-                               len(nacks)))
+                       .format(len(addresses) - len(failed), len(addresses),
+                               num_retransmitted, num_nacks))
+
+        if failed and not allow_missing:
+            raise RegisterReadFailure('Could not read registers at {}.'
+                .format(', '.join(hex(addresses[i]) for i in sorted(failed))))
 
-        return read_values_aligned(requests, responses, alignment)
+        return iter(results)
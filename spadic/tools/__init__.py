@@ -1,8 +1,22 @@
+from .calibration import SpadicCalibration
+from .cluster import ClusterFinder
+from .event_builder import EventBuilder
 from .monitor import SpadicDataMonitor
+from .recorder import SpadicRecorder
+from .scan import SpadicScan
 from .scope import SpadicScope
+from .statistics import PulseStatistics
 
+del calibration
+del cluster
+del event_builder
 del monitor
+del recorder
+del scan
 del scope
+del statistics
 
-__all__ = ['SpadicDataMonitor', 'SpadicScope']
+__all__ = ['SpadicCalibration', 'ClusterFinder', 'EventBuilder',
+           'SpadicDataMonitor', 'SpadicRecorder', 'SpadicScan',
+           'SpadicScope', 'PulseStatistics']
 
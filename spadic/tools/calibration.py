@@ -0,0 +1,193 @@
+"""
+Pedestal and noise calibration with forced triggers.
+
+All channels are triggered with the DLM force trigger (DLM 11), and the
+samples of the pulses are accumulated per channel and sample index (sum,
+sum of squares, minimum, maximum) without storing the pulses. The result
+is written as a table with one line per channel:
+
+    channel  count  pedestal  noise  min  max
+
+where pedestal and noise are the mean and the RMS of all samples of the
+channel. The table can be loaded with read_table, e.g. for the scope
+(pedestal subtraction) or as target for the baseline trims (see
+scan.optimal_trims).
+"""
+
+import numpy as np
+import threading
+import time
+
+from .session import SpadicSession
+from .statistics import hit_data, samples_array
+from .statistics import NUM_CHANNELS, SAMPLE_MIN, SAMPLE_MAX
+
+NUM_SAMPLES = 32
+TABLE_COLUMNS = ['channel', 'count', 'pedestal', 'noise', 'min', 'max']
+
+
+class SampleAccumulator:
+    """
+    Per-channel and per-sample accumulators of the received samples.
+
+    >>> a = SampleAccumulator()
+    >>> a.add_data([3, 3], [[-100, -102], [-98]])
+    >>> r = a.result()
+    >>> r['count'][3, :3].tolist(), r['mean'][3, :2].tolist()
+    ([2, 1, 0], [-99.0, -102.0])
+    >>> [round(float(r[k][3]), 3) for k in ['pedestal', 'noise']]
+    [-100.0, 1.633]
+    >>> int(r['min'][3, 0]), int(r['max'][3, 0]), int(r['min'][3, 2])
+    (-100, -98, 256)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discard all accumulated data."""
+        shape = (NUM_CHANNELS, NUM_SAMPLES)
+        with self._lock:
+            self._count = np.zeros(shape, int)
+            self._sum = np.zeros(shape)
+            self._sum2 = np.zeros(shape)
+            self._min = np.full(shape, SAMPLE_MAX + 1)
+            self._max = np.full(shape, SAMPLE_MIN - 1)
+
+    def add_messages(self, messages, group='A'):
+        """
+        Add a batch of raw messages (lists of words) of the given group.
+
+        Can be used as a SpadicDataMonitor listener.
+        """
+        self.add_data(*hit_data(messages, group))
+
+    def add_data(self, channels, data):
+        """Add a batch of pulses (lists of samples) of the given channels."""
+        if not len(data):
+            return
+        samples, valid = samples_array(data, NUM_SAMPLES)
+        channels = np.broadcast_to(np.asarray(channels, int)[:, np.newaxis],
+                                   samples.shape)
+        # flat index channel * NUM_SAMPLES + sample index
+        index = (channels * NUM_SAMPLES + np.arange(NUM_SAMPLES))[valid]
+        values = samples[valid]
+        size = NUM_CHANNELS * NUM_SAMPLES
+        count = np.bincount(index, minlength=size)
+        s = np.bincount(index, values, minlength=size)
+        s2 = np.bincount(index, values.astype(float)**2, minlength=size)
+        with self._lock:
+            self._count += count.reshape(self._count.shape)
+            self._sum += s.reshape(self._sum.shape)
+            self._sum2 += s2.reshape(self._sum2.shape)
+            np.minimum.at(self._min.reshape(-1), index, values)
+            np.maximum.at(self._max.reshape(-1), index, values)
+
+    def result(self):
+        """
+        Return the accumulated statistics as a dictionary of arrays:
+
+        count, mean, rms, min, max: per channel and sample index
+        pedestal, noise:            per channel, of all samples
+
+        (NaN where there is no data, min/max out of range)
+        """
+        with self._lock:
+            n = self._count.copy()
+            s = self._sum.copy()
+            s2 = self._sum2.copy()
+            vmin = self._min.copy()
+            vmax = self._max.copy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s / n
+            n_ch = n.sum(axis=1)
+            pedestal = s.sum(axis=1) / n_ch
+            return {
+                'count':    n,
+                'mean':     mean,
+                'rms':      np.sqrt(np.maximum(s2 / n - mean**2, 0)),
+                'min':      vmin,
+                'max':      vmax,
+                'pedestal': pedestal,
+                'noise':    np.sqrt(np.maximum(
+                                s2.sum(axis=1) / n_ch - pedestal**2, 0)),
+            }
+
+
+def write_table(filename, result):
+    """Write the per-channel pedestal and noise table of a
+    SampleAccumulator result."""
+    n = result['count']
+    table = np.column_stack([np.arange(NUM_CHANNELS), n.sum(axis=1),
+                             result['pedestal'], result['noise'],
+                             np.where(n, result['min'], 0).min(axis=1),
+                             np.where(n, result['max'], 0).max(axis=1)])
+    np.savetxt(filename, table, fmt=['%2i', '%8i', '%9.3f', '%7.3f',
+                                     '%4i', '%4i'],
+               header='  '.join(TABLE_COLUMNS))
+
+def read_table(filename):
+    """
+    Read a pedestal and noise table, return a dictionary of arrays with
+    one entry per channel.
+
+    >>> import tempfile
+    >>> a = SampleAccumulator()
+    >>> a.add_data([0, 0, 5], [[10, 12], [14], [-3, -5]])
+    >>> with tempfile.NamedTemporaryFile(suffix='.txt') as f:
+    ...     write_table(f.name, a.result())
+    ...     t = read_table(f.name)
+    >>> t['pedestal'][[0, 5]].tolist(), float(t['noise'][5]), int(t['max'][0])
+    ([12.0, -4.0], 1.0, 14)
+    """
+    table = np.loadtxt(filename, ndmin=2)
+    result = {name: table[:, i] for (i, name) in enumerate(TABLE_COLUMNS)}
+    for name in ['channel', 'count', 'min', 'max']:
+        result[name] = result[name].astype(int)
+    return result
+
+
+class SpadicCalibration(SpadicSession):
+    """
+    Pedestal and noise calibration run on a SpadicServer.
+
+    During a run, all channels are enabled and their trigger input is set
+    (triggerMaskA/B), then the DLM force trigger is sent `num` times at
+    the given rate (per second). The original configuration is restored
+    afterwards. Example:
+
+        with SpadicCalibration('localhost') as cal:
+            result = cal.run(1000)
+        write_table('pedestals.txt', result)
+    """
+    name = 'calibration'
+
+    def __init__(self, host, port_base=None, settle=0.2):
+        self.settle = settle
+        self.accumulator = SampleAccumulator()
+        self._running = threading.Event()
+        SpadicSession.__init__(self, host, port_base)
+
+    def _received(self, group, messages):
+        if self._running.is_set():
+            self.accumulator.add_messages(messages, group)
+
+    def run(self, num, rate=100):
+        """Send num force triggers and return the accumulated statistics
+        (see SampleAccumulator.result)."""
+        with self._restored():
+            with self.control.transaction():
+                for ch in self.control.digital.channel:
+                    ch.write(enable=1, entrigger=1)
+            time.sleep(self.settle) # discard data of the old configuration
+            self.accumulator.reset()
+            self._running.set()
+            try:
+                period = 1 / rate
+                for i in range(num):
+                    self.ctrl_client.send_command(11)
+                    time.sleep(period)
+                time.sleep(self.settle) # wait for the last pulses
+            finally:
+                self._running.clear()
+        return self.accumulator.result()
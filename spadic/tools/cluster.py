@@ -0,0 +1,222 @@
+"""
+Online search for clusters of hits in adjacent channels.
+
+Hits belong to the same cluster if they are connected by a chain of hits
+which are at most `window` timestamp units apart, and if their channels
+are adjacent. Channels are numbered 0..31 along the detector: channels
+0..15 of group A, then channels 0..15 of group B, so that channel A.15 and
+channel B.0 are neighbors, like in the neighbor select matrix.
+
+The input is the time-ordered message stream of tools.event_builder.
+"""
+
+import numpy as np
+
+from spadic.message import Message
+
+CLUSTER_DTYPE = np.dtype([
+    ('time',          np.int64),   # timestamp of the first hit
+    ('duration',      np.int64),   # timestamp of last hit - first hit
+    ('first_channel', np.int16),   # channels 0..31 (see above)
+    ('last_channel',  np.int16),
+    ('size',          np.int16),   # number of hits
+    ('neighbor_hits', np.int16),   # hits of type hNBR or hSAN
+    ('charge',        np.float64), # sum of the charges of all hits
+])
+
+
+def pulse_charge(data):
+    """Default charge of a hit: maximum sample minus the first sample."""
+    return max(data) - data[0] if data else 0
+
+
+def cluster_labels(time, channel, window):
+    """
+    Return the cluster label of each hit: hits are connected if their
+    channels are the same or adjacent and their timestamps are at most
+    `window` apart, and clusters are the connected groups of hits. Each
+    label is the smallest index of the hits of its cluster.
+
+    >>> cluster_labels([0, 1, 2, 5], [4, 5, 7, 4], window=2).tolist()
+    [0, 0, 2, 3]
+    """
+    time = np.asarray(time, np.int64)
+    channel = np.asarray(channel, np.int64)
+    n = len(time)
+    if not n:
+        return np.zeros(0, np.int64)
+
+    # sort by channel, then time, as one key per hit
+    t = time - time.min()
+    span = int(t.max()) + 2 * window + 1
+    key = channel * span + t
+    order = np.argsort(key, kind='stable')
+    key = key[order]
+
+    # Edges between hits of the same channel: consecutive hits within the
+    # window. Edges to the next channel: from each hit to the earliest and
+    # the latest hit of that channel within the window. The hits between
+    # those two are connected to one of them by the same-channel edges, as
+    # all of them lie in an interval of twice the window.
+    same = np.flatnonzero(np.diff(key) <= window)
+    u = [order[same]]
+    v = [order[same + 1]]
+    next_channel = key + span
+    lo = np.searchsorted(key, next_channel - window, 'left')
+    hi = np.searchsorted(key, next_channel + window, 'right') - 1
+    found = lo <= hi
+    for j in [lo, hi]:
+        u.append(order[found])
+        v.append(order[j[found]])
+    u = np.concatenate(u)
+    v = np.concatenate(v)
+
+    # connected components by propagating the smallest label
+    labels = np.arange(n)
+    while True:
+        m = np.minimum(labels[u], labels[v])
+        new = labels.copy()
+        np.minimum.at(new, u, m)
+        np.minimum.at(new, v, m)
+        new = new[new] # pointer jumping
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def _make_clusters(time, channel, charge, neighbor, labels):
+    """Return the clusters of hits with the given labels, ordered by the
+    time of their first hit."""
+    n = len(time)
+    if not n:
+        return np.zeros(0, CLUSTER_DTYPE)
+    order = np.lexsort((channel, labels))
+    time, channel = time[order], channel[order]
+    charge, neighbor = charge[order], neighbor[order]
+    labels = labels[order]
+    new = np.ones(n, bool)
+    new[1:] = labels[1:] != labels[:-1]
+    start = np.flatnonzero(new)
+
+    clusters = np.zeros(len(start), CLUSTER_DTYPE)
+    clusters['time'] = np.minimum.reduceat(time, start)
+    clusters['duration'] = np.maximum.reduceat(time, start) - clusters['time']
+    clusters['first_channel'] = channel[start]
+    clusters['last_channel'] = np.maximum.reduceat(channel, start)
+    clusters['size'] = np.diff(np.append(start, n))
+    clusters['neighbor_hits'] = np.add.reduceat(neighbor.astype(np.int64),
+                                                start)
+    clusters['charge'] = np.add.reduceat(charge, start)
+    return clusters[np.lexsort((clusters['first_channel'],
+                                clusters['time']))]
+
+
+def find_clusters(time, channel, charge, neighbor, window):
+    """
+    Find the clusters in arrays of hit data (see cluster_labels).
+
+    time, channel, charge: arrays with the data of each hit
+    neighbor: boolean array telling which hits are neighbor triggered
+
+    Return a structured array with dtype CLUSTER_DTYPE, ordered by time.
+
+    >>> c = find_clusters(time=[0, 1, 2, 10, 50], channel=[4, 5, 7, 6, 4],
+    ...                   charge=[10, 20, 5, 5, 1],
+    ...                   neighbor=[False, True, False, True, False],
+    ...                   window=2)
+    >>> [tuple(int(x) for x in r) for r in c]
+    [(0, 1, 4, 5, 2, 1, 30), (2, 0, 7, 7, 1, 0, 5), (10, 0, 6, 6, 1, 1, 5), (50, 0, 4, 4, 1, 0, 1)]
+
+    Hits of other channels do not connect hits that are far apart in time:
+
+    >>> busy = list(range(0, 201))
+    >>> c = find_clusters(time=[0, 200] + busy, channel=[4, 5] + [20]*201,
+    ...                   charge=[1]*203, neighbor=[False]*203, window=2)
+    >>> [tuple(int(x) for x in r)[:5] for r in c]
+    [(0, 0, 4, 4, 1), (0, 200, 20, 20, 201), (200, 0, 5, 5, 1)]
+    """
+    time = np.asarray(time, np.int64)
+    channel = np.asarray(channel, np.int64)
+    labels = cluster_labels(time, channel, window)
+    return _make_clusters(time, channel, np.asarray(charge, np.float64),
+                          np.asarray(neighbor, bool), labels)
+
+
+class ClusterFinder:
+    """
+    Find clusters in a time-ordered stream of hits.
+
+    A cluster is held back until a hit newer than its latest hit plus the
+    window has arrived, so that no later hit can belong to it. The charge
+    of each hit is computed from its samples by the `charge` function
+    (default: pulse_charge).
+
+    >>> f = ClusterFinder(window=2)
+    >>> hit = lambda ch, ts, data: [0x8000 | ch, 0x9000 | ts,
+    ...                             0xA000 | (data >> 3), (data & 7) << 12,
+    ...                             0xB000 | (1 << 6) | 0x20]
+    >>> len(f.add([(0, 0, hit(15, 0, 0)), (1, 1, hit(0, 1, 0))]))
+    0
+    >>> c = f.add([(2, 0, hit(3, 2, 0)), (4, 0, hit(3, 4, 0))])
+    >>> [(int(c['first_channel']), int(c['size'])) for c in c]
+    [(15, 2)]
+    >>> [(int(c['first_channel']), int(c['size'])) for c in f.flush()]
+    [(3, 2)]
+    """
+    def __init__(self, window=2, charge=pulse_charge):
+        self.window = window
+        self.charge = charge
+        self._time = np.zeros(0, np.int64)
+        self._channel = np.zeros(0, np.int64)
+        self._charge = np.zeros(0, np.float64)
+        self._neighbor = np.zeros(0, bool)
+
+    def add(self, items):
+        """
+        Add a list of (timestamp, lane, message) tuples, as released by an
+        EventBuilder. Messages which are no hits are ignored.
+
+        Return the clusters that are complete (see find_clusters).
+        """
+        hits = [(t, lane, Message(words)) for (t, lane, words) in items
+                if (words[0] & 0xF000) == 0x8000]
+        hits = [(t, lane, m) for (t, lane, m) in hits
+                if m.hit_type is not None]
+        n = len(hits)
+        self._time = np.append(self._time, np.fromiter(
+            (t for (t, _, _) in hits), np.int64, n))
+        self._channel = np.append(self._channel, np.fromiter(
+            (16*lane + m.channel_id for (_, lane, m) in hits), np.int64, n))
+        self._charge = np.append(self._charge, np.fromiter(
+            (self.charge(m.data()) for (_, _, m) in hits), np.float64, n))
+        self._neighbor = np.append(self._neighbor, np.fromiter(
+            (m.hit_type >= 2 for (_, _, m) in hits), bool, n))
+
+        if not len(self._time):
+            return np.zeros(0, CLUSTER_DTYPE)
+
+        # Later hits are not earlier than the newest one, so clusters whose
+        # latest hit is older than that minus the window are complete.
+        labels = cluster_labels(self._time, self._channel, self.window)
+        latest = np.full(len(labels), np.iinfo(np.int64).min)
+        np.maximum.at(latest, labels, self._time)
+        done = latest[labels] < self._time.max() - self.window
+        return self._release(done, labels)
+
+    def flush(self):
+        """Return the clusters of all hits that are held back."""
+        n = len(self._time)
+        return self._release(np.ones(n, bool),
+                             cluster_labels(self._time, self._channel,
+                                            self.window))
+
+    def _release(self, done, labels):
+        clusters = _make_clusters(self._time[done], self._channel[done],
+                                  self._charge[done], self._neighbor[done],
+                                  labels[done])
+        keep = ~done
+        self._time = self._time[keep]
+        self._channel = self._channel[keep]
+        self._charge = self._charge[keep]
+        self._neighbor = self._neighbor[keep]
+        return clusters
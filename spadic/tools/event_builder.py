@@ -0,0 +1,190 @@
+"""
+Reconstruction of full timestamps and time-ordered merging of the message
+streams of both lanes (groups A and B).
+
+Hit messages only contain a 12 bit timestamp. The upper bits (the epoch)
+are known from epoch marker messages (12 bit epoch count) and iSYN info
+words (lowest 8 bits of the epoch count). The full timestamp of a message
+is epoch * 4096 + timestamp, where the epoch is counted from the start of
+the stream without wrapping around.
+
+Messages are handled in batches of raw messages (lists of words), as
+returned by SpadicDataClient.read_messages.
+"""
+
+import numpy as np
+
+TIMESTAMP_BITS = 12
+
+
+def _unwrap(previous, value, bits):
+    """
+    Return the smallest number >= previous whose lowest bits are value.
+
+    >>> _unwrap(4095, 2, 12), _unwrap(5000, 5000 % 4096, 12)
+    (4098, 5000)
+    """
+    return previous + ((value - previous) % (1 << bits))
+
+
+def _words_at(messages, position):
+    """Return the words at the given position of all messages (0 if the
+    message is too short) as an array."""
+    return np.fromiter((m[position] if len(m) > position else 0
+                        for m in messages), np.int64, len(messages))
+
+
+class EpochTracker:
+    """
+    Keep track of the epoch of one lane and compute the full timestamps of
+    its messages.
+
+    >>> t = EpochTracker()
+    >>> t.timestamps([[0x8001, 0x9010, 0xB000],  # hit, timestamp 0x10
+    ...               [0x8000, 0x9000, 0xD001],  # epoch marker, epoch 1
+    ...               [0xF123],                  # info word
+    ...               [0x8002, 0x9005, 0xB000]]).tolist()
+    [16, 4096, 4096, 4101]
+    >>> t.timestamps([[0xF602], [0x8003, 0x9001, 0xB000]]).tolist()
+    [4101, 8193]
+    """
+    def __init__(self):
+        self.epoch = 0
+        self.last_timestamp = 0
+
+    def timestamps(self, messages):
+        """
+        Return the full timestamps of the given raw messages.
+
+        Messages without a timestamp (info words) get the timestamp of the
+        previous message, so that they stay in place when merging.
+        """
+        n = len(messages)
+        first = _words_at(messages, 0)
+        second = _words_at(messages, 1)
+        last = np.fromiter((m[-1] for m in messages), np.int64, n)
+        length = np.fromiter((len(m) for m in messages), np.int64, n)
+
+        som = (first & 0xF000) == 0x8000
+        has_timestamp = som & ((second & 0xF000) == 0x9000)
+        marker = som & ((last & 0xF000) == 0xD000)
+        sync = (length == 1) & ((first & 0xFF00) == 0xF600)
+
+        # the epoch changes only at a few messages -> loop over those
+        updates = np.flatnonzero(marker | sync)
+        epoch_at = np.empty(len(updates) + 1, np.int64)
+        epoch = epoch_at[0] = self.epoch
+        for (k, i) in enumerate(updates.tolist(), 1):
+            if marker[i]:
+                epoch = _unwrap(epoch, int(last[i]) & 0xFFF, 12)
+            else:
+                epoch = _unwrap(epoch, int(first[i]) & 0xFF, 8)
+            epoch_at[k] = epoch
+
+        # epoch of each message: that of the latest update before it
+        update_index = np.zeros(n, np.int64)
+        update_index[updates] = np.arange(1, len(updates) + 1)
+        epochs = epoch_at[np.maximum.accumulate(update_index)]
+        self.epoch = epoch
+
+        # messages without timestamp: use the previous timestamp
+        full = np.empty(n + 1, np.int64)
+        full[0] = self.last_timestamp
+        full[1:] = (epochs << TIMESTAMP_BITS) + (second & 0x0FFF)
+        previous = np.where(has_timestamp, np.arange(1, n + 1), 0)
+        result = full[np.maximum.accumulate(previous)]
+        if n:
+            self.last_timestamp = int(result[-1])
+        return result
+
+
+class EventBuilder:
+    """
+    Merge the messages of several lanes into one stream ordered by the full
+    timestamp.
+
+    Messages are held back until no earlier message can be expected
+    anymore: either all lanes have reached their timestamp, or they are
+    more than `window` timestamp units older than the latest message. At
+    most `max_pending` messages are held back, if there are more, the
+    oldest ones are released. Messages released after a later one are
+    counted in the `late` attribute.
+
+    >>> b = EventBuilder(window=100)
+    >>> b.add(0, [[0x8001, 0x9010, 0xB000], [0x8001, 0x9030, 0xB000]])
+    []
+    >>> [(t, lane) for (t, lane, m) in
+    ...  b.add(1, [[0x8002, 0x9020, 0xB000], [0x8002, 0x90A0, 0xB000]])]
+    [(16, 0), (32, 1), (48, 0)]
+    >>> [(t, lane) for (t, lane, m) in b.flush()]
+    [(160, 1)]
+    """
+    def __init__(self, lanes=2, window=4096, max_pending=2**16):
+        self.window = window
+        self.max_pending = max_pending
+        self.late = 0
+        self._trackers = [EpochTracker() for _ in range(lanes)]
+        self._latest = np.full(lanes, -1, np.int64) # -1: no data yet
+        self._last_released = -1
+        self._timestamps = np.zeros(0, np.int64)
+        self._lanes = np.zeros(0, np.int64)
+        self._messages = []
+
+    def add(self, lane, messages):
+        """
+        Add a batch of raw messages of the given lane.
+
+        Return a list of (timestamp, lane, message) tuples that can be
+        released, ordered by timestamp.
+        """
+        if not messages:
+            return []
+        ts = self._trackers[lane].timestamps(messages)
+        self._latest[lane] = max(self._latest[lane], ts.max())
+        self._timestamps = np.concatenate([self._timestamps, ts])
+        self._lanes = np.concatenate([self._lanes,
+                                      np.full(len(ts), lane, np.int64)])
+        self._messages.extend(messages)
+
+        limit = max(self._latest.min(), self._latest.max() - self.window)
+        ready = self._timestamps <= limit
+        excess = len(self._messages) - self.max_pending - ready.sum()
+        if excess > 0:
+            waiting = np.flatnonzero(~ready)
+            oldest = np.argsort(self._timestamps[waiting], kind='stable')
+            ready[waiting[oldest[:excess]]] = True
+        return self._release(ready)
+
+    def flush(self):
+        """Release all messages that are held back."""
+        return self._release(np.ones(len(self._messages), bool))
+
+    def _release(self, ready):
+        index = np.flatnonzero(ready)
+        index = index[np.argsort(self._timestamps[index], kind='stable')]
+        ts = self._timestamps[index]
+        if len(ts):
+            self.late += int((ts < self._last_released).sum())
+            self._last_released = max(self._last_released, int(ts[-1]))
+        result = list(zip(ts.tolist(), self._lanes[index].tolist(),
+                          [self._messages[i] for i in index.tolist()]))
+        keep = np.flatnonzero(~ready)
+        self._timestamps = self._timestamps[keep]
+        self._lanes = self._lanes[keep]
+        self._messages = [self._messages[i] for i in keep.tolist()]
+        return result
+
+
+def merged_messages(sources, timeout=0.1, **kwargs):
+    """
+    Read batches of raw messages from several sources (functions like
+    SpadicDataClient.read_messages) and generate (timestamp, lane, message)
+    tuples in time order, where lane is the index of the source.
+
+    The remaining keyword arguments are used for the EventBuilder.
+    """
+    builder = EventBuilder(len(sources), **kwargs)
+    while True:
+        for (lane, read) in enumerate(sources):
+            for item in builder.add(lane, read(timeout=timeout)):
+                yield item
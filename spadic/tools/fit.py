@@ -0,0 +1,167 @@
+"""
+Fitting of the expected pulse shape to many pulses at once.
+
+The model function is
+
+    f(x) = a * max((x-b) * exp(-(x-b)/t), 0) + c
+
+where b is the start of the pulse and t is approximately 2 (shaping time
+divided by sampling period).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# parameter order
+A, B, C, T = range(4)
+
+
+def mask_to_x(mask):
+    """
+    Convert the encoded 32 bit mask to x values.
+
+    Example: 0xF -> [28, 29, 30, 31]
+    """
+    return [31-i for i in reversed(list(range(32))) if (mask>>i)&1]
+
+
+def pulse_model(x, a, b, c, t):
+    """
+    Model function of the expected pulse shape.
+
+    The arguments can be arrays which are broadcast against each other.
+    """
+    u = x - b
+    return a * np.maximum(u*np.exp(-u/t), 0) + c
+
+
+def _model_jacobian(x, p):
+    """Return model values and derivatives with respect to the parameters.
+
+    x has shape (n, k), p has shape (n, 4). The derivatives have shape
+    (n, k, 4).
+    """
+    a, b, c, t = [p[:, i, np.newaxis] for i in range(4)]
+    u = x - b
+    e = np.exp(-u/t)
+    rising = u > 0
+    shape = np.where(rising, u*e, 0)
+    jac = np.empty(x.shape + (4,))
+    jac[..., A] = shape
+    jac[..., B] = np.where(rising, a*e*(u/t - 1), 0)
+    jac[..., C] = 1
+    jac[..., T] = np.where(rising, a*u*u*e/(t*t), 0)
+    return a*shape + c, jac
+
+
+def initial_parameters(x, y, valid, t=2.0):
+    """
+    Estimate the parameters from the baseline and the maximum of the pulses.
+
+    The maximum of the model function is a*t/e at x = b+t.
+    """
+    n = len(y)
+    c = np.where(valid[:, 0], y[:, 0], 0)
+    i_max = np.argmax(np.where(valid, y, -np.inf), axis=1)
+    y_max = y[np.arange(n), i_max]
+    x_max = x[np.arange(n), i_max]
+    p = np.empty((n, 4))
+    p[:, A] = (y_max - c) * np.e / t
+    p[:, B] = x_max - t
+    p[:, C] = c
+    p[:, T] = t
+    return p
+
+
+def fit_pulses(x, y, valid=None, p0=None, max_iter=50, tol=1e-6):
+    """
+    Fit the pulse model to many pulses at once (Levenberg-Marquardt).
+
+    x, y:  arrays of shape (n, k) with the x and y values of n pulses
+    valid: boolean array of shape (n, k), only these values are used
+           (default: all)
+    p0:    initial parameters (a, b, c, t) of shape (n, 4) or (4,)
+           (default: estimated by initial_parameters)
+
+    Return the fit parameters (shape (n, 4)) and the residuals y - f(x)
+    (shape (n, k)).
+
+    >>> x = np.tile(np.arange(16.0), (3, 1))
+    >>> p = np.array([[200, 2, -100, 2], [100, 3.5, -80, 2.5],
+    ...               [50, 1, 0, 1.5]])
+    >>> y = pulse_model(x, *[p[:, [i]] for i in range(4)])
+    >>> popt, res = fit_pulses(x, y)
+    >>> bool(np.allclose(popt, p) and np.allclose(res, 0, atol=1e-6))
+    True
+    """
+    x = np.asarray(x, float)
+    y = np.asarray(y, float)
+    if valid is None:
+        valid = np.ones(y.shape, bool)
+    if p0 is None:
+        p = initial_parameters(x, y, valid)
+    else:
+        p = np.array(np.broadcast_to(p0, (len(y), 4)), float)
+    w = valid.astype(float)
+
+    def cost(p):
+        f, jac = _model_jacobian(x, p)
+        r = (y - f) * w
+        return (r*r).sum(axis=1), r, jac
+
+    lam = np.full(len(y), 1e-3)
+    active = np.ones(len(y), bool)
+    s, r, jac = cost(p)
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        jw = jac * w[..., np.newaxis]
+        jtj = np.einsum('nki,nkj->nij', jw, jw)
+        jtr = np.einsum('nki,nk->ni', jw, r)
+        damping = lam[:, np.newaxis] * np.maximum(
+            np.diagonal(jtj, axis1=1, axis2=2), 1e-12)
+        jtj[:, range(4), range(4)] += damping
+        try:
+            step = np.linalg.solve(jtj, jtr[..., np.newaxis])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.stack([np.linalg.lstsq(m, v, rcond=None)[0]
+                             for (m, v) in zip(jtj, jtr)])
+        step[~active] = 0
+        p_new = p + step
+        p_new[:, T] = np.maximum(p_new[:, T], 1e-3)
+        s_new, r_new, jac_new = cost(p_new)
+        better = s_new < s
+        converged = better & (s - s_new <= tol * np.maximum(s, 1e-12))
+        p[better] = p_new[better]
+        r[better] = r_new[better]
+        jac[better] = jac_new[better]
+        s = np.where(better, s_new, s)
+        lam = np.where(better, lam / 10, lam * 10)
+        active &= ~converged & (lam < 1e10)
+    residuals = y - pulse_model(x, *[p[:, [i]] for i in range(4)])
+    return p, residuals
+
+
+class PulseFitter:
+    """
+    Fit pulses in a separate process, so that the calling thread (e.g. the
+    GUI) is not blocked.
+
+    fit() returns a concurrent.futures.Future whose result is the same as
+    the one of fit_pulses.
+    """
+    def __init__(self, processes=1):
+        self._executor = ProcessPoolExecutor(processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def fit(self, x, y, valid=None, **kwargs):
+        """Submit a batch of pulses to be fitted (see fit_pulses)."""
+        return self._executor.submit(fit_pulses, x, y, valid, **kwargs)
+
+    def shutdown(self):
+        self._executor.shutdown()
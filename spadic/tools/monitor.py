@@ -1,3 +1,4 @@
+import numpy as np
 import queue
 import threading
 import time
@@ -5,52 +6,119 @@ import time
 INF = float('inf')
 
 from spadic import SpadicDataClient, SpadicControlClient
+from spadic.message import Message
+
+
+def latest_per_channel(messages):
+    """
+    Find the latest data message of each channel in a list of raw messages.
+
+    The channel ID is taken directly from the start of message word, other
+    messages (info words or incomplete messages) are ignored. Return the
+    indices of the selected messages and their channel IDs.
+
+    >>> msgs = [[0x8003, 0xB000], [0xF000], [0x8001, 0xB000], [0x8003, 0xB000]]
+    >>> [a.tolist() for a in latest_per_channel(msgs)]
+    [[2, 3], [1, 3]]
+    """
+    first = np.fromiter((m[0] for m in messages), np.uint16, len(messages))
+    index = np.flatnonzero((first & 0xF000) == 0x8000)
+    # np.unique finds the first occurrence -> search in reversed order
+    index = index[::-1]
+    channel, first_reversed = np.unique(first[index] & 0x000F,
+                                        return_index=True)
+    index = index[first_reversed]
+    order = np.argsort(index)
+    return index[order], channel[order]
 
 
 class SpadicDataMonitor:
     """
     Continuously reads data, discarding any messages that come faster than
     the specified rate.
+
+    Messages are read in batches, of which only the latest message per
+    channel is decoded, and only if the data of that channel has expired.
+    Listeners (see add_listener) get every batch before this happens.
+
+    The hit logic configuration (needed for the selection mask) is read in
+    the background every `config_period` seconds. Each change of the
+    configuration gets a new version number, which is stored together with
+    the data.
     """
-    def __init__(self, host, rate=60):
+    def __init__(self, host, rate=60, config_period=1):
         self.dataA_client = SpadicDataClient('A', host)
         self.dataB_client = SpadicDataClient('B', host)
         self.ctrl_client = SpadicControlClient(host)
 
         self._period = 1.0/rate
+        self._config_period = config_period
+
+        # (version, hit logic configuration), replaced as a whole
+        self._config = (0, self.ctrl_client.control.hitlogic.read())
 
-        # data, mask, expiration date
+        # data, mask, config version
         self.data_buffer = [queue.Queue() for _ in range(32)]
-        self.data_expires = [-INF for _ in range(32)]
+        self.data_expires = np.full(32, -INF)
         self.last_data = [queue.Queue(maxsize=1) for _ in range(32)]
+        self._listeners = []
         self._stop = threading.Event()
         self.groupA_reader = threading.Thread(name="groupA_reader")
         self.groupB_reader = threading.Thread(name="groupB_reader")
         self.groupA_reader.run = self._read_group_task('A')
         self.groupB_reader.run = self._read_group_task('B')
+        self.config_reader = threading.Thread(name="config_reader")
+        self.config_reader.run = self._read_config_task
         self.groupA_reader.start()
         self.groupB_reader.start()
+        self.config_reader.start()
+
+    def _read_config_task(self):
+        while not self._stop.wait(self._config_period):
+            config = self.ctrl_client.control.hitlogic.read()
+            version, last_config = self._config
+            if config != last_config:
+                self._config = (version + 1, config)
+
+    def add_listener(self, callback):
+        """Call callback(messages, group) for every batch of raw messages
+        (lists of words) read from the given group ('A' or 'B').
+
+        The callback is executed in the reader thread of the group, so it
+        should be fast, e.g. statistics.PulseStatistics.add_messages.
+        """
+        self._listeners.append(callback)
+
+    def get_config(self):
+        """Get the version and the latest known hit logic configuration."""
+        return self._config
 
     def _read_group_task(self, group):
-        readmethod = {'A': self.dataA_client.read_message,
-                      'B': self.dataB_client.read_message}[group]
+        readmethod = {'A': self.dataA_client.read_messages,
+                      'B': self.dataB_client.read_messages}[group]
+        offset = {'A': 0, 'B': 16}[group]
         def read_group_task():
             while not self._stop.is_set():
-                m = readmethod(timeout=self._period)
+                messages = readmethod(timeout=self._period)
                 t = time.time()
-                if not m or m.channel_id is None:
+                if not messages:
                     continue
-                c = m.channel_id + {'A': 0, 'B': 16}[group]
-                if t < self.data_expires[c]:
-                    continue # data not yet expired
-                self.data_expires[c] = t + self._period
-                mask = self.ctrl_client.control.hitlogic.read()['mask']
-                if self.last_data[c].full():
-                    try:
-                        self.last_data[c].get(block=False)
-                    except queue.Empty:
-                        pass
-                self.last_data[c].put((m.data(), mask))
+                for callback in self._listeners:
+                    callback(messages, group)
+                index, channel = latest_per_channel(messages)
+                channel += offset
+                expired = t >= self.data_expires[channel]
+                index, channel = index[expired], channel[expired]
+                self.data_expires[channel] = t + self._period
+                version, config = self._config
+                for i, c in zip(index.tolist(), channel.tolist()):
+                    if self.last_data[c].full():
+                        try:
+                            self.last_data[c].get(block=False)
+                        except queue.Empty:
+                            pass
+                    data = Message(messages[i]).data()
+                    self.last_data[c].put((data, config['mask'], version))
         return read_group_task
 
     def __enter__(self):
@@ -59,12 +127,18 @@ class SpadicDataMonitor:
     def __exit__(self, *args, **kwargs):
         if not self._stop.is_set():
             self._stop.set()
-        for t in [self.groupA_reader, self.groupB_reader]:
+        for t in [self.groupA_reader, self.groupB_reader,
+                  self.config_reader]:
             while t.is_alive():
                 t.join(timeout=1)
 
-    def get_last_data(self, channel, **queue_args):
-        """Get the latest data of one channel."""
-        return self.last_data[channel].get(**queue_args)
+    def get_last_data(self, channel, version=False, **queue_args):
+        """Get the latest data of one channel.
+
+        Return (data, mask), or (data, mask, version) if the `version` flag
+        is set (see get_config).
+        """
+        data, mask, config_version = self.last_data[channel].get(**queue_args)
+        return (data, mask, config_version) if version else (data, mask)
 
 
@@ -0,0 +1,353 @@
+"""
+Lossless recording of all messages of both lanes into binary files.
+
+File format (all numbers little endian):
+
+    file header: b'SPADICREC' + format version (1 byte)
+    chunks:      chunk header (4 byte tag, uint32 n, uint32 m) + payload
+
+Data chunks (tag b'DATA') contain n messages with m words in total, stored
+as columns:
+
+    time    float64[n]  time of reception (seconds since the epoch)
+    lane    uint8[n]    0 (group A) or 1 (group B)
+    channel int8[n]     channel ID from the start of message word, or -1
+    length  uint16[n]   number of words of each message
+    words   uint16[m]   the words of all messages, one after the other
+
+Statistics chunks (tag b'STAT') contain m bytes of JSON with the counters
+of the recorder (see SpadicRecorder.counters). One is written at the end of
+each file.
+
+Chunks are only appended, so a file can be read while it is written, and
+everything up to the last complete chunk can be read after a crash.
+"""
+
+import json
+import numpy as np
+import queue
+import struct
+import threading
+import time
+
+from spadic import SpadicDataClient, SpadicMetricsClient
+from spadic import metrics
+from spadic.decoder import ParallelDecoder
+
+FILE_HEADER = b'SPADICREC\x01'
+CHUNK_HEADER = struct.Struct('<4sII')
+DATA_TAG = b'DATA'
+STAT_TAG = b'STAT'
+
+
+def data_chunk(times, lanes, messages):
+    """
+    Return the bytes of a data chunk with the given messages (lists of
+    words) and their reception times and lanes.
+    """
+    n = len(messages)
+    length = np.fromiter((len(m) for m in messages), np.uint16, n)
+    words = np.fromiter((w for m in messages for w in m), '<u2',
+                        int(length.sum()))
+    first = words[np.cumsum(length, dtype=int) - length]
+    channel = np.where((first & 0xF000) == 0x8000, first & 0x000F, -1)
+    return b''.join([
+        CHUNK_HEADER.pack(DATA_TAG, n, len(words)),
+        np.asarray(times, '<f8').tobytes(),
+        np.asarray(lanes, 'u1').tobytes(),
+        channel.astype('i1').tobytes(),
+        length.astype('<u2').tobytes(),
+        words.tobytes(),
+    ])
+
+
+def stat_chunk(counters):
+    """Return the bytes of a statistics chunk with the given counters."""
+    data = bytes(json.dumps(counters), 'utf-8')
+    return CHUNK_HEADER.pack(STAT_TAG, 0, len(data)) + data
+
+
+def read_chunks(filename):
+    """
+    Read a recorded file and generate (tag, payload) tuples for all
+    complete chunks.
+
+    The payload of a data chunk is a dictionary of arrays (see above), that
+    of a statistics chunk is the dictionary of counters.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix='.spr') as f:
+    ...     _ = f.write(FILE_HEADER)
+    ...     _ = f.write(data_chunk([1.0, 2.0], [0, 1],
+    ...                            [[0x8003, 0xB000], [0xF000]]))
+    ...     _ = f.write(stat_chunk({'messages': 2}))
+    ...     f.flush()
+    ...     chunks = list(read_chunks(f.name))
+    >>> chunks[0][1]['channel'].tolist(), chunks[0][1]['words'].tolist()
+    ([3, -1], [32771, 45056, 61440])
+    >>> chunks[1]
+    (b'STAT', {'messages': 2})
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(FILE_HEADER)) != FILE_HEADER:
+            raise ValueError('%s is not a recorder file' % filename)
+        while True:
+            header = f.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                return
+            tag, n, m = CHUNK_HEADER.unpack(header)
+            if tag == DATA_TAG:
+                columns = [('time', '<f8', n), ('lane', 'u1', n),
+                           ('channel', 'i1', n), ('length', '<u2', n),
+                           ('words', '<u2', m)]
+                size = sum(np.dtype(t).itemsize * k for (_, t, k) in columns)
+                payload = f.read(size)
+                if len(payload) < size:
+                    return
+                chunk = {}
+                pos = 0
+                for (name, t, k) in columns:
+                    chunk[name] = np.frombuffer(payload, t, k, pos)
+                    pos += np.dtype(t).itemsize * k
+                yield (tag, chunk)
+            elif tag == STAT_TAG:
+                payload = f.read(m)
+                if len(payload) < m:
+                    return
+                yield (tag, json.loads(str(payload, 'utf-8')))
+            else:
+                raise ValueError('unknown chunk type %r' % tag)
+
+
+def read_messages(filename):
+    """Generate (time, lane, words) for all messages in a recorded file."""
+    for (tag, chunk) in read_chunks(filename):
+        if tag != DATA_TAG:
+            continue
+        end = np.cumsum(chunk['length'], dtype=int)
+        words = chunk['words'].tolist()
+        for (t, lane, start, stop) in zip(chunk['time'].tolist(),
+                                          chunk['lane'].tolist(),
+                                          (end - chunk['length']).tolist(),
+                                          end.tolist()):
+            yield (t, lane, words[start:stop])
+
+def replay_messages(filename, processes=None, chunk_size=2**14):
+    """
+    Decode all messages in a recorded file in a pool of processes (see
+    decoder.ParallelDecoder) and generate (lane, messages) tuples with lists
+    of Message objects, in the recorded order of each lane.
+
+    >>> import tempfile
+    >>> m = lambda ch: [0x8000 | ch, 0x9000, 0xA000, 0x7000, 0xB040]
+    >>> with tempfile.NamedTemporaryFile(suffix='.spr') as f:
+    ...     _ = f.write(FILE_HEADER)
+    ...     _ = f.write(data_chunk([1.0, 1.0, 2.0], [0, 1, 0],
+    ...                            [m(1), m(2), m(3)]))
+    ...     _ = f.write(data_chunk([3.0], [1], [m(4)]))
+    ...     f.flush()
+    ...     lanes = {0: [], 1: []}
+    ...     for (lane, messages) in replay_messages(f.name, chunk_size=5):
+    ...         lanes[lane].extend((m.channel_id, m.data())
+    ...                            for m in messages)
+    >>> lanes
+    {0: [(1, [0]), (3, [0])], 1: [(2, [0]), (4, [0])]}
+    """
+    with ParallelDecoder(processes, chunk_size) as decoder:
+        lanes = set()
+        for (tag, chunk) in read_chunks(filename):
+            if tag != DATA_TAG:
+                continue
+            word_lanes = np.repeat(chunk['lane'], chunk['length'])
+            for lane in np.unique(chunk['lane']).tolist():
+                lanes.add(lane)
+                decoder.put(lane, chunk['words'][word_lanes == lane].tolist())
+            # pass on what is decoded already, without waiting
+            for lane in lanes:
+                yield from _decoded(decoder, lane, 0)
+        decoder.flush()
+        for lane in lanes:
+            yield from _decoded(decoder, lane, None)
+
+def _decoded(decoder, lane, timeout):
+    while decoder.pending(lane):
+        messages = decoder.get(lane, timeout)
+        if messages is None:
+            break
+        if messages:
+            yield (lane, messages)
+
+
+class SpadicRecorder:
+    """
+    Record all messages of both lanes from a SpadicServer.
+
+    Files are named <prefix>_0000.spr, <prefix>_0001.spr, ... A new file is
+    started when the current one is larger than `max_bytes` or older than
+    `max_seconds` (if given). Messages are written in chunks of at most
+    `chunk_size` messages, at least every `flush_interval` seconds.
+
+    Received messages are never discarded on this side. If the recorder
+    cannot keep up, the server discards messages, which is counted in the
+    server metrics (if available, see counters).
+    """
+    def __init__(self, host, prefix, port_base=None, groups='AB',
+                       max_bytes=2**30, max_seconds=None,
+                       chunk_size=2**14, flush_interval=1):
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+
+        self._clients = {}
+        self._metrics_client = None
+        # counters() is called from the writer thread (file rotation) and
+        # from other threads, requests and responses must not interleave
+        self._metrics_lock = threading.Lock()
+        try:
+            for g in groups:
+                self._clients['AB'.index(g.upper())] = SpadicDataClient(
+                    g, host, port_base, queue_size=0)
+            try:
+                self._metrics_client = SpadicMetricsClient(host, port_base)
+            except OSError:
+                pass
+            self._server_drops_start = self._server_drops()
+        except BaseException:
+            self._close_clients()
+            raise
+
+        m = metrics.registry.labelled(stage='recorder')
+        self._messages = m.counter('messages_written')
+        self._words = m.counter('words_written')
+        self._bytes = m.counter('bytes_written')
+        self._files = m.counter('files_written')
+        self._batches = queue.Queue()
+        m.gauge('batch_queue_depth', self._batches.qsize)
+        self._file = None
+        self._file_number = 0
+        self._start_time = None
+
+        self._stop = threading.Event()
+        self._stop_writer = threading.Event()
+        self._threads = []
+        for lane in self._clients:
+            t = threading.Thread(name='lane%s recorder' % 'AB'[lane])
+            t.run = self._read_task(lane)
+            t.daemon = True
+            self._threads.append(t)
+        self._writer = threading.Thread(name='file writer')
+        self._writer.run = self._write_task
+        self._writer.daemon = True
+
+    def __enter__(self):
+        self._start_time = time.time()
+        self._open_file()
+        for t in self._threads:
+            t.start()
+        self._writer.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        for t in self._threads:
+            while t.is_alive():
+                t.join(timeout=1)
+        self._stop_writer.set() # after all readers are finished
+        while self._writer.is_alive():
+            self._writer.join(timeout=1)
+        self._close_file()
+        self._close_clients()
+
+    def _close_clients(self):
+        for c in self._clients.values():
+            c.__exit__()
+        if self._metrics_client:
+            self._metrics_client.__exit__()
+
+    def _server_drops(self):
+        """Return the numbers of discarded messages/words of the server."""
+        if self._metrics_client is None:
+            return {}
+        try:
+            with self._metrics_lock:
+                return self._metrics_client.read('queue_overflows')
+        except (OSError, ValueError):
+            return {}
+
+    def counters(self):
+        """Return a dictionary with throughput and loss counters."""
+        elapsed = time.time() - (self._start_time or time.time())
+        start = self._server_drops_start
+        server_drops = {k: v - start.get(k, 0)
+                        for (k, v) in self._server_drops().items()}
+        return {
+            'messages':     self._messages.value,
+            'words':        self._words.value,
+            'bytes':        self._bytes.value,
+            'files':        self._files.value,
+            'elapsed':      elapsed,
+            'message_rate': self._messages.value / elapsed if elapsed else 0,
+            'byte_rate':    self._bytes.value / elapsed if elapsed else 0,
+            'server_drops': server_drops,
+        }
+
+    def _read_task(self, lane):
+        client = self._clients[lane]
+        def read_task():
+            while not self._stop.is_set():
+                messages = client.read_messages(timeout=0.1)
+                if messages:
+                    self._batches.put((time.time(), lane, messages))
+        return read_task
+
+    def _write_task(self):
+        times, lanes, messages = [], [], []
+        last_flush = time.time()
+        while True:
+            stopped = self._stop_writer.is_set()
+            try:
+                t, lane, batch = self._batches.get(timeout=0.1)
+                times += [t] * len(batch)
+                lanes += [lane] * len(batch)
+                messages += batch
+            except queue.Empty:
+                pass
+            now = time.time()
+            while messages and (len(messages) >= self.chunk_size or stopped
+                                or now - last_flush >= self.flush_interval):
+                n = self.chunk_size
+                self._write_chunk(times[:n], lanes[:n], messages[:n])
+                times, lanes, messages = times[n:], lanes[n:], messages[n:]
+                last_flush = now
+            if stopped and self._batches.empty():
+                break
+
+    def _write_chunk(self, times, lanes, messages):
+        chunk = data_chunk(times, lanes, messages)
+        self._file.write(chunk)
+        self._file.flush()
+        self._messages.inc(len(messages))
+        self._words.inc(sum(len(m) for m in messages))
+        self._bytes.inc(len(chunk))
+        too_large = self._file.tell() >= self.max_bytes
+        too_old = (self.max_seconds is not None and
+                   time.time() - self._file_opened >= self.max_seconds)
+        if too_large or too_old:
+            self._close_file()
+            self._open_file()
+
+    def _open_file(self):
+        name = '%s_%04i.spr' % (self.prefix, self._file_number)
+        self._file_number += 1
+        self._file = open(name, 'wb')
+        self._file.write(FILE_HEADER)
+        self._file_opened = time.time()
+
+    def _close_file(self):
+        # also available after the recorder is finished
+        self.last_counters = self.counters()
+        self._file.write(stat_chunk(self.last_counters))
+        self._file.close()
+        self._files.inc()
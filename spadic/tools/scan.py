@@ -0,0 +1,233 @@
+"""
+Automated scans of the hit logic thresholds and the baseline trims.
+
+A scan steps one setting through a range of values. Each step is written
+in one transaction (one RF batch or one SR write for all channels), then
+the data of both lanes is collected for a fixed dwell time. The hit rates
+and sample histograms of each step are accumulated in the background
+(see statistics.PulseStatistics) while the next step is written.
+"""
+
+import numpy as np
+import queue
+import threading
+import time
+
+from .session import SpadicSession
+from .statistics import hit_data, PulseStatistics, NUM_CHANNELS
+
+# parameter: (minimum, maximum) value
+PARAMETERS = {'threshold1': (-256, 255),
+              'threshold2': (-256, 255),
+              'baseline':   (0, 127)}
+
+
+def scurve_midpoints(values, rates):
+    """
+    Return the value at which the rate of each channel crosses half of its
+    maximum, interpolated linearly between the steps (NaN if the channel
+    has no hits).
+
+    values: array of the scanned values (one per step, increasing)
+    rates:  array of rates (steps x channels)
+
+    >>> scurve_midpoints([0, 1, 2, 3], [[10, 0], [10, 0], [4, 0], [0, 0]])
+    array([1.83333333,        nan])
+    """
+    x = np.asarray(values, float)
+    r = np.asarray(rates, float)
+    half = r.max(axis=0) / 2
+    result = np.full(r.shape[1], np.nan)
+    for c in np.flatnonzero(half > 0):
+        above = r[:, c] > half[c]
+        # last step above half the maximum, followed by one below
+        cross = np.flatnonzero(above[:-1] & ~above[1:])
+        if not len(cross):
+            continue
+        i = cross[-1]
+        r0, r1 = r[i, c], r[i+1, c]
+        result[c] = x[i] + (x[i+1] - x[i]) * (r0 - half[c]) / (r0 - r1)
+    return result
+
+def optimal_trims(values, baselines, target=None):
+    """
+    Return the trim value of each channel that brings its measured
+    baseline closest to the target (default: the median of the baselines
+    of all channels at the middle step). The target can also be given per
+    channel, e.g. from a pedestal table (see calibration.read_table). -1
+    where there is no data.
+
+    values:    array of the scanned trim values (one per step)
+    baselines: array of measured baselines (steps x channels)
+
+    >>> optimal_trims([0, 64, 127], [[-200, -100], [-50, 0], [100, 150]])
+    array([64, 64])
+    >>> optimal_trims([0, 64, 127], [[-200, -100], [-50, 0], [100, 150]],
+    ...               target=-100)
+    array([64,  0])
+    """
+    b = np.asarray(baselines, float)
+    if target is None:
+        middle = b[len(b)//2]
+        middle = middle[~np.isnan(middle)]
+        target = np.median(middle) if len(middle) else np.nan
+    dist = np.abs(b - target)
+    missing = np.isnan(dist).all(axis=0)
+    best = np.argmin(np.where(np.isnan(dist), np.inf, dist), axis=0)
+    return np.where(missing, -1, np.asarray(values)[best])
+
+
+class ScanResult:
+    """
+    Results of a scan, as arrays with one row per step and one column per
+    channel:
+
+    values:     the scanned values
+    counts:     number of hits (data messages)
+    rates:      hit rates (per second)
+    baseline:   mean of the first samples of the pulses (NaN if no hits)
+    noise:      RMS of these samples
+    histograms: sample histograms (steps x channels x bins)
+    bins:       sample values of the histogram bins
+    """
+    def __init__(self, parameter, values, dwell, hits, statistics):
+        self.parameter = parameter
+        self.values = np.asarray(values)
+        snapshots = [s.snapshot() for s in statistics]
+        self.counts = hits
+        self.rates = self.counts / dwell
+        self.baseline = np.array([s['baseline'] for s in snapshots])
+        self.noise = np.array([s['noise'] for s in snapshots])
+        self.histograms = np.array([s['sample_histogram']
+                                    for s in snapshots])
+        self.bins = snapshots[0]['bins']
+
+    def midpoints(self):
+        """Per-channel S-curve midpoints (see scurve_midpoints)."""
+        return scurve_midpoints(self.values, self.rates)
+
+    def optimal_trims(self, target=None):
+        """Per-channel baseline trims (see optimal_trims), only for
+        baseline scans."""
+        if self.parameter != 'baseline':
+            raise ValueError('not a baseline scan')
+        return optimal_trims(self.values, self.baseline, target)
+
+
+class SpadicScan(SpadicSession):
+    """
+    Scan the hit logic thresholds or the baseline trims of a SpadicServer.
+
+    For each step, the data received during `dwell` seconds is used,
+    starting `settle` seconds after the configuration was written.
+    Optionally, the DLM force trigger (DLM 11) is sent `dlm_trigger` times
+    per second during the dwell time, e.g. for baseline scans with the
+    threshold set above the noise (the trigger must be enabled with
+    triggerMaskA/B, see digital.DigitalChannel).
+
+    The original configuration is restored after each scan. Example:
+
+        with SpadicScan('localhost', dwell=0.5) as scan:
+            result = scan.run('threshold1', range(-256, 0, 4))
+            print(result.midpoints())
+            result = scan.run('baseline', range(0, 128, 8))
+            scan.apply_trims(result.optimal_trims())
+    """
+    name = 'scan'
+
+    def __init__(self, host, port_base=None, dwell=1, settle=0.05,
+                       dlm_trigger=0, baseline_samples=4):
+        self.dwell = dwell
+        self.settle = settle
+        self.dlm_trigger = dlm_trigger
+        self.baseline_samples = baseline_samples
+
+        # (step, start, end) of the current dwell time, replaced as a whole
+        self._window = None
+        self._batches = queue.Queue()
+        SpadicSession.__init__(self, host, port_base)
+
+    def _received(self, group, messages):
+        window = self._window
+        if window is None:
+            return
+        (step, start, end) = window
+        if start <= time.time() <= end:
+            self._batches.put((step, group, messages))
+
+    def _reduce_task(self, hits, statistics):
+        def reduce_task():
+            while True:
+                item = self._batches.get()
+                if item is None:
+                    break
+                (step, group, messages) = item
+                (channels, data) = hit_data(messages, group)
+                hits[step] += np.bincount(channels, minlength=NUM_CHANNELS)
+                statistics[step].add_data(channels, data)
+        return reduce_task
+
+    def _set(self, parameter, value, channels):
+        """Write one step in a single transaction."""
+        with self.control.transaction():
+            if parameter == 'baseline':
+                for c in channels:
+                    self.control.frontend.channel[c].write(baseline=value)
+            else:
+                self.control.hitlogic.write(**{parameter: value})
+
+    def run(self, parameter, values, channels=range(NUM_CHANNELS)):
+        """
+        Scan the parameter ('threshold1', 'threshold2' or 'baseline')
+        through the values. The baseline trim is set for the given
+        channels, the thresholds are global. Return a ScanResult.
+        """
+        if parameter not in PARAMETERS:
+            raise ValueError('unknown scan parameter: %s' % parameter)
+        values = list(values)
+        (vmin, vmax) = PARAMETERS[parameter]
+        if not values or min(values) < vmin or max(values) > vmax:
+            raise ValueError('valid %s range: %i..%i' %
+                             (parameter, vmin, vmax))
+        channels = list(channels)
+
+        hits = np.zeros((len(values), NUM_CHANNELS), int)
+        statistics = [PulseStatistics(self.baseline_samples)
+                      for _ in values]
+        with self._restored():
+            reducer = threading.Thread(name='scan reducer')
+            reducer.run = self._reduce_task(hits, statistics)
+            reducer.daemon = True
+            reducer.start()
+            try:
+                for (step, value) in enumerate(values):
+                    # the data of the previous step is still being reduced
+                    self._set(parameter, value, channels)
+                    start = time.time() + self.settle
+                    end = start + self.dwell
+                    self._window = (step, start, end)
+                    self._dwell(end)
+                    self._window = None
+            finally:
+                self._window = None
+                self._batches.put(None)
+                reducer.join()
+        return ScanResult(parameter, values, self.dwell, hits, statistics)
+
+    def _dwell(self, end):
+        if not self.dlm_trigger:
+            time.sleep(max(end - time.time(), 0))
+            return
+        period = 1 / self.dlm_trigger
+        while time.time() < end:
+            self.ctrl_client.send_command(11)
+            time.sleep(max(min(period, end - time.time()), 0))
+
+    def apply_trims(self, trims):
+        """Write the baseline trims of all channels (-1: unchanged) in one
+        transaction."""
+        with self.control.transaction():
+            for (c, trim) in enumerate(trims):
+                if trim >= 0:
+                    self.control.frontend.channel[c].write(
+                        baseline=int(trim))
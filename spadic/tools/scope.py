@@ -1,27 +1,63 @@
+import collections
 import numpy as np
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtGui, QtCore
 import queue
-import scipy.optimize
+import threading
 
+from .fit import PulseFitter, mask_to_x
+from .statistics import samples_array
 
-def mask_to_x(mask):
+
+def _join_curves(curves):
     """
-    Convert the encoded 32 bit mask to x values.
+    Concatenate (x, y) curves into one pair of arrays, separated by NaN, so
+    that they can be drawn as a single curve.
 
-    Example: 0xF -> [28, 29, 30, 31]
+    >>> x, y = _join_curves([([0, 1], [5, 6]), ([0], [7])])
+    >>> x.tolist(), y.tolist()
+    ([0.0, 1.0, nan, 0.0, nan], [5.0, 6.0, nan, 7.0, nan])
     """
-    return [31-i for i in reversed(list(range(32))) if (mask>>i)&1]
+    n = sum(len(x) + 1 for (x, _) in curves)
+    xs = np.full(n, np.nan)
+    ys = np.full(n, np.nan)
+    i = 0
+    for (x, y) in curves:
+        xs[i:i+len(x)] = x
+        ys[i:i+len(y)] = y
+        i += len(x) + 1
+    return xs, ys
 
 
 class SpadicScope:
     """
     Visualization of SpadicDataMonitor output.
+
+    A background thread collects the latest data of the displayed channels,
+    corrects the jitter and prepares the curves as arrays. The GUI timer
+    only draws the latest prepared frame. If new data arrives faster than
+    the refresh rate of the monitor, only the latest pulse of each channel
+    in each refresh period is displayed.
+
+    channels:    list of channels to display (default: [channel])
+    layout:      'grid' (one plot per channel) or 'overlay' (one plot with
+                 the latest pulse of all channels)
+    persistence: number of pulses shown per channel
+    pedestals:   values subtracted from the samples of each channel, e.g.
+                 the pedestal column of a calibration table (see
+                 calibration.read_table)
     """
-    def __init__(self, spadic_data_monitor, channel=31, fit=0):
+    def __init__(self, spadic_data_monitor, channel=31, fit=0,
+                       channels=None, layout='grid', persistence=10,
+                       pedestals=None):
         self.monitor = spadic_data_monitor
         self.channel = channel # channel 31 has injection
+        self.channels = list(channels) if channels else [channel]
         self.fit = fit
+        self.layout = layout
+        self.persistence = persistence
+        self.pedestals = (None if pedestals is None else
+                          np.nan_to_num(np.asarray(pedestals, float)))
 
         # set white background mode (must be done at the beginning)
         pg.setConfigOption('background', 'w')
@@ -29,78 +65,161 @@ class SpadicScope:
 
         # create window
         self.win = pg.GraphicsWindow()
-        self.win.resize(400, 300)
         self.win.setWindowTitle("SPADIC Data Monitor")
-
-        # create plot and set drawing options
-        self.plot = self.win.addPlot()
-        self.plot.setRange(xRange=(0, 32), yRange=(-256, 256),
-                           disableAutoRange=True)
+        single = len(self.channels) == 1
+        if single:
+            self.win.resize(400, 300)
+        else:
+            self.win.resize(1200, 700)
+
+        # create plots and curves
+        # channel: (history curve, latest curve, residual curve or None)
+        self.curves = {}
+        if layout == 'overlay' or single:
+            plot = self._add_plot()
+            for c in self.channels:
+                if single:
+                    history = plot.plot(connect='finite')
+                    history.setPen(width=1, color=0.5)
+                    latest = plot.plot(antialias=True)
+                    latest.setPen(width=2, color='r')
+                    residual = plot.plot(antialias=True)
+                    residual.setPen(width=1, color='b')
+                else:
+                    history = None
+                    latest = plot.plot(antialias=True)
+                    latest.setPen(width=1, color=pg.intColor(c, 32))
+                    residual = None
+                self.curves[c] = (history, latest, residual)
+        elif layout == 'grid':
+            columns = int(np.ceil(np.sqrt(len(self.channels))))
+            for (i, c) in enumerate(self.channels):
+                if i and not i % columns:
+                    self.win.nextRow()
+                plot = self._add_plot(title='channel %i' % c)
+                history = plot.plot(connect='finite')
+                history.setPen(width=1, color=0.7)
+                latest = plot.plot()
+                latest.setPen(width=1, color='r')
+                self.curves[c] = (history, latest, None)
+        else:
+            raise ValueError('unknown layout: %r' % layout)
+
+        # persistence buffers, filled by the producer thread
+        self.data = {c: collections.deque(maxlen=persistence)
+                     for c in self.channels}
+        self._frame = None # replaced as a whole by the producer
+        self._drawn = {}
+        self.fitter = PulseFitter() if fit else None
+        self._stop = threading.Event()
+        self.producer = threading.Thread(name="scope_producer")
+        self.producer.run = self._produce_task
+        self.producer.daemon = True
+
+    def _add_plot(self, title=None):
+        plot = self.win.addPlot(title=title)
+        plot.setRange(xRange=(0, 32), yRange=(-256, 256),
+                      disableAutoRange=True)
         def ytickspacing(minval, maxval, size):
             return [(128, 0), (64, 0), (32, 0)]
         def xtickspacing(minval, maxval, size):
             return [(8, 0), (4, 0), (1, 0)]
-        self.plot.getAxis('left').tickSpacing = ytickspacing
-        self.plot.getAxis('bottom').tickSpacing = xtickspacing
-        self.plot.showGrid(x=True, y=True, alpha=0.2)
-
-        c = self.plot.plot(antialias=True)
-        c.setPen(width=1, color='b')
-        self.curve_res = c
-        self.curves = []
-        for i in reversed(list(range(10))):
-            curve = self.plot.plot(antialias=True)
-            if i == 0: # generated last -> on top
-                curve.setPen(width=2, color='r')
-            else:
-                curve.setPen(width=1, color=i*0.1)
-            self.curves.insert(0, curve)
-        self.data = []
+        plot.getAxis('left').tickSpacing = ytickspacing
+        plot.getAxis('bottom').tickSpacing = xtickspacing
+        plot.showGrid(x=True, y=True, alpha=0.2)
+        return plot
 
     def run(self):
+        self.producer.start()
         timer = QtCore.QTimer()
-        timer.timeout.connect(self.update_data)
+        timer.timeout.connect(self.update_plot)
         timer.start(self.monitor._period*1000) # milliseconds
         QtGui.QApplication.instance().exec_()
-
-    def correct_jitter(self, data, x0=2):
+        self._stop.set()
+        self.producer.join()
+        if self.fitter:
+            self.fitter.shutdown()
+
+    #----------------------------------------------------------------
+    # producer (background thread)
+    #----------------------------------------------------------------
+    def _produce_task(self):
+        while not self._stop.wait(self.monitor._period):
+            new = self.collect_data()
+            if not new:
+                continue
+            residuals = {}
+            if self.fit:
+                new, residuals = self.correct_jitter(new)
+            for (c, xy) in new.items():
+                self.data[c].appendleft(xy)
+            self._frame = self.make_frame(new, residuals)
+
+    def collect_data(self):
+        """Get the latest data of all displayed channels, if available."""
+        new = {}
+        for c in self.channels:
+            try:
+                (y, mask) = self.monitor.get_last_data(c, block=False)
+            except queue.Empty:
+                continue
+            x = mask_to_x(mask)[:len(y)]
+            y = np.array(y, float)
+            if self.pedestals is not None:
+                y -= self.pedestals[c]
+            new[c] = (np.array(x, float), y)
+        return new
+
+    def correct_jitter(self, new, x0=2):
         """
         Remove horizontal fluctuation of the curves.
 
-        Detect and move the rise of the pulse (b parameter in the model
-        function). By default, the rise of the pulse is moved to position 2.
+        Fit the first samples of all new pulses in one batch and move the
+        rise of each pulse (b parameter of the model function). By default,
+        the rise of the pulse is moved to position 2.
+
+        Return the corrected curves and the fit residuals.
         """
-        if not self.fit:
-            return data
-        x, y = data
-        xfit = x[:self.fit]
-        yfit = y[:self.fit]
-
-        def model(x, a, b, c, t):
-            """
-            Model function of the expected pulse shape.
-
-            t is approximately 2 (shaping time divided by sampling period)
-            """
-            return a * np.maximum((x-b)*np.exp(-(x-b)/t), 0) + c
-
-        popt, _ = scipy.optimize.curve_fit(model, xfit, yfit, p0=[200, 2, -100, 2])
-        print(popt)
-        xcorr = popt[1]-x0
-        fit = model(x, *popt)
-        res = np.array(y)-fit
-        self.curve_res.setData([t-xcorr for t in x], res)
-        return ([t-xcorr for t in x], y)
-
-    def update_data(self):
-        """Display the latest data."""
-        try:
-            (y, mask) = self.monitor.get_last_data(self.channel, block=False)
-        except queue.Empty:
+        channels = list(new)
+        x, _ = samples_array([new[c][0] for c in channels])
+        y, valid = samples_array([new[c][1] for c in channels])
+        popt, res = self.fitter.fit(x, y, valid & (np.arange(32) < self.fit)
+                                   ).result()
+        xcorr = popt[:, 1] - x0
+        corrected = {}
+        residuals = {}
+        for (i, c) in enumerate(channels):
+            x, y = new[c]
+            corrected[c] = (x - xcorr[i], y)
+            residuals[c] = (x - xcorr[i], res[i, :len(x)])
+        return corrected, residuals
+
+    def make_frame(self, new, residuals):
+        """Prepare the curves of all channels with new data, keep the ones of
+        the other channels from the last frame."""
+        frame = dict(self._frame or {})
+        for c in new:
+            history = list(self.data[c])
+            frame[c] = (_join_curves(history[1:]), history[0],
+                        residuals.get(c))
+        return frame
+
+    #----------------------------------------------------------------
+    # rendering (GUI thread)
+    #----------------------------------------------------------------
+    def update_plot(self):
+        """Display the latest prepared frame."""
+        frame = self._frame
+        if frame is None:
             return
-        x = mask_to_x(mask)[:len(y)]
-        newdata = self.correct_jitter((x, y))
-        self.data = [newdata] + self.data[:9]
-        for (i, data) in enumerate(self.data):
-            self.curves[i].setData(*data)
-
+        for (c, entry) in frame.items():
+            if self._drawn.get(c) is entry:
+                continue # not changed
+            history, latest, residual = entry
+            history_curve, latest_curve, residual_curve = self.curves[c]
+            if history_curve is not None:
+                history_curve.setData(*history)
+            latest_curve.setData(*latest)
+            if residual_curve is not None and residual is not None:
+                residual_curve.setData(*residual)
+        self._drawn = frame
@@ -0,0 +1,70 @@
+import contextlib
+import threading
+
+from spadic import SpadicControlClient, SpadicDataClient
+from spadic.control import ConfigSnapshot
+
+
+class SpadicSession:
+    """
+    Control client and data clients of both groups of a SpadicServer, with
+    one reader thread per group, for runs that change the configuration
+    and collect data (see SpadicScan, SpadicCalibration).
+
+    Subclasses handle the received messages in _received, which is called
+    by the reader threads as soon as the session is created, so everything
+    it uses must be set up before SpadicSession.__init__ is called.
+    """
+    name = 'session' # used in the names of the reader threads
+
+    def __init__(self, host, port_base=None):
+        self.ctrl_client = SpadicControlClient(host, port_base)
+        self.control = self.ctrl_client.control
+        self._clients = {g: SpadicDataClient(g, host, port_base)
+                         for g in 'AB'}
+
+        self._stop = threading.Event()
+        self._threads = []
+        for g in 'AB':
+            t = threading.Thread(name='group%s %s reader' % (g, self.name))
+            t.run = self._read_task(g)
+            t.daemon = True
+            self._threads.append(t)
+            t.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        for t in self._threads:
+            while t.is_alive():
+                t.join(timeout=1)
+        for c in self._clients.values():
+            c.__exit__()
+        self.ctrl_client.__exit__()
+
+    def _read_task(self, group):
+        client = self._clients[group]
+        def read_task():
+            while not self._stop.is_set():
+                messages = client.read_messages(timeout=0.05)
+                if messages:
+                    self._received(group, messages)
+        return read_task
+
+    def _received(self, group, messages):
+        """Handle a batch of raw messages of the given group."""
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def _restored(self):
+        """Context manager restoring the current configuration at the
+        end."""
+        self.control.update()
+        original = ConfigSnapshot(self.control.registerfile.get(),
+                                  self.control.shiftregister.get())
+        try:
+            yield original
+        finally:
+            self.control.configure(original)
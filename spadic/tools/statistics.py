@@ -0,0 +1,149 @@
+import numpy as np
+import threading
+
+from spadic.message import Message
+
+NUM_CHANNELS = 32
+SAMPLE_MIN, SAMPLE_MAX = -256, 255 # 9 bit samples
+NUM_BINS = SAMPLE_MAX - SAMPLE_MIN + 1
+
+
+def samples_array(data, length=32):
+    """
+    Convert a list of sample lists to a 2D array padded with zeros and an
+    array of the same shape telling which samples are valid.
+
+    >>> s, valid = samples_array([[1, 2], [3]], length=3)
+    >>> s.tolist(), valid.tolist()
+    ([[1, 2, 0], [3, 0, 0]], [[True, True, False], [True, False, False]])
+    """
+    num = np.fromiter((len(d) for d in data), int, len(data))
+    num = np.minimum(num, length)
+    valid = np.arange(length) < num[:, np.newaxis]
+    samples = np.zeros((len(data), length), int)
+    samples[valid] = np.fromiter((x for (d, n) in zip(data, num)
+                                    for x in d[:n]), int, num.sum())
+    return samples, valid
+
+def hit_data(messages, group='A'):
+    """
+    Return the channels and the samples (list of sample lists) of the hit
+    messages among raw messages (lists of words) of the given group.
+
+    >>> hit_data([[0x8003, 0x9000, 0xA000, 0x7000, 0xB040], [0xF000]], 'B')
+    ([19], [[0]])
+    """
+    offset = {'A': 0, 'B': 16}[group.upper()]
+    messages = [m for m in messages if (m[0] & 0xF000) == 0x8000]
+    channels = [(m[0] & 0x000F) + offset for m in messages]
+    return channels, [Message(m).data() for m in messages]
+
+
+class PulseStatistics:
+    """
+    Per-channel running statistics of the received pulses.
+
+    For each channel, the following quantities are accumulated:
+    - baseline: mean of the first `baseline_samples` samples of a pulse
+    - noise:    RMS of these samples around the baseline
+    - amplitude: maximum sample minus baseline
+    - histograms of all samples and of the maximum samples, with one bin
+      per possible sample value (-256..255)
+
+    Pulses with less than `baseline_samples` samples are only used for the
+    sample histogram. The data is added in batches (see add_messages or
+    add_data), snapshot() can be called at any time.
+
+    >>> s = PulseStatistics(baseline_samples=2)
+    >>> s.add_data([3, 3], [[-100, -102, 50, 0], [-98, -96, 10]])
+    >>> r = s.snapshot()
+    >>> [float(r[k][3]) for k in ['count', 'baseline', 'noise', 'amplitude']]
+    [2.0, -99.0, 1.0, 129.0]
+    >>> int(r['sample_histogram'][3].sum()), int(r['peak_histogram'][3][306])
+    (7, 1)
+    """
+    def __init__(self, baseline_samples=4):
+        self.baseline_samples = baseline_samples
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discard all accumulated data."""
+        with self._lock:
+            self._count = np.zeros(NUM_CHANNELS, int)
+            self._baseline_sum = np.zeros(NUM_CHANNELS)
+            self._noise_n = np.zeros(NUM_CHANNELS, int)
+            self._noise_sum2 = np.zeros(NUM_CHANNELS)
+            self._amplitude_sum = np.zeros(NUM_CHANNELS)
+            self._amplitude_sum2 = np.zeros(NUM_CHANNELS)
+            self._sample_hist = np.zeros((NUM_CHANNELS, NUM_BINS), int)
+            self._peak_hist = np.zeros((NUM_CHANNELS, NUM_BINS), int)
+
+    def add_messages(self, messages, group='A'):
+        """
+        Add a batch of raw messages (lists of words) of the given group.
+
+        Can be used as a SpadicDataMonitor listener.
+        """
+        self.add_data(*hit_data(messages, group))
+
+    def add_data(self, channels, data):
+        """Add a batch of pulses (lists of samples) of the given channels."""
+        if not len(data):
+            return
+        channels = np.asarray(channels, int)
+        samples, valid = samples_array(data)
+        sample_bins = samples - SAMPLE_MIN
+
+        nb = self.baseline_samples
+        full = valid[:, nb-1] if nb else np.ones(len(data), bool)
+        ch = channels[full]
+        base_samples = samples[full, :nb]
+        baseline = base_samples.mean(axis=1) if nb else np.zeros(len(ch))
+        peak = np.where(valid, samples, SAMPLE_MIN)[full].max(axis=1)
+        amplitude = peak - baseline
+        dev2 = ((base_samples - baseline[:, np.newaxis])**2).sum(axis=1)
+
+        def per_channel(weights=None):
+            return np.bincount(ch, weights, minlength=NUM_CHANNELS)
+
+        with self._lock:
+            self._count += per_channel()
+            self._baseline_sum += per_channel(baseline)
+            self._noise_n += per_channel() * nb
+            self._noise_sum2 += per_channel(dev2)
+            self._amplitude_sum += per_channel(amplitude)
+            self._amplitude_sum2 += per_channel(amplitude**2)
+            np.add.at(self._sample_hist,
+                      (np.broadcast_to(channels[:, np.newaxis],
+                                       samples.shape)[valid],
+                       sample_bins[valid]), 1)
+            np.add.at(self._peak_hist, (ch, peak - SAMPLE_MIN), 1)
+
+    def snapshot(self):
+        """
+        Return the current statistics as a dictionary of arrays with one
+        entry per channel (NaN where there is no data).
+        """
+        with self._lock:
+            n = self._count.copy()
+            baseline_sum = self._baseline_sum.copy()
+            noise_n = self._noise_n.copy()
+            noise_sum2 = self._noise_sum2.copy()
+            amplitude_sum = self._amplitude_sum.copy()
+            amplitude_sum2 = self._amplitude_sum2.copy()
+            sample_hist = self._sample_hist.copy()
+            peak_hist = self._peak_hist.copy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            amplitude = amplitude_sum / n
+            return {
+                'count':            n,
+                'baseline':         baseline_sum / n,
+                'noise':            np.sqrt(noise_sum2 / noise_n),
+                'amplitude':        amplitude,
+                'amplitude_rms':    np.sqrt(np.maximum(
+                                        amplitude_sum2 / n - amplitude**2, 0)),
+                'sample_histogram': sample_hist,
+                'peak_histogram':   peak_hist,
+                'bins':             np.arange(SAMPLE_MIN, SAMPLE_MAX + 1),
+            }
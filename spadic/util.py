@@ -1,7 +1,9 @@
-from collections import defaultdict
+from array import array
+from collections import defaultdict, deque
 import logging
 import queue
 import threading
+import time
 
 
 class IndexQueue:
@@ -30,6 +32,190 @@ class IndexQueue:
             self.data[key].get()
 
 
+class OverflowQueue(queue.Queue):
+    """Queue with a selectable policy for items put into it while it is full.
+
+    Overflow policies:
+    'block'       - wait until there is space (the default of queue.Queue)
+    'drop_newest' - discard the new item
+    'drop_oldest' - discard the oldest item in the queue
+
+    Each time an item is put while the queue is full, the `overflows`
+    attribute is incremented and `on_overflow` is called, if given. The
+    number of discarded items is counted in the `dropped` attribute, and
+    `on_drop` is called with each discarded item, if given.
+
+    >>> dropped = []
+    >>> q = OverflowQueue(maxsize=2, overflow='drop_oldest',
+    ...                   on_drop=dropped.append)
+    >>> for i in range(5):
+    ...     q.put(i)
+    >>> q.get(), q.get(), q.dropped, dropped
+    (3, 4, 3, [0, 1, 2])
+    """
+    OVERFLOW_POLICIES = ['block', 'drop_newest', 'drop_oldest']
+
+    def __init__(self, maxsize=0, overflow='block', on_overflow=None,
+                       on_drop=None):
+        if not overflow in self.OVERFLOW_POLICIES:
+            raise ValueError('unknown overflow policy: %r' % overflow)
+        queue.Queue.__init__(self, maxsize)
+        self.overflow = overflow
+        self.overflows = 0
+        self.dropped = 0
+        self._on_overflow = on_overflow
+        self._times = deque() # (write position after put, time of put)
+        self._on_drop = on_drop
+
+    def _count_overflow(self):
+        self.overflows += 1
+        if self._on_overflow:
+            self._on_overflow()
+
+    def put(self, item, block=True, timeout=None):
+        if self.maxsize <= 0:
+            return queue.Queue.put(self, item, block, timeout)
+        if self.overflow == 'block':
+            if self.full():
+                self._count_overflow()
+            return queue.Queue.put(self, item, block, timeout)
+        with self.not_full:
+            if self._qsize() >= self.maxsize:
+                self._count_overflow()
+                self.dropped += 1
+                if self.overflow == 'drop_newest':
+                    if self._on_drop:
+                        self._on_drop(item)
+                    return
+                oldest = self._get()
+                self.unfinished_tasks -= 1
+                if self._on_drop:
+                    self._on_drop(oldest)
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
+class WordRingBuffer:
+    """Preallocated ring buffer of 16-bit words for exactly one producer and
+    one consumer thread.
+
+    The producer only advances the write position after copying the words,
+    and the consumer only advances the read position after copying them
+    out, so no lock is needed. The consumer waits for data by polling.
+
+    Overflow policies (see OverflowQueue, 'drop_oldest' is not possible
+    without a lock):
+    'block'       - wait until there is space
+    'drop_newest' - discard the new words
+
+    `overflows` counts the calls of put (or drop) whose words were
+    discarded, `dropped` counts the discarded words. Waiting for space
+    with the 'block' policy is not an overflow.
+
+    >>> r = WordRingBuffer(4, overflow='drop_newest')
+    >>> r.put([1, 2, 3]), r.put([4, 5]), r.put([4])
+    (True, False, True)
+    >>> list(r.get()), len(r), r.dropped
+    ([1, 2, 3, 4], 0, 2)
+    >>> r.put([5, 6, 7])
+    True
+    >>> list(r.get(max_words=2)), list(r.get())
+    ([5, 6], [7])
+
+    With `timed`, get also returns the time at which the first of the
+    returned words was put:
+
+    >>> r.put([8, 9])
+    True
+    >>> t, words = r.get(timed=True)
+    >>> list(words), abs(t - time.time()) < 1
+    ([8, 9], True)
+    """
+    OVERFLOW_POLICIES = ['block', 'drop_newest']
+    POLL_INTERVAL = 0.001
+
+    def __init__(self, capacity, overflow='block', on_overflow=None):
+        if not overflow in self.OVERFLOW_POLICIES:
+            raise ValueError('unknown overflow policy: %r' % overflow)
+        self._data = array('H', bytes(2 * capacity))
+        self._capacity = capacity
+        self._write_pos = 0 # total number of words written
+        self._read_pos = 0  # total number of words read
+        self.overflow = overflow
+        self.overflows = 0
+        self.dropped = 0
+        self._on_overflow = on_overflow
+        self._times = deque() # (write position after put, time of put)
+
+    def __len__(self):
+        """Number of words available for reading."""
+        return self._write_pos - self._read_pos
+
+    def put(self, words, timeout=None):
+        """Append the words (an array('H') or a sequence of integers).
+
+        Return True if the words were written, or False if they were
+        discarded, or if there was no space within the timeout (only with
+        the 'block' overflow policy).
+        """
+        n = len(words)
+        if self._capacity - len(self) < n:
+            if self.overflow == 'drop_newest' or n > self._capacity:
+                self.drop(words)
+                return False
+            end = None if timeout is None else time.time() + timeout
+            while self._capacity - len(self) < n:
+                if end is not None and time.time() > end:
+                    return False
+                time.sleep(self.POLL_INTERVAL)
+        if not isinstance(words, array):
+            words = array('H', words)
+        start = self._write_pos % self._capacity
+        first = min(n, self._capacity - start)
+        self._data[start:start+first] = words[:first]
+        self._data[:n-first] = words[first:]
+        self._times.append((self._write_pos + n, time.time()))
+        self._write_pos += n # publish
+        return True
+
+    def drop(self, words):
+        """Discard the words, e.g. if they could not be put in time."""
+        self.overflows += 1
+        self.dropped += len(words)
+        if self._on_overflow:
+            self._on_overflow()
+
+    def get(self, max_words=None, timeout=None, timed=False):
+        """Remove and return all available words (at most max_words) as an
+        array('H'), or if timed, a tuple (time, words) with the time at
+        which the first of the words was put.
+
+        Wait up to timeout seconds (forever if None) for words to become
+        available, return None if there are none.
+        """
+        if not len(self):
+            end = None if timeout is None else time.time() + timeout
+            while not len(self):
+                if end is not None and time.time() > end:
+                    return None
+                time.sleep(self.POLL_INTERVAL)
+        n = len(self)
+        if max_words is not None:
+            n = min(n, max_words)
+        start = self._read_pos % self._capacity
+        first = min(n, self._capacity - start)
+        words = self._data[start:start+first] + self._data[:n-first]
+        times = self._times
+        while times[0][0] <= self._read_pos:
+            times.popleft()
+        t = times[0][1]
+        self._read_pos += n # release
+        while times and times[0][0] <= self._read_pos:
+            times.popleft()
+        return (t, words) if timed else words
+
+
 class InfiniteSemaphore:
     "Fake a threading.Semaphore with infinite capacity."
     def acquire(self, blocking=None):